@@ -21,7 +21,8 @@ tests_require = [
     'coverage',
     'pytest-cov',
     'pytest-mock',
-    'fakeredis',
+    'fakeredis[lua]',
+    'aiosmtpd',
     'flake8',
     'mypy',
 ]
@@ -72,6 +73,7 @@ setup(
         'Operating System :: OS Independent',
     ],
     extras_require={
+        'msgpack': ['msgpack'],
         'testing': tests_require,
     },
 )
@@ -1,39 +1,157 @@
-"""Command line handling"""
+"""Command line handling
+
+Subcommand modules are only imported when their subcommand is run. All other
+subcommands get a stub parser built from SUBCOMMANDS, which is enough for the
+top-level help and for picking the subcommand from the command line.
+"""
 
 import argparse
+import importlib
+import sys
+from typing import Any, Dict, Optional, Sequence
+
 from envparse import Env
 
 from . import __version__
 from .common import run_command
-from .storage import get_storage
-from . import (
-    control,
-    job,
-    notice,
+from .storage import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_RETRIES,
+    DEFAULT_RETRY_BACKOFF,
+    DEFAULT_SCAN_COUNT,
+    get_async_storage,
+    get_storage,
 )
 
 
-def main():
-    """Run smashctl"""
+# subcommand name: (module registering it, help text)
+SUBCOMMANDS = {
+    'batch': ('shell', 'Run smashctl commands from a file over one connection'),
+    'control': ('control', 'Show and manipulate dispatchers'),
+    'dump': ('snapshot', 'Write jobs, queues, dispatchers and notices to a snapshot file'),
+    'exporter': ('exporter', 'Serve Prometheus metrics over HTTP'),
+    'history': ('history', 'Query the history of finished jobs'),
+    'index': ('index', 'Maintain the secondary job indexes'),
+    'job': ('job', 'Show and manipulate jobs'),
+    'load': ('snapshot', 'Restore a snapshot written by dump'),
+    'notice': ('notice', 'Show and control notifications'),
+    'shell': ('shell', 'Run smashctl commands interactively over one connection'),
+    'stats': ('stats', 'Show queue lengths and job counts'),
+    'top': ('top', 'Show a live overview of dispatchers and queues'),
+}
+
 
-    env = Env(
+def _get_env() -> Env:
+    """Get the environment settings"""
+    return Env(
         # Redis DB to contact
         SMASHCTL_REDIS=dict(cast=str, default='redis://localhost:6379/0'),
         SMASHCTL_BASEURL=dict(cast=str, default='https://antismash/secondarymetabolites.org/'),
+        # Local archive of finished jobs removed from Redis
+        SMASHCTL_ARCHIVE=dict(cast=str, default='~/.local/share/smashctl/jobs-archive.jsonl'),
+        # Local SQLite database with the history of finished jobs
+        SMASHCTL_HISTORY=dict(cast=str, default='~/.local/share/smashctl/history.sqlite'),
+        # Number of objects to fetch from Redis per pipelined round trip
+        SMASHCTL_CHUNK_SIZE=dict(cast=int, default=DEFAULT_CHUNK_SIZE),
+        # COUNT hint used when walking the keyspace with SCAN
+        SMASHCTL_SCAN_COUNT=dict(cast=int, default=DEFAULT_SCAN_COUNT),
+        # Seconds to wait for a Redis reply and for a new connection
+        SMASHCTL_SOCKET_TIMEOUT=dict(cast=float, default=30.0),
+        SMASHCTL_CONNECT_TIMEOUT=dict(cast=float, default=5.0),
+        # Seconds after which an idle connection is checked with PING before it is used
+        SMASHCTL_HEALTH_CHECK_INTERVAL=dict(cast=int, default=30),
+        # Maximum number of pooled Redis connections, 0 for the redis-py default
+        SMASHCTL_MAX_CONNECTIONS=dict(cast=int, default=0),
+        # Retries of failed reads, and the seconds to wait before the first one
+        SMASHCTL_RETRIES=dict(cast=int, default=DEFAULT_RETRIES),
+        SMASHCTL_RETRY_BACKOFF=dict(cast=float, default=DEFAULT_RETRY_BACKOFF),
     )
 
-    parser = argparse.ArgumentParser(prog='smashctl')
+
+def _storage_options(env: Env) -> Dict[str, Any]:
+    """Get the connection pool and retry options for get_storage from the environment"""
+    return {
+        'socket_timeout': env('SMASHCTL_SOCKET_TIMEOUT'),
+        'socket_connect_timeout': env('SMASHCTL_CONNECT_TIMEOUT'),
+        'health_check_interval': env('SMASHCTL_HEALTH_CHECK_INTERVAL'),
+        'max_connections': env('SMASHCTL_MAX_CONNECTIONS') or None,
+        'retries': env('SMASHCTL_RETRIES'),
+        'retry_backoff': env('SMASHCTL_RETRY_BACKOFF'),
+    }
+
+
+def _base_parser(env: Env, add_help: bool = True) -> argparse.ArgumentParser:
+    """Create a parser with the global options"""
+    parser = argparse.ArgumentParser(prog='smashctl', add_help=add_help)
     parser.add_argument('--db', default=env('SMASHCTL_REDIS'),
                         help="Redis database to contact (default: %(default)s)")
+    parser.add_argument('--chunk-size', type=int, default=env('SMASHCTL_CHUNK_SIZE'),
+                        help="Number of objects to fetch per Redis round trip (default: %(default)s)")
+    parser.add_argument('--scan-count', type=int, default=env('SMASHCTL_SCAN_COUNT'),
+                        help="COUNT hint for incremental key scans (default: %(default)s)")
+    parser.add_argument('--archive', default=env('SMASHCTL_ARCHIVE'),
+                        help="Archive file for finished jobs (default: %(default)s)")
+    parser.add_argument('--history', default=env('SMASHCTL_HISTORY'),
+                        help="History database of finished jobs (default: %(default)s)")
+    parser.add_argument('--async', dest='use_async', action='store_true', default=False,
+                        help="Use the asyncio Redis client for commands that support it")
     parser.add_argument('-V', '--version', action='version', version=__version__)
+    return parser
+
+
+def find_subcommand(argv: Sequence[str], env: Optional[Env] = None) -> Optional[str]:
+    """Find the subcommand chosen on a command line without importing any subcommand"""
+    parser = _base_parser(env or _get_env(), add_help=False)
+    subparsers = parser.add_subparsers(title='subcommands')
+    for name in SUBCOMMANDS:
+        stub = subparsers.add_parser(name, add_help=False)
+        stub.add_argument('rest', nargs=argparse.REMAINDER)
+        stub.set_defaults(subcommand=name)
+    args, _ = parser.parse_known_args(argv)
+    return getattr(args, 'subcommand', None)
+
+
+def build_parser(argv: Sequence[str], env: Optional[Env] = None) -> argparse.ArgumentParser:
+    """Build the argument parser for a command line
+
+    Only the module of the chosen subcommand is imported and registered.
+
+    :param argv: The command line arguments, without the program name
+    :param env: Environment settings providing the defaults of the global options
+    """
+    env = env or _get_env()
+    chosen = find_subcommand(argv, env)
+    chosen_module = SUBCOMMANDS[chosen][0] if chosen else None
 
+    parser = _base_parser(env)
     subparsers = parser.add_subparsers(title='subcommands')
-    control.register(subparsers)
-    job.register(subparsers)
-    notice.register(subparsers)
+    registered = False
+    for name, (module_name, help_text) in SUBCOMMANDS.items():
+        if module_name != chosen_module:
+            subparsers.add_parser(name, help=help_text)
+        elif not registered:
+            # a module registers all of its subcommands at once
+            importlib.import_module(f".{module_name}", __package__).register(subparsers)
+            registered = True
+    return parser
+
+
+def main():
+    """Run smashctl"""
+    argv = sys.argv[1:]
+    env = _get_env()
+    parser = build_parser(argv, env)
+    args = parser.parse_args(argv)
+    if not hasattr(args, 'func'):
+        parser.print_help()
+        return
+
+    async_func = getattr(args, 'async_func', None)
+    if args.use_async and async_func is not None:
+        run_command(async_func, args, get_async_storage(args.db, **_storage_options(env)))
+        return
 
-    args = parser.parse_args()
-    store = get_storage(args.db)
+    store = get_storage(args.db, **_storage_options(env))
     run_command(args.func, args, store)
 
 
@@ -0,0 +1,110 @@
+"""Local archive of finished jobs
+
+Archived jobs are appended to a JSON lines file, one line per job holding the raw
+fields of its hash. A dbm file next to it maps job IDs to the offsets of their lines,
+so single jobs can be looked up without reading the whole archive. If a job is archived
+more than once, the index points at the latest copy.
+"""
+
+import dbm
+import json
+import os
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from .common import AntismashRunError
+
+
+INDEX_SUFFIX = ".idx"
+
+
+class JobArchive:
+    """An append-only archive file of job hashes with an index of their offsets"""
+    __slots__ = (
+        'index_path',
+        'path',
+    )
+
+    def __init__(self, path: str) -> None:
+        self.path = os.path.expanduser(path)
+        self.index_path = self.path + INDEX_SUFFIX
+
+    def append(self, jobs: Iterable[Tuple[str, Dict[str, str]]]) -> int:
+        """Append jobs to the archive
+
+        The lines are synced to disk before the index is updated and before this returns,
+        so jobs can safely be removed from the database afterwards.
+
+        :param jobs: Pairs of job IDs and the fields of their hashes
+        :return: The number of archived jobs
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        offsets: Dict[str, int] = {}
+        with open(self.path, "ab") as handle:
+            for job_id, fields in jobs:
+                offsets[job_id] = handle.tell()
+                line = json.dumps({"job_id": job_id, "fields": fields}, sort_keys=True)
+                handle.write(line.encode("utf-8") + b"\n")
+            handle.flush()
+            os.fsync(handle.fileno())
+
+        if offsets:
+            with dbm.open(self.index_path, "c") as index:
+                for job_id, offset in offsets.items():
+                    index[job_id] = str(offset)
+        return len(offsets)
+
+    def get(self, job_id: str) -> Optional[Dict[str, str]]:
+        """Look up the fields of an archived job, None if it isn't in the archive"""
+        try:
+            with dbm.open(self.index_path, "r") as index:
+                offset = index.get(job_id)
+        except dbm.error:
+            return None
+        if offset is None:
+            return None
+
+        with open(self.path, "rb") as handle:
+            handle.seek(int(offset))
+            line = handle.readline()
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = {}
+        if record.get("job_id") != job_id:
+            raise ValueError(f"Archive index {self.index_path} doesn't match {self.path}")
+        return record["fields"]
+
+    def read_from(self, offset: int = 0) -> Iterator[Tuple[int, str, Dict[str, str]]]:
+        """Iterate over the archived jobs starting at a byte offset
+
+        A last line without a newline is still being written and ends the iteration,
+        it is read once it is complete.
+
+        :return: The offset after each job's line, the job ID and its fields
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as handle:
+            handle.seek(offset)
+            for line in handle:
+                if not line.endswith(b"\n"):
+                    return
+                if line.strip():
+                    try:
+                        record = json.loads(line)
+                        job_id, fields = record["job_id"], record["fields"]
+                    except (ValueError, KeyError, TypeError) as err:
+                        raise AntismashRunError(f"Corrupt archive {self.path} at offset "
+                                                f"{offset}: {err!r}")
+                    offset += len(line)
+                    yield offset, job_id, fields
+                else:
+                    offset += len(line)
+
+    def __iter__(self) -> Iterator[Tuple[str, Dict[str, str]]]:
+        """Iterate over all archived jobs in the order they were archived"""
+        for _, job_id, fields in self.read_from():
+            yield job_id, fields
@@ -1,14 +1,28 @@
 """Common functions"""
 import argparse
+import asyncio
+from datetime import datetime, timedelta, UTC
+import inspect
+import re
 import sys
-from typing import Callable
+from typing import Any, Awaitable, Callable, Iterable, Optional, Union
 
 from redis import Redis
 
 from .storage import AntismashStorageError
 
 
-CommandFunc = Callable[[argparse.Namespace, Redis], str]
+DURATION_UNITS = {
+    "s": 1,
+    "m": 60,
+    "h": 60 * 60,
+    "d": 24 * 60 * 60,
+    "w": 7 * 24 * 60 * 60,
+}
+DURATION_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)([smhdw]?)$")
+
+CommandResult = Optional[Union[str, Iterable[Union[str, bytes]]]]
+CommandFunc = Callable[[argparse.Namespace, Redis], Union[CommandResult, Awaitable[CommandResult]]]
 
 
 class AntismashRunError(RuntimeError):
@@ -17,23 +31,84 @@ class AntismashRunError(RuntimeError):
 
 
 def run_command(func, args, storage):
-    """Run a smashctl command
+    """Run a smashctl command, exiting with an error code if it fails
 
     :param func: Function to run
     :param args: Namespace object with command line args
     :param storage: A Redis instance connected to the database
+
+    Commands can either return their complete output as a string, or an iterable of
+    lines that are written out as they are generated. Items of the iterable that are
+    bytes are written to the binary stdout as they are, without a newline. Coroutine
+    commands are run to completion on a new event loop, closing the storage connection
+    afterwards. Commands returning None have no output.
     """
+    if not execute_command(func, args, storage):
+        sys.exit(1)
+
+
+def execute_command(func, args, storage) -> bool:
+    """Run a smashctl command like run_command, but report errors without exiting
 
+    :return: True if the command succeeded, False if it failed
+    """
     try:
-        print(func(args, storage))
+        result = func(args, storage)
+        if inspect.isawaitable(result):
+            result = asyncio.run(_await_command(result, storage))
+        if result is None:
+            return True
+        if isinstance(result, str):
+            print(result)
+        else:
+            for line in result:
+                if isinstance(line, bytes):
+                    sys.stdout.flush()
+                    sys.stdout.buffer.write(line)
+                else:
+                    print(line)
     except (AntismashRunError, AntismashStorageError) as e:
         print("ERROR: ", e, file=sys.stderr)
-        sys.exit(1)
+        return False
+    return True
+
+
+async def _await_command(result: Awaitable[CommandResult], storage: Any) -> CommandResult:
+    """Wait for a coroutine command, then close the asyncio storage connection"""
+    try:
+        return await result
+    finally:
+        await storage.aclose()
 
 
 def default_action(func: CommandFunc, **kwargs) -> CommandFunc:
-    def new_func(args: argparse.Namespace, storage: Redis) -> str:
+    def new_func(args: argparse.Namespace, storage: Redis) -> CommandResult:
         for name, value in kwargs.items():
             setattr(args, name, value)
         return func(args, storage)
     return new_func
+
+
+def parse_duration(value: str) -> timedelta:
+    """Parse a duration like 90s, 15m, 6h, 30d or 2w, plain numbers are seconds"""
+    match = DURATION_PATTERN.match(value.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(f"{value!r} can not be parsed as a duration")
+    amount, unit = match.groups()
+    return timedelta(seconds=float(amount) * DURATION_UNITS[unit or "s"])
+
+
+def parse_time(value: str) -> datetime:
+    """Parse a point in time, either as a UTC date or as a duration before now
+
+    Accepts YYYY-MM-DD HH:MM:SS, YYYY-MM-DD or any duration understood by parse_duration.
+    """
+    for date_format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, date_format).replace(tzinfo=UTC)
+        except ValueError:
+            pass
+    try:
+        return datetime.now(UTC) - parse_duration(value)
+    except argparse.ArgumentTypeError:
+        raise argparse.ArgumentTypeError(f"{value!r} can not be parsed as a date or duration")
@@ -1,10 +1,27 @@
 """dispatcher control logic"""
 
 import argparse
+import asyncio
 from typing import List
 
-from antismash_models import SyncControl as Control
+from antismash_models import AsyncControl, SyncControl as Control
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+
+from .common import CommandResult
+from .formats import add_format_argument, serialize
+from .storage import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_SCAN_COUNT,
+    async_fetch_in_batches,
+    async_scan_keys,
+    fetch_in_batches,
+    get_retry_policy,
+    scan_keys,
+)
+
+
+CONTROL_FIELDS = Control.ATTRIBUTES
 
 
 def register(subparsers: "argparse._SubParsersAction[argparse.ArgumentParser]"):  # pragma: no cover
@@ -18,55 +35,82 @@ def register(subparsers: "argparse._SubParsersAction[argparse.ArgumentParser]"):
                                 dest="pretty", default="standard",
                                 choices=["simple", "standard"],
                                 help="Modify the output style")
-    p_control_list.set_defaults(func=control_list)
+    add_format_argument(p_control_list)
+    p_control_list.set_defaults(func=control_list, async_func=async_control_list)
 
     p_control_stop = control_subparsers.add_parser("stop", help="Stop dispatcher(s)")
     p_control_stop.add_argument("names", nargs="+", metavar="name",
                                 help="Name(s) of dispatcher(s) to stop ('all' to stop everything)")
-    p_control_stop.set_defaults(func=control_stop)
-
-
-def control_list(args: argparse.Namespace, storage: Redis) -> str:
-    """List running dispatchers"""
-    lines: List[str] = []
-    dispatcher_ids = _get_all_dispatcher_names(storage)
-    for dispatcher_id in dispatcher_ids:
-        d: Control = Control(storage, dispatcher_id, 0).fetch()  # type: ignore
-
-        if args.pretty == "simple":
-            lines.append(
-                "\t".join([
-                    f"{d.name:<16}",
-                    f"{d.stop_scheduled}",
-                    d.status,
-                    d.version,
-                    f"{d.max_jobs}",
-                    f"{d.running_jobs}",
-                ])
-            )
-            continue
-
-        lines.append(f"""{d.name}
+    p_control_stop.set_defaults(func=control_stop, async_func=async_control_stop)
+
+
+def _format_control(d: Control, pretty: str) -> str:
+    """Format a dispatcher for printing"""
+    if pretty == "simple":
+        return "\t".join([
+            f"{d.name:<16}",
+            f"{d.stop_scheduled}",
+            d.status,
+            d.version,
+            f"{d.max_jobs}",
+            f"{d.running_jobs}",
+        ])
+
+    return f"""{d.name}
     running: {d.running}
     stopping: {d.stop_scheduled}
     status: {d.status}
     version: {d.version}
     max_jobs: {d.max_jobs}
-    running_jobs: {d.running_jobs}""")
+    running_jobs: {d.running_jobs}"""
+
+
+def control_list(args: argparse.Namespace, storage: Redis) -> CommandResult:
+    """List running dispatchers"""
+    dispatcher_ids = _get_all_dispatcher_names(storage,
+                                               getattr(args, "scan_count", DEFAULT_SCAN_COUNT))
+
+    output_format = getattr(args, "format", None)
+    if output_format:
+        dispatchers = fetch_in_batches(storage, lambda name: Control(storage, name, 0),
+                                       dispatcher_ids,
+                                       getattr(args, "chunk_size", DEFAULT_CHUNK_SIZE))
+        return serialize(dispatchers, output_format, CONTROL_FIELDS)
+
+    lines: List[str] = []
+    for dispatcher_id in dispatcher_ids:
+        d: Control = get_retry_policy(storage).call(Control(storage, dispatcher_id, 0).fetch)
+        lines.append(_format_control(d, args.pretty))
 
     return "\n".join(lines)
 
 
+async def async_control_list(args: argparse.Namespace, storage: AsyncRedis) -> CommandResult:
+    """List running dispatchers, fetching them concurrently"""
+    dispatcher_ids = await _async_get_all_dispatcher_names(
+        storage, getattr(args, "scan_count", DEFAULT_SCAN_COUNT))
+    dispatchers = await async_fetch_in_batches(
+        storage, lambda name: AsyncControl(storage, name, 0), dispatcher_ids,
+        getattr(args, "chunk_size", DEFAULT_CHUNK_SIZE))
+
+    output_format = getattr(args, "format", None)
+    if output_format:
+        return list(serialize(dispatchers, output_format, CONTROL_FIELDS))
+
+    return "\n".join(_format_control(d, args.pretty) for d in dispatchers)
+
+
 def control_stop(args: argparse.Namespace, storage: Redis) -> str:
     """Stop dispatcher(s)"""
     output: List[str] = []
 
     if "all" in args.names:
-        args.names = _get_all_dispatcher_names(storage)
+        args.names = _get_all_dispatcher_names(storage,
+                                               getattr(args, "scan_count", DEFAULT_SCAN_COUNT))
 
     for dispatcher_id in args.names:
         try:
-            d = Control(storage, dispatcher_id, 0).fetch()  # type: ignore
+            d = get_retry_policy(storage).call(Control(storage, dispatcher_id, 0).fetch)
             d.stop_scheduled = True
             d.commit()
             output.append(f"Stopping dispatcher {dispatcher_id}")
@@ -76,6 +120,32 @@ def control_stop(args: argparse.Namespace, storage: Redis) -> str:
     return "\n".join(output)
 
 
-def _get_all_dispatcher_names(storage: Redis) -> List[str]:
+async def async_control_stop(args: argparse.Namespace, storage: AsyncRedis) -> str:
+    """Stop dispatcher(s), sending the stop requests concurrently"""
+    if "all" in args.names:
+        args.names = await _async_get_all_dispatcher_names(
+            storage, getattr(args, "scan_count", DEFAULT_SCAN_COUNT))
+
+    async def stop(dispatcher_id: str) -> str:
+        try:
+            d = await AsyncControl(storage, dispatcher_id, 0).fetch()  # type: ignore
+            d.stop_scheduled = True
+            await d.commit()
+            return f"Stopping dispatcher {dispatcher_id}"
+        except ValueError:
+            return f"Skipping noexistent dispatcher {dispatcher_id}"
+
+    return "\n".join(await asyncio.gather(*map(stop, args.names)))
+
+
+def _get_all_dispatcher_names(storage: Redis, scan_count: int = DEFAULT_SCAN_COUNT) -> List[str]:
+    """Get all dispatcher names, sorted"""
+    keys = scan_keys(storage, "control:*", scan_count)
+    return sorted(set(map(lambda x: x.split(":", 1)[-1], keys)))
+
+
+async def _async_get_all_dispatcher_names(storage: AsyncRedis,
+                                          scan_count: int = DEFAULT_SCAN_COUNT) -> List[str]:
     """Get all dispatcher names, sorted"""
-    return list(map(lambda x: x.split(":")[-1], sorted(storage.keys("control:*"))))
+    keys = [key async for key in async_scan_keys(storage, "control:*", scan_count)]
+    return sorted(set(map(lambda x: x.split(":", 1)[-1], keys)))
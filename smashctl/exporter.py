@@ -0,0 +1,269 @@
+"""Prometheus metrics exporter
+
+Metrics are collected by a background thread on a single Redis connection and cached,
+so scrapes are answered from memory and never reach Redis.
+"""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from antismash_models import SyncControl as Control, SyncNotice as Notice
+from redis import Redis
+
+from .index import to_timestamp
+from .storage import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_SCAN_COUNT,
+    QUEUES,
+    fetch_in_batches,
+    scan_keys,
+)
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+METRICS_PATH = "/metrics"
+# fixed label values for the dispatcher state, the free-text status isn't used as a label
+DISPATCHER_STATES = ('running', 'stopping', 'stopped')
+# cached metrics older than this many refresh intervals are no longer served
+STALE_REFRESHES = 3
+
+
+def register(subparsers: "argparse._SubParsersAction[argparse.ArgumentParser]") \
+        -> None:  # pragma: no cover
+    """Register the exporter subcommand"""
+    p_exporter = subparsers.add_parser("exporter", help="Serve Prometheus metrics over HTTP")
+    p_exporter.add_argument("--listen", type=_parse_listen, default=("", 9100),
+                            metavar="[HOST]:PORT",
+                            help="Address to serve the metrics on (default: :9100)")
+    p_exporter.add_argument("--ttl", type=float, default=15.0,
+                            help="Seconds between two refreshes of the cached metrics "
+                                 "(default: %(default)s)")
+    p_exporter.set_defaults(func=exporter, async_func=None)
+
+
+def _parse_listen(value: str) -> Tuple[str, int]:
+    """Parse a [HOST]:PORT listen address"""
+    host, _, port = value.rpartition(":")
+    try:
+        return host.strip("[]"), int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value!r} is not a valid [HOST]:PORT address")
+
+
+def _escape(value: str) -> str:
+    """Escape a label value"""
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class MetricsWriter:
+    """Collects samples into the Prometheus text exposition format"""
+    __slots__ = ('_lines',)
+
+    def __init__(self) -> None:
+        self._lines: List[str] = []
+
+    def metric(self, name: str, help_text: str, kind: str = "gauge") -> None:
+        """Start a new metric family"""
+        self._lines.append(f"# HELP {name} {help_text}")
+        self._lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name: str, value: float, **labels: str) -> None:
+        """Add a sample to the current metric family"""
+        if labels:
+            label_text = ",".join(f'{key}="{_escape(str(label))}"'
+                                  for key, label in labels.items())
+            name = f"{name}{{{label_text}}}"
+        self._lines.append(f"{name} {value:g}")
+
+    def text(self) -> str:
+        """Get the complete exposition text"""
+        return "\n".join(self._lines) + "\n"
+
+
+def _dispatcher_state(dispatcher: Control) -> str:
+    """Get the one of DISPATCHER_STATES a dispatcher is in"""
+    if not dispatcher.running:
+        return 'stopped'
+    if dispatcher.stop_scheduled:
+        return 'stopping'
+    return 'running'
+
+
+def collect(storage: Redis, scan_count: int = DEFAULT_SCAN_COUNT,
+            chunk_size: int = DEFAULT_CHUNK_SIZE, now: Optional[float] = None) -> str:
+    """Collect all metrics from the database
+
+    :param storage: A Redis instance connected to the database
+    :param scan_count: COUNT hint for scanning the dispatcher and notice keys
+    :param chunk_size: Number of objects to fetch per round trip
+    :param now: UNIX timestamp to check the notices against, defaults to the current time
+    :return: The metrics in the Prometheus text exposition format
+    """
+    if now is None:
+        now = time.time()
+    writer = MetricsWriter()
+
+    pipe = storage.pipeline(transaction=False)
+    for queue in QUEUES:
+        pipe.llen(queue)
+    writer.metric("smashctl_queue_length", "Number of jobs in a queue")
+    for queue, length in zip(QUEUES, pipe.execute()):
+        writer.sample("smashctl_queue_length", length, queue=queue)
+
+    names = sorted(set(key.split(":", 1)[-1] for key in
+                       scan_keys(storage, "control:*", scan_count)))
+    dispatchers = list(fetch_in_batches(storage, lambda name: Control(storage, name, 0), names,
+                                        chunk_size))
+    dispatcher_metrics: List[Tuple[str, str, Callable[[Control], float]]] = [
+        ("smashctl_dispatcher_running_jobs", "Number of jobs a dispatcher is running",
+         lambda d: d.running_jobs),
+        ("smashctl_dispatcher_max_jobs", "Maximum number of jobs a dispatcher runs",
+         lambda d: d.max_jobs),
+        ("smashctl_dispatcher_stop_scheduled", "Whether a dispatcher is scheduled to stop",
+         lambda d: int(bool(d.stop_scheduled))),
+    ]
+    for name, help_text, getter in dispatcher_metrics:
+        writer.metric(name, help_text)
+        for dispatcher in dispatchers:
+            writer.sample(name, getter(dispatcher), dispatcher=dispatcher.name)
+    writer.metric("smashctl_dispatcher_state",
+                  f"Whether a dispatcher is in a state, out of {', '.join(DISPATCHER_STATES)}")
+    for dispatcher in dispatchers:
+        current = _dispatcher_state(dispatcher)
+        for state in DISPATCHER_STATES:
+            writer.sample("smashctl_dispatcher_state", int(state == current),
+                          dispatcher=dispatcher.name, state=state)
+
+    notice_ids = sorted(set(key.rsplit(":", 1)[-1] for key in
+                            scan_keys(storage, "notice:*", scan_count)))
+    active: Dict[str, int] = {}
+    for notice in fetch_in_batches(storage, lambda notice_id: Notice(storage, notice_id),
+                                   notice_ids, chunk_size):
+        show_from = to_timestamp(notice.show_from)
+        show_until = to_timestamp(notice.show_until)
+        if (show_from is None or show_from <= now) and (show_until is None or now < show_until):
+            active[notice.category] = active.get(notice.category, 0) + 1
+    writer.metric("smashctl_active_notices", "Number of notices currently shown")
+    for category, count in sorted(active.items()):
+        writer.sample("smashctl_active_notices", count, category=category)
+
+    return writer.text()
+
+
+class MetricsCache:
+    """Metrics text kept up to date by a background thread"""
+    __slots__ = (
+        'errors',
+        'refreshed',
+        '_collector',
+        '_lock',
+        '_stop',
+        '_text',
+        '_thread',
+        '_ttl',
+    )
+
+    def __init__(self, collector: Callable[[], str], ttl: float) -> None:
+        self.errors = 0
+        self.refreshed: Optional[float] = None
+        self._collector = collector
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._text = ""
+        self._thread: Optional[threading.Thread] = None
+        self._ttl = ttl
+
+    def refresh(self) -> None:
+        """Collect the metrics once, keeping the previous values if that fails
+
+        Any error counts as a failed refresh, so the refresher thread keeps running.
+        """
+        try:
+            text = self._collector()
+        except Exception:  # pylint: disable=broad-except
+            with self._lock:
+                self.errors += 1
+            return
+        with self._lock:
+            self._text = text
+            self.refreshed = time.time()
+
+    def text(self) -> Optional[str]:
+        """Get the cached metrics, or None if they have never been collected or are stale"""
+        with self._lock:
+            if self.refreshed is None:
+                return None
+            if time.time() - self.refreshed > STALE_REFRESHES * self._ttl:
+                return None
+            return (f"{self._text}"
+                    "# HELP smashctl_last_refresh_timestamp_seconds Time of the last refresh\n"
+                    "# TYPE smashctl_last_refresh_timestamp_seconds gauge\n"
+                    f"smashctl_last_refresh_timestamp_seconds {self.refreshed:.3f}\n"
+                    "# HELP smashctl_refresh_errors_total Number of failed refreshes\n"
+                    "# TYPE smashctl_refresh_errors_total counter\n"
+                    f"smashctl_refresh_errors_total {self.errors}\n")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._ttl):
+            self.refresh()
+
+    def start(self) -> None:
+        """Collect the metrics, then keep refreshing them in a background thread"""
+        self.refresh()
+        self._thread = threading.Thread(target=self._run, name="metrics-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def make_server(address: Tuple[str, int], cache: MetricsCache) -> ThreadingHTTPServer:
+    """Create an HTTP server answering metrics requests from the cache"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:  # pylint: disable=invalid-name
+            if self.path.split("?", 1)[0] not in (METRICS_PATH, "/"):
+                self.send_error(404)
+                return
+            text = cache.text()
+            if text is None:
+                self.send_error(503, "Metrics not collected yet or stale")
+                return
+            body = text.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:  # pylint: disable=redefined-builtin
+            pass
+
+    server = ThreadingHTTPServer(address, MetricsHandler)
+    server.daemon_threads = True
+    return server
+
+
+def exporter(args: argparse.Namespace, storage: Redis) -> Iterator[str]:
+    """Serve the cached metrics until interrupted"""
+    scan_count = getattr(args, "scan_count", DEFAULT_SCAN_COUNT)
+    chunk_size = getattr(args, "chunk_size", DEFAULT_CHUNK_SIZE)
+    cache = MetricsCache(lambda: collect(storage, scan_count, chunk_size), args.ttl)
+    server = make_server(args.listen, cache)
+    cache.start()
+
+    host, port = server.server_address[:2]
+    yield f"Serving metrics on http://{host}:{port}{METRICS_PATH}, refreshing every {args.ttl}s"
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        return
+    finally:
+        server.server_close()
+        cache.stop()
@@ -0,0 +1,136 @@
+"""Machine-readable output formats
+
+Serializers turn a stream of records into a stream of output chunks, one record at a
+time, so arbitrarily long listings never have to be held in memory. Text formats yield
+lines, binary formats yield bytes, both are written out by run_command as they arrive.
+"""
+
+from abc import ABC, abstractmethod
+import argparse
+import csv
+from datetime import datetime
+import io
+import json
+from typing import Any, Callable, Dict, Iterable, Iterator, Sequence, Type, Union
+
+from .common import AntismashRunError
+
+
+Chunk = Union[str, bytes]
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+class Serializer(ABC):
+    """Base class of the output format serializers"""
+    def __init__(self, fields: Sequence[str]) -> None:
+        self.fields = fields
+
+    @abstractmethod
+    def serialize(self, records: Iterable[Dict[str, Any]]) -> Iterator[Chunk]:
+        """Serialize records one at a time"""
+
+
+SERIALIZERS: Dict[str, Type[Serializer]] = {}
+
+
+def register_serializer(name: str) -> Callable[[Type[Serializer]], Type[Serializer]]:
+    """Class decorator adding a serializer to the registry under the given format name"""
+    def wrapper(cls: Type[Serializer]) -> Type[Serializer]:
+        SERIALIZERS[name] = cls
+        return cls
+    return wrapper
+
+
+def _to_json(value: Any) -> Any:
+    """Convert values json can't handle natively"""
+    if isinstance(value, datetime):
+        return value.strftime(DATE_FORMAT)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+@register_serializer("json")
+class JsonSerializer(Serializer):
+    """A single JSON array, with one record per line"""
+    def serialize(self, records: Iterable[Dict[str, Any]]) -> Iterator[Chunk]:
+        yield "["
+        previous = None
+        for record in records:
+            if previous is not None:
+                yield previous + ","
+            previous = "  " + json.dumps(record, default=_to_json)
+        if previous is not None:
+            yield previous
+        yield "]"
+
+
+@register_serializer("jsonl")
+class JsonLinesSerializer(Serializer):
+    """One JSON object per line"""
+    def serialize(self, records: Iterable[Dict[str, Any]]) -> Iterator[Chunk]:
+        for record in records:
+            yield json.dumps(record, default=_to_json)
+
+
+@register_serializer("csv")
+class CsvSerializer(Serializer):
+    """Comma-separated values with a header row, lists are joined with commas"""
+    def serialize(self, records: Iterable[Dict[str, Any]]) -> Iterator[Chunk]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="")
+
+        def row(values: Iterable[Any]) -> str:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow(values)
+            return buffer.getvalue()
+
+        yield row(self.fields)
+        for record in records:
+            yield row(self._cell(record[field]) for field in self.fields)
+
+    @staticmethod
+    def _cell(value: Any) -> Any:
+        if value is None:
+            return ""
+        if isinstance(value, datetime):
+            return value.strftime(DATE_FORMAT)
+        if isinstance(value, list):
+            return ",".join(map(str, value))
+        return value
+
+
+@register_serializer("msgpack")
+class MsgpackSerializer(Serializer):
+    """A stream of msgpack maps, requires the optional msgpack package"""
+    def serialize(self, records: Iterable[Dict[str, Any]]) -> Iterator[Chunk]:
+        try:
+            import msgpack
+        except ImportError:
+            raise AntismashRunError("The msgpack format requires the msgpack package")
+        packer = msgpack.Packer(default=_to_json)
+        for record in records:
+            yield packer.pack(record)
+
+
+def add_format_argument(parser: argparse.ArgumentParser) -> None:  # pragma: no cover
+    """Add the shared --format option to a list command"""
+    parser.add_argument('--format', dest='format', default=None, choices=sorted(SERIALIZERS),
+                        help="Write machine-readable records instead of formatted text")
+
+
+def to_record(obj: Any, fields: Sequence[str]) -> Dict[str, Any]:
+    """Convert a model object to a record of the given fields"""
+    return {field: getattr(obj, field) for field in fields}
+
+
+def serialize(objects: Iterable[Any], format_name: str, fields: Sequence[str]) -> Iterator[Chunk]:
+    """Serialize model objects one at a time in a registered output format
+
+    :param objects: The model objects to write out
+    :param format_name: Name the serializer is registered under
+    :param fields: The fields of each object to include, in order
+    """
+    if format_name not in SERIALIZERS:
+        raise AntismashRunError(f"Unknown output format {format_name!r}")
+    serializer = SERIALIZERS[format_name](fields)
+    yield from serializer.serialize(to_record(obj, fields) for obj in objects)
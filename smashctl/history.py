@@ -0,0 +1,293 @@
+"""Offline history of finished jobs
+
+Jobs are imported into a local SQLite database with one column per job field, the same
+fields _format_job shows. Dates are stored as UNIX timestamps, so aggregates over the
+history are computed by SQLite without parsing any strings. Imports from the job archive
+are incremental, the database remembers how far into the archive it has read.
+"""
+
+import argparse
+import os
+import sqlite3
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from antismash_models import SyncJob as Job
+from redis import Redis
+
+from .archive import JobArchive
+from .common import AntismashRunError, parse_time
+from .formats import Chunk, add_format_argument, serialize
+from .index import parse_timestamp, to_timestamp
+from .job import ARCHIVE_QUEUES, JOB_FIELDS
+from .storage import (
+    DEFAULT_CHUNK_SIZE,
+    chunked,
+    fetch_fields_in_batches,
+    iterate_list,
+)
+
+
+HISTORY_FIELDS = JOB_FIELDS[1:]
+INDEXED_COLUMNS = ('added', 'jobtype', 'dispatcher', 'state', 'email')
+# columns that aggregations read, included in the indexes so grouping by an indexed
+# column or filtering by time never needs to look up the table rows
+COVERED_COLUMNS = {
+    'added': ('jobtype', 'dispatcher', 'state', 'last_changed'),
+}
+DEFAULT_COVERED_COLUMNS = ('added', 'last_changed')
+# SQL expressions of the columns a query can group by
+GROUPS = {
+    'day': "strftime('%Y-%m-%d', added, 'unixepoch')",
+    'week': "strftime('%Y-W%W', added, 'unixepoch')",
+    'month': "strftime('%Y-%m', added, 'unixepoch')",
+    'jobtype': 'jobtype',
+    'dispatcher': 'dispatcher',
+    'state': 'state',
+    'email': 'email',
+}
+AGGREGATES = ('jobs', 'mean_runtime')
+ARCHIVE_OFFSET = 'archive_offset'
+
+
+def register(subparsers: "argparse._SubParsersAction[argparse.ArgumentParser]") \
+        -> None:  # pragma: no cover
+    """Register history subcommands"""
+    p_history = subparsers.add_parser("history", help="Query the history of finished jobs")
+    history_subparsers = p_history.add_subparsers(title="history-related commands")
+
+    p_import = history_subparsers.add_parser(
+        "import", help="Import new jobs from the archive into the history database")
+    p_import.add_argument("--include-queues", action="store_true", default=False,
+                          help="Also import the finished jobs still in "
+                               f"{' and '.join(ARCHIVE_QUEUES)}")
+    p_import.set_defaults(func=history_import, async_func=None)
+
+    p_query = history_subparsers.add_parser(
+        "query", help="Count jobs and their mean runtime, grouped by day, job type and more")
+    p_query.add_argument("--by", type=_parse_groups, default=("day",),
+                         help="Comma-separated columns to group by, out of "
+                              f"{', '.join(GROUPS)} (default: day)")
+    p_query.add_argument("--since", type=parse_time, default=None,
+                         help="Only count jobs added at or after this UTC time "
+                              "('YYYY-MM-DD[ HH:MM:SS]' or a duration ago like '2h')")
+    p_query.add_argument("--until", type=parse_time, default=None,
+                         help="Only count jobs added at or before this UTC time")
+    p_query.add_argument("--filter", dest="filters", action="append", default=[],
+                         type=_parse_filter, metavar="FIELD=VALUE",
+                         help="Only count jobs where FIELD equals VALUE, can be given "
+                              "multiple times")
+    add_format_argument(p_query)
+    p_query.set_defaults(func=history_query, async_func=None)
+
+
+def _parse_groups(value: str) -> Tuple[str, ...]:
+    """Parse a comma-separated list of group columns"""
+    groups = tuple(group.strip() for group in value.split(",") if group.strip())
+    if not groups or any(group not in GROUPS for group in groups):
+        raise argparse.ArgumentTypeError(f"{value!r} is not a valid list of group columns")
+    return groups
+
+
+def _parse_filter(value: str) -> Tuple[str, str]:
+    """Parse a FIELD=VALUE filter on an indexed column"""
+    field, separator, expected = value.partition("=")
+    if not separator or field not in INDEXED_COLUMNS or field == 'added':
+        raise argparse.ArgumentTypeError(f"{value!r} is not a valid FIELD=VALUE history filter")
+    return field, expected
+
+
+def _column_type(field: str) -> str:
+    """Get the SQLite type of a job field's column"""
+    if field in Job.DATE_ARGS or field in Job.FLOAT_ARGS:
+        return "REAL"
+    if field in Job.INT_ARGS or field in Job.BOOL_ARGS:
+        return "INTEGER"
+    return "TEXT"
+
+
+def _column_value(field: str, raw: Optional[str]) -> Any:
+    """Convert a raw job hash value to its column value, lists are kept as JSON"""
+    if raw is None:
+        return None
+    try:
+        if field in Job.DATE_ARGS:
+            return parse_timestamp(raw)
+        if field in Job.BOOL_ARGS:
+            return int(raw != 'False')
+        if field in Job.INT_ARGS:
+            return int(raw)
+        if field in Job.FLOAT_ARGS:
+            return float(raw)
+    except ValueError:
+        return None
+    return raw
+
+
+class JobHistory:
+    """A SQLite database of finished jobs"""
+    __slots__ = (
+        'connection',
+        'path',
+    )
+
+    def __init__(self, path: str) -> None:
+        self.path = os.path.expanduser(path)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        try:
+            self.connection = sqlite3.connect(self.path)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self._create_schema()
+        except sqlite3.Error as err:
+            raise AntismashRunError(f"Can't open history database {self.path}: {err}")
+
+    def _create_schema(self) -> None:
+        columns = ", ".join(f'"{field}" {_column_type(field)}' for field in HISTORY_FIELDS)
+        with self.connection:
+            self.connection.execute(
+                f"CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, {columns})")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+            for column in INDEXED_COLUMNS:
+                covered = COVERED_COLUMNS.get(column, DEFAULT_COVERED_COLUMNS)
+                indexed = ", ".join((column,) + covered)
+                self.connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS jobs_{column} ON jobs ({indexed})")
+
+    def close(self) -> None:
+        """Close the database connection"""
+        self.connection.close()
+
+    def get_meta(self, name: str, default: int = 0) -> int:
+        """Get a bookkeeping value"""
+        row = self.connection.execute("SELECT value FROM meta WHERE name = ?",
+                                      (name,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_meta(self, name: str, value: int) -> None:
+        """Store a bookkeeping value"""
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                                    (name, value))
+
+    def add(self, jobs: Iterable[Tuple[str, Dict[str, Optional[str]]]],
+            chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+        """Add or replace jobs, one transaction per chunk
+
+        :param jobs: Pairs of job IDs and the raw fields of their hashes
+        :param chunk_size: Number of jobs to write per transaction
+        :return: The number of added jobs
+        """
+        names = ", ".join(f'"{field}"' for field in ('job_id',) + HISTORY_FIELDS)
+        placeholders = ", ".join("?" * (len(HISTORY_FIELDS) + 1))
+        statement = f"INSERT OR REPLACE INTO jobs ({names}) VALUES ({placeholders})"
+        added = 0
+        for chunk in chunked(jobs, chunk_size):
+            rows = [[job_id] + [_column_value(field, fields.get(field))
+                                for field in HISTORY_FIELDS]
+                    for job_id, fields in chunk]
+            with self.connection:
+                self.connection.executemany(statement, rows)
+            added += len(rows)
+        return added
+
+    def aggregate(self, groups: Sequence[str], since: Optional[float] = None,
+                  until: Optional[float] = None,
+                  filters: Sequence[Tuple[str, str]] = ()) -> Iterator[SimpleNamespace]:
+        """Count jobs and average their runtime per group
+
+        The runtime is the time between a job being added and its last change, which
+        for finished jobs is when they finished.
+
+        :param groups: Names of the GROUPS to group by
+        :param since: Only count jobs added at or after this UNIX timestamp
+        :param until: Only count jobs added at or before this UNIX timestamp
+        :param filters: Pairs of indexed columns and their required values
+        """
+        conditions: List[str] = []
+        parameters: List[Any] = []
+        if since is not None:
+            conditions.append("added >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("added <= ?")
+            parameters.append(until)
+        for field, value in filters:
+            if field not in INDEXED_COLUMNS:
+                raise ValueError(f"Column {field!r} is not indexed")
+            conditions.append(f"{field} = ?")
+            parameters.append(value)
+
+        selected = ", ".join(f"{GROUPS[group]} AS {group}" for group in groups)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = ", ".join(groups)
+        statement = (f"SELECT {selected}, COUNT(*), AVG(last_changed - added) FROM jobs "
+                     f"{where} GROUP BY {order} ORDER BY {order}")
+        for row in self.connection.execute(statement, parameters):
+            result = SimpleNamespace(**dict(zip(groups, row)))
+            result.jobs, result.mean_runtime = row[-2:]
+            yield result
+
+
+def _finished_queue_jobs(storage: Redis,
+                         chunk_size: int) -> Iterator[Tuple[str, Dict[str, Optional[str]]]]:
+    """Get the raw fields of all jobs in the finished queues"""
+    for queue in ARCHIVE_QUEUES:
+        job_ids = iterate_list(storage, queue, chunk_size)
+        for job_id, values in fetch_fields_in_batches(storage, "job:{}", job_ids,
+                                                      HISTORY_FIELDS, chunk_size):
+            yield job_id, dict(zip(HISTORY_FIELDS, values))
+
+
+def history_import(args: argparse.Namespace, storage: Redis) -> str:
+    """Import the jobs archived since the last import, and optionally the finished queues"""
+    chunk_size = getattr(args, "chunk_size", DEFAULT_CHUNK_SIZE)
+    history = JobHistory(args.history)
+    job_archive = JobArchive(args.archive)
+    try:
+        start = history.get_meta(ARCHIVE_OFFSET)
+        if not os.path.exists(job_archive.path) or os.path.getsize(job_archive.path) < start:
+            # the archive was replaced, read the new one from the start
+            start = 0
+        position = {"offset": start}
+
+        def archived() -> Iterator[Tuple[str, Dict[str, Optional[str]]]]:
+            for offset, job_id, fields in job_archive.read_from(start):
+                position["offset"] = offset
+                yield job_id, fields
+
+        from_archive = history.add(archived(), chunk_size)
+        history.set_meta(ARCHIVE_OFFSET, position["offset"])
+        lines = [f"Imported {from_archive} jobs from {job_archive.path}"]
+        if args.include_queues:
+            from_queues = history.add(_finished_queue_jobs(storage, chunk_size), chunk_size)
+            lines.append(f"Imported {from_queues} jobs from {' and '.join(ARCHIVE_QUEUES)}")
+    finally:
+        history.close()
+    return "\n".join(lines)
+
+
+def _format_row(row: SimpleNamespace, groups: Sequence[str]) -> str:
+    """Format an aggregated row as tab-separated columns"""
+    runtime = "-" if row.mean_runtime is None else f"{row.mean_runtime:.1f}"
+    return "\t".join([str(getattr(row, group)) for group in groups] + [str(row.jobs), runtime])
+
+
+def history_query(args: argparse.Namespace, storage: Redis) -> Iterator[Chunk]:
+    """Show job counts and mean runtimes in seconds from the history database"""
+    history = JobHistory(args.history)
+    try:
+        rows = history.aggregate(args.by, to_timestamp(args.since), to_timestamp(args.until),
+                                 args.filters)
+        output_format = getattr(args, "format", None)
+        if output_format:
+            yield from serialize(rows, output_format, tuple(args.by) + AGGREGATES)
+            return
+        yield "\t".join(tuple(args.by) + AGGREGATES)
+        for row in rows:
+            yield _format_row(row, args.by)
+    finally:
+        history.close()
@@ -0,0 +1,238 @@
+"""Secondary indexes for job lookups
+
+Index sets are kept under index:<field>:<value> and contain the IDs of all jobs with
+that value. The sorted sets index:added and index:last_changed order all jobs by the
+UNIX timestamps of those fields. smashctl updates the indexes whenever it changes a job,
+but other tools writing jobs don't, so `smashctl index rebuild` should be run regularly
+to pick up their changes.
+"""
+
+import argparse
+from datetime import datetime, UTC
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from redis import Redis
+
+from .storage import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_SCAN_COUNT,
+    chunked,
+    require_standalone,
+    scan_keys,
+)
+
+
+INDEXED_FIELDS = ('dispatcher', 'email', 'jobtype', 'state')
+TIME_FIELDS = ('added', 'last_changed')
+INDEX_PREFIX = "index"
+REBUILD_PREFIX = "index-rebuild"
+
+
+def register(subparsers: "argparse._SubParsersAction[argparse.ArgumentParser]") \
+        -> None:  # pragma: no cover
+    """Register index subcommands"""
+    p_index = subparsers.add_parser("index", help="Maintain the secondary job indexes")
+    index_subparsers = p_index.add_subparsers(title="index-related commands")
+
+    p_rebuild = index_subparsers.add_parser("rebuild", help="Rebuild all indexes from the jobs")
+    p_rebuild.set_defaults(func=rebuild, async_func=None)
+
+
+def index_key(field: str, value: str, prefix: str = INDEX_PREFIX) -> str:
+    """Get the key of the index set for a field value"""
+    return f"{prefix}:{field}:{value}"
+
+
+def time_index_key(field: str, prefix: str = INDEX_PREFIX) -> str:
+    """Get the key of the sorted set ordering jobs by a timestamp field"""
+    return f"{prefix}:{field}"
+
+
+def to_timestamp(value: Optional[datetime]) -> Optional[float]:
+    """Convert a job datetime to a UNIX timestamp, naive datetimes are treated as UTC"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=UTC)
+    return value.timestamp()
+
+
+def parse_timestamp(raw: str) -> float:
+    """Convert a datetime as stored in a job hash to a UNIX timestamp"""
+    try:
+        value = datetime.strptime(raw, "%Y-%m-%d %H:%M:%S.%f")
+    except ValueError:
+        value = datetime.strptime(raw, "%Y-%m-%d %H:%M:%S")
+    return value.replace(tzinfo=UTC).timestamp()
+
+
+def index_values(job) -> Dict[str, Optional[str]]:
+    """Get the indexed field values of a job"""
+    return {field: getattr(job, field) or None for field in INDEXED_FIELDS}
+
+
+def update_job_index(pipe, job_id: str, old_values: Mapping[str, Optional[str]],
+                     new_values: Mapping[str, Optional[str]]) -> None:
+    """Queue the commands moving a job to the index sets matching its new values"""
+    for field in INDEXED_FIELDS:
+        old = old_values.get(field)
+        new = new_values.get(field)
+        if old == new:
+            continue
+        if old:
+            pipe.srem(index_key(field, old), job_id)
+        if new:
+            pipe.sadd(index_key(field, new), job_id)
+
+
+def update_time_index(pipe, job) -> None:
+    """Queue the commands updating a job's position in the time indexes"""
+    for field in TIME_FIELDS:
+        timestamp = to_timestamp(getattr(job, field))
+        if timestamp is not None:
+            pipe.zadd(time_index_key(field), {job.job_id: timestamp})
+
+
+def remove_from_time_index(pipe, job_id: str) -> None:
+    """Queue the commands removing a job from the time indexes"""
+    for field in TIME_FIELDS:
+        pipe.zrem(time_index_key(field), job_id)
+
+
+def find_jobs(storage: Redis, filters: Mapping[str, str]) -> Set[str]:
+    """Get the IDs of all jobs matching all filters, using the index sets
+
+    :param storage: A Redis instance connected to the database
+    :param filters: Mapping of indexed field names to required values
+    """
+    for field in filters:
+        if field not in INDEXED_FIELDS:
+            raise ValueError(f"Field {field!r} is not indexed")
+    if not filters:
+        raise ValueError("Need at least one filter to look up jobs")
+    require_standalone(storage, "Looking up jobs by email, dispatcher or job type")
+    return storage.sinter([index_key(field, value) for field, value in filters.items()])
+
+
+def find_jobs_in_ranges(storage: Redis, ranges: Mapping[str, Tuple[float, float]],
+                        filters: Optional[Mapping[str, str]] = None,
+                        chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[str]:
+    """Get the IDs of all jobs with timestamps in the given ranges, using the time indexes
+
+    The jobs are ordered by the first range's field. Jobs in that range are checked
+    against the other ranges and the filters with pipelined lookups, one round trip
+    per chunk of jobs.
+
+    :param storage: A Redis instance connected to the database
+    :param ranges: Mapping of time field names to (minimum, maximum) UNIX timestamps
+    :param filters: Mapping of indexed field names to required values
+    :param chunk_size: Number of jobs to check per round trip
+    """
+    if not ranges:
+        raise ValueError("Need at least one time range to look up jobs")
+    filters = filters or {}
+    for field in ranges:
+        if field not in TIME_FIELDS:
+            raise ValueError(f"Field {field!r} has no time index")
+    for field in filters:
+        if field not in INDEXED_FIELDS:
+            raise ValueError(f"Field {field!r} is not indexed")
+
+    (field, (minimum, maximum)), *other_ranges = ranges.items()
+    candidates = storage.zrangebyscore(time_index_key(field), minimum, maximum)
+    if not other_ranges and not filters:
+        return candidates
+
+    job_ids: List[str] = []
+    for chunk in chunked(candidates, chunk_size):
+        pipe = storage.pipeline(transaction=False)
+        for other_field, _ in other_ranges:
+            pipe.zmscore(time_index_key(other_field), chunk)
+        for filter_field, value in filters.items():
+            pipe.smismember(index_key(filter_field, value), chunk)
+        replies = pipe.execute()
+
+        range_replies = replies[:len(other_ranges)]
+        filter_replies = replies[len(other_ranges):]
+        for i, job_id in enumerate(chunk):
+            if not all(scores[i] is not None and low <= scores[i] <= high
+                       for scores, (_, (low, high)) in zip(range_replies, other_ranges)):
+                continue
+            if not all(members[i] for members in filter_replies):
+                continue
+            job_ids.append(job_id)
+
+    return job_ids
+
+
+def _replace_keys(storage: Redis, new_keys: Iterable[str], pattern: str, scan_count: int,
+                  chunk_size: int) -> None:
+    """Move freshly built index sets into place and drop outdated ones"""
+    wanted: Set[str] = set()
+    for chunk in chunked(new_keys, chunk_size):
+        pipe = storage.pipeline(transaction=False)
+        for key in chunk:
+            final_key = INDEX_PREFIX + key[len(REBUILD_PREFIX):]
+            pipe.rename(key, final_key)
+            wanted.add(final_key)
+        pipe.execute()
+
+    outdated: List[str] = [key for key in scan_keys(storage, pattern, scan_count)
+                           if key not in wanted]
+    for chunk in chunked(outdated, chunk_size):
+        storage.delete(*chunk)
+
+
+def rebuild(args: argparse.Namespace, storage: Redis) -> str:
+    """Rebuild all indexes with a pipelined pass over all job hashes
+
+    The new sets are built under temporary keys and then renamed, so lookups keep
+    working while the rebuild is running. Jobs with a timestamp that can't be parsed
+    are left out of that time index and counted in the summary.
+    """
+    require_standalone(storage, "Rebuilding the indexes")
+    scan_count = getattr(args, "scan_count", DEFAULT_SCAN_COUNT)
+    chunk_size = getattr(args, "chunk_size", DEFAULT_CHUNK_SIZE)
+    new_keys: Set[str] = set()
+    job_count = unparsable = 0
+
+    for stale in chunked(scan_keys(storage, f"{REBUILD_PREFIX}:*", scan_count), chunk_size):
+        storage.delete(*stale)
+
+    for chunk in chunked(scan_keys(storage, "job:*", scan_count), chunk_size):
+        pipe = storage.pipeline(transaction=False)
+        for key in chunk:
+            pipe.hmget(key, *(INDEXED_FIELDS + TIME_FIELDS))
+        replies = pipe.execute()
+
+        pipe = storage.pipeline(transaction=False)
+        for key, values in zip(chunk, replies):
+            job_id = key.split(":", 1)[-1]
+            valid = True
+            for field, value in zip(INDEXED_FIELDS, values):
+                if not value:
+                    continue
+                new_key = index_key(field, value, REBUILD_PREFIX)
+                pipe.sadd(new_key, job_id)
+                new_keys.add(new_key)
+            for field, value in zip(TIME_FIELDS, values[len(INDEXED_FIELDS):]):
+                if not value:
+                    continue
+                try:
+                    timestamp = parse_timestamp(value)
+                except ValueError:
+                    valid = False
+                    continue
+                new_key = time_index_key(field, REBUILD_PREFIX)
+                pipe.zadd(new_key, {job_id: timestamp})
+                new_keys.add(new_key)
+            job_count += 1
+            unparsable += not valid
+        pipe.execute()
+
+    _replace_keys(storage, new_keys, f"{INDEX_PREFIX}:*", scan_count, chunk_size)
+
+    summary = f"Indexed {job_count} jobs into {len(new_keys)} indexes"
+    if unparsable:
+        summary += f", {unparsable} jobs with unparsable timestamps left out of the time indexes"
+    return summary
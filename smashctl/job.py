@@ -1,16 +1,91 @@
-"""Job management logic"""
+"""Job management logic
+
+smashctl.mail is only imported by the functions sending mails, as loading smtplib
+and the email package slows down every other job subcommand.
+"""
 import argparse
+from contextlib import nullcontext
+from datetime import datetime, UTC
+import sys
+import time
+from typing import (
+    Any,
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from antismash_models import AsyncJob, SyncControl as Control, SyncJob as Job
+from redis.exceptions import ResponseError
+
+from smashctl.archive import JobArchive
+from smashctl.common import (
+    AntismashRunError,
+    CommandResult,
+    default_action,
+    parse_duration,
+    parse_time,
+)
+from smashctl.formats import Chunk, add_format_argument, serialize
+from smashctl.index import (
+    INDEXED_FIELDS,
+    find_jobs,
+    find_jobs_in_ranges,
+    index_values,
+    parse_timestamp,
+    remove_from_time_index,
+    time_index_key,
+    to_timestamp,
+    update_job_index,
+    update_time_index,
+)
+from smashctl.storage import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_SCAN_COUNT,
+    RUNNING_QUEUE,
+    async_fetch_in_batches,
+    chunked,
+    expire_nx,
+    fetch_fields_in_batches,
+    fetch_in_batches,
+    get_retry_policy,
+    is_cluster,
+    iterate_list,
+    move_job,
+    remove_archived_job,
+    require_standalone,
+    scan_keys,
+)
 
-from antismash_models import SyncJob as Job
 
-from smashctl.common import AntismashRunError, default_action
-from smashctl.mail import send_mail, MailConfig
+JOB_FIELDS = ('job_id',) + Job.PROPERTIES + Job.ATTRIBUTES
+ONELINE_FIELDS = ('job_id', 'jobtype', 'dispatcher', 'email', 'added', 'last_changed',
+                  'filename', 'download', 'state', 'status')
+ONELINE_TEMPLATE = ("{job.job_id}\t{job.jobtype}\t{job.dispatcher}\t"
+                    "{job.email}\t{job.added}\t{job.last_changed}\t"
+                    "{job.filename}{job.download}\t{job.state}\t{job.status}")
+RESTARTABLE_STATES = ('queued', 'running', 'done', 'failed')
+CANCELABLE_STATES = ('created', 'downloading', 'validating', 'waiting', 'queued')
+FINISHED_STATES = ('done', 'failed', 'removed')
+ARCHIVE_QUEUES = ('jobs:done', 'jobs:failed')
+# job list options only the synchronous job list supports
+ASYNC_UNSUPPORTED_LIST_OPTIONS = ('email', 'dispatcher', 'jobtype', 'since', 'until',
+                                  'stale_for', 'fields')
+# minimum number of seconds between re-reading a watched queue on its keyspace events
+QUEUE_REFRESH_INTERVAL = 1.0
 
 
 def register(subparsers: "argparse._SubParsersAction[argparse.ArgumentParser]"):  # pragma: no cover
     """Register job subcommands"""
     p_job = subparsers.add_parser('job', help='Show and manipulate jobs')
-    p_job.set_defaults(func=default_action(joblist, queue="running", pretty="oneline"))
+    p_job.set_defaults(func=default_action(joblist, queue="running", pretty="oneline"),
+                       async_func=default_action(async_joblist, queue="running", pretty="oneline"))
 
     job_subparsers = p_job.add_subparsers(title='job-related commands')
 
@@ -18,23 +93,41 @@ def register(subparsers: "argparse._SubParsersAction[argparse.ArgumentParser]"):
     p_show.add_argument('job_id', help="ID of the job to show")
     p_show.add_argument('-p', '--pretty', choices=["oneline", "verbose"], default="oneline",
                         help="Show job in one line or verbose mode (default: %(default)s)")
-    p_show.set_defaults(func=show)
+    p_show.set_defaults(func=show, async_func=async_show)
 
     p_list = job_subparsers.add_parser('list', help='List jobs')
     p_list.add_argument('-q', '--queue', default='running',
-                        help="What queue to list jobs for (default: %(default)s)")
+                        help="What queue to list jobs for, 'all' to list jobs in any queue "
+                             "(default: %(default)s)")
     p_list.add_argument('-p', '--pretty', choices=["oneline", "verbose"], default="oneline",
                         help="Show jobs in one line per job or verbose mode (default: %(default)s)")
-    p_list.set_defaults(func=joblist)
+    p_list.add_argument('--email', default=None,
+                        help="Only list jobs submitted from this email address, using the index")
+    p_list.add_argument('--dispatcher', default=None,
+                        help="Only list jobs handled by this dispatcher, using the index")
+    p_list.add_argument('--jobtype', default=None,
+                        help="Only list jobs of this job type, using the index")
+    p_list.add_argument('--since', type=parse_time, default=None,
+                        help="Only list jobs added at or after this UTC time "
+                             "('YYYY-MM-DD[ HH:MM:SS]' or a duration ago like '2h')")
+    p_list.add_argument('--until', type=parse_time, default=None,
+                        help="Only list jobs added at or before this UTC time")
+    p_list.add_argument('--stale-for', type=parse_duration, default=None,
+                        help="Only list jobs that haven't changed for this long, e.g. '30m'")
+    p_list.add_argument('--fields', type=_parse_fields, default=None,
+                        help="Comma-separated job fields to list, only fetching those "
+                             "(default: the oneline columns)")
+    add_format_argument(p_list)
+    p_list.set_defaults(func=joblist, async_func=async_joblist)
 
-    p_restart = job_subparsers.add_parser('restart', help='Restart a job')
-    p_restart.add_argument('job_id', help="ID of the job to restart")
+    p_restart = job_subparsers.add_parser('restart', help='Restart one or more jobs')
+    _add_bulk_arguments(p_restart, "restart")
     p_restart.add_argument('-q', '--queue', default="jobs:queued",
                            help="Queue to send the job to (default: %(default)s).")
-    p_restart.set_defaults(func=restart)
+    p_restart.set_defaults(func=restart, async_func=None)
 
-    p_cancel = job_subparsers.add_parser('cancel', help='Cancel a job')
-    p_cancel.add_argument('job_id', help="ID of the job to cancel")
+    p_cancel = job_subparsers.add_parser('cancel', help='Cancel one or more jobs')
+    _add_bulk_arguments(p_cancel, "cancel")
     p_cancel.add_argument('-f', '--force', action="store_true", default=False,
                           help="Force a job to be canceled regardless of status.")
     p_cancel.add_argument('--notify', action="store_true", default=False,
@@ -43,20 +136,119 @@ def register(subparsers: "argparse._SubParsersAction[argparse.ArgumentParser]"):
                           help="Give a reason for canceling the job (default: %(default)s).")
     p_cancel.add_argument('-s', '--state', default="failed", choices=Job.VALID_STATES,
                           help="Set a state for the job (default: %(default)s).")
-    p_cancel.set_defaults(func=cancel)
+    p_cancel.set_defaults(func=cancel, async_func=None)
+
+    p_notify = job_subparsers.add_parser('notify', help='Notify users about job outcomes')
+    _add_bulk_arguments(p_notify, "notify")
+    p_notify.add_argument('--parallel', type=int, default=0, metavar='N',
+                          help="Send mails from N worker threads with one SMTP connection each")
+    p_notify.add_argument('--rate-limit', type=float, default=0.0, metavar='SECONDS',
+                          help="Minimum time between two mails to the same recipient "
+                               "when sending in parallel (default: %(default)s)")
+    p_notify.add_argument('--error-report', dest='error_report', action="store_true",
+                          default=False,
+                          help="Also send a failure report for failed jobs to the support address")
+    p_notify.set_defaults(func=notify, async_func=None)
+
+    p_watch = job_subparsers.add_parser('watch', help='Follow the state of jobs as it changes')
+    p_watch.add_argument('job_ids', nargs='*', metavar='job_id',
+                         help="ID(s) of the job(s) to watch until they have finished")
+    p_watch.add_argument('-q', '--queue', default=None,
+                         help="Watch all jobs in a queue, e.g. jobs:running")
+    p_watch.add_argument('--timeout', type=float, default=0,
+                         help="Stop watching after this many seconds (default: no timeout)")
+    p_watch.add_argument('--poll-interval', type=float, default=1.0,
+                         help="Initial polling interval if keyspace notifications are disabled "
+                              "(default: %(default)s)")
+    p_watch.add_argument('--max-poll-interval', type=float, default=30.0,
+                         help="Maximal polling interval (default: %(default)s)")
+    p_watch.set_defaults(func=watch, async_func=None)
+
+    p_reap = job_subparsers.add_parser('reap',
+                                       help='Find running jobs that are orphaned or stuck')
+    p_reap.add_argument('--stale-for', type=parse_duration, default=parse_duration("6h"),
+                        help="Consider running jobs stuck if they haven't changed for this long "
+                             "(default: 6h)")
+    p_reap.add_argument('--requeue', action="store_true", default=False,
+                        help="Restart the orphaned and stuck jobs")
+    p_reap.add_argument('-q', '--queue', default="jobs:queued",
+                        help="Queue to send requeued jobs to (default: %(default)s).")
+    p_reap.add_argument('--limit', type=int, default=0,
+                        help="Requeue at most this many jobs per run (default: no limit)")
+    p_reap.set_defaults(func=reap, async_func=None)
+
+    p_archive = job_subparsers.add_parser('archive',
+                                          help='Move old finished jobs to the local archive')
+    p_archive.add_argument('--older-than', type=parse_duration, default=parse_duration("30d"),
+                           help="Archive done and failed jobs that haven't changed for this long "
+                                "(default: 30d)")
+    p_archive.add_argument('--expire-remaining', type=parse_duration, default=None,
+                           metavar='DURATION',
+                           help="Let the remaining done and failed jobs expire this long after "
+                                "they're old enough to archive, unless they already have a TTL")
+    p_archive.set_defaults(func=archive, async_func=None)
+
+
+def _add_bulk_arguments(parser: argparse.ArgumentParser, verb: str) -> None:  # pragma: no cover
+    """Add the arguments selecting the jobs for a bulk operation"""
+    parser.add_argument('job_ids', nargs='*', metavar='job_id',
+                        help=f"ID(s) of the job(s) to {verb}, '-' to read IDs from stdin")
+    parser.add_argument('--from-queue', dest='from_queue', default=None,
+                        help=f"{verb.capitalize()} all jobs in a queue, e.g. jobs:failed")
+    parser.add_argument('--filter', dest='filters', action='append', default=[],
+                        type=_parse_filter, metavar='FIELD=VALUE',
+                        help=f"Only {verb} jobs where FIELD equals VALUE, can be given multiple times")
+
 
-    p_notify = job_subparsers.add_parser('notify', help='Notify user about the job outcome')
-    p_notify.add_argument('job_id', help="ID of the job to notify for")
-    p_notify.set_defaults(func=notify)
+def _parse_filter(value: str) -> Tuple[str, str]:
+    """Parse a FIELD=VALUE job filter"""
+    field, separator, expected = value.partition("=")
+    if not separator or field not in JOB_FIELDS:
+        raise argparse.ArgumentTypeError(f"{value!r} is not a valid FIELD=VALUE job filter")
+    return field, expected
+
+
+def _parse_fields(value: str) -> Tuple[str, ...]:
+    """Parse a comma-separated list of job fields"""
+    fields = tuple(field.strip() for field in value.split(",") if field.strip())
+    invalid = [field for field in fields if field not in JOB_FIELDS]
+    if invalid or not fields:
+        raise argparse.ArgumentTypeError(f"{value!r} is not a valid list of job fields")
+    return fields
+
+
+def _fetch_job_fields(storage, job_ids: Iterable[str], fields: Sequence[str],
+                      chunk_size: int) -> Iterator[Job]:
+    """Fetch only the given fields of many jobs
+
+    The values are parsed by the job model, so fields that weren't fetched or aren't set
+    show the model defaults, just like fully fetched jobs. Jobs with values the model
+    rejects are skipped, as fetch_in_batches does.
+    """
+    # in the model's order, setting the state touches last_changed
+    hash_fields = [field for field in Job.PROPERTIES + Job.ATTRIBUTES if field in fields]
+    for job_id, values in fetch_fields_in_batches(storage, "job:{}", job_ids, hash_fields,
+                                                  chunk_size):
+        job = Job(storage, job_id)
+        try:
+            job._parse(hash_fields, values)
+        except ValueError:
+            continue
+        yield job
+
+
+def _format_fields(job: Job, fields: Sequence[str]) -> str:
+    """Format the fetched fields of a job, the oneline fields just like _format_job"""
+    if tuple(fields) == ONELINE_FIELDS:
+        return ONELINE_TEMPLATE.format(job=job)
+    return "\t".join(str(getattr(job, field)) for field in fields)
 
 
 def _format_job(job: Job, format: str = "oneline") -> str:
     """Format a job for printing"""
 
     if format == "oneline":
-        template: str = ("{job.job_id}\t{job.jobtype}\t{job.dispatcher}\t"
-                         "{job.email}\t{job.added}\t{job.last_changed}\t"
-                         "{job.filename}{job.download}\t{job.state}\t{job.status}")
+        template: str = ONELINE_TEMPLATE
     elif format == "verbose":
         template = "{job.job_id}\n"
         for var in sorted(Job.PROPERTIES + Job.ATTRIBUTES):
@@ -67,108 +259,785 @@ def _format_job(job: Job, format: str = "oneline") -> str:
     return template.format(job=job)
 
 
+def _archived_job(args, storage, job_id: str) -> Optional[Job]:
+    """Look up a job in the local archive, if there is one"""
+    path = getattr(args, "archive", None)
+    if not path:
+        return None
+    try:
+        fields = JobArchive(path).get(job_id)
+        if fields is None:
+            return None
+        job = Job(storage, job_id)
+        job._parse(JOB_FIELDS[1:], [fields.get(field) for field in JOB_FIELDS[1:]])
+    except (OSError, ValueError) as err:
+        raise AntismashRunError(f"Can't read job {job_id} from the archive {path}: {err}")
+    return job
+
+
 def show(args, storage) -> str:
-    """Handle smashctl job show"""
+    """Handle smashctl job show, falling back to the archive for jobs not in the database"""
     try:
         job = Job(storage, args.job_id)
-        job.fetch()  # type: ignore
+        get_retry_policy(storage).call(job.fetch)
     except ValueError as e:
-        raise AntismashRunError('Job {} not found in database, {}!'.format(args.job_id, e))
+        archived = _archived_job(args, storage, args.job_id)
+        if archived is None:
+            raise AntismashRunError('Job {} not found in database, {}!'.format(args.job_id, e))
+        job = archived
 
     return _format_job(job, args.pretty)
 
 
-def joblist(args, storage) -> str:
-    """Handle listing jobs"""
-    queue_key = 'jobs:{}'.format(args.queue)
-    result_lines = []
+async def async_show(args, storage) -> str:
+    """Handle smashctl job show, asyncio version"""
+    try:
+        job = AsyncJob(storage, args.job_id)
+        await job.fetch()  # type: ignore
+    except ValueError as e:
+        archived = _archived_job(args, storage, args.job_id)
+        if archived is None:
+            raise AntismashRunError('Job {} not found in database, {}!'.format(args.job_id, e))
+        job = archived
 
-    jobs = storage.lrange(queue_key, 0, -1)
-    for job_id in jobs:
-        try:
-            job = Job(storage, job_id)
-            job.fetch()  # type: ignore
-            result_lines.append(_format_job(job, args.pretty))
-        except ValueError:
-            pass
+    return _format_job(job, args.pretty)
+
+
+def joblist(args, storage) -> Iterator[Chunk]:
+    """Handle listing jobs
+
+    The queue is paged through in windows of chunk_size jobs and lines are yielded as soon
+    as their window has been fetched, so memory use does not grow with the queue length.
+    With --format, the jobs are written out as records in that format instead.
+
+    For oneline output or a --fields selection, only the needed hash fields are fetched.
+    The time indexes only narrow down the candidates for --since, --until and --stale-for,
+    the fetched timestamps of the jobs decide whether they are listed.
+    """
+    chunk_size = getattr(args, "chunk_size", DEFAULT_CHUNK_SIZE)
+    found_jobs = False
+
+    ranges = _time_ranges(args)
+    job_ids = _job_ids_from_index(args, storage, ranges)
+    if job_ids is None:
+        job_ids = _queue_job_ids(storage, args.queue, chunk_size,
+                                 getattr(args, "scan_count", DEFAULT_SCAN_COUNT))
+
+    fields = getattr(args, "fields", None)
+    output_format = getattr(args, "format", None)
+    if fields or (args.pretty == "oneline" and not output_format):
+        fields = fields or ONELINE_FIELDS
+        fetched = tuple(fields) + tuple(field for field in ranges if field not in fields)
+        projected = _fetch_job_fields(storage, job_ids, fetched, chunk_size)
+        if ranges:
+            projected = (job for job in projected if _in_time_ranges(job, ranges))
+        if output_format:
+            yield from serialize(projected, output_format, fields)
+            return
+        for projected_job in projected:
+            found_jobs = True
+            yield _format_fields(projected_job, fields)
+    else:
+        jobs = fetch_in_batches(storage, lambda job_id: Job(storage, job_id), job_ids, chunk_size)
+        if ranges:
+            jobs = (job for job in jobs if _in_time_ranges(job, ranges))
+        if output_format:
+            yield from serialize(jobs, output_format, JOB_FIELDS)
+            return
+        for job in jobs:
+            found_jobs = True
+            yield _format_job(job, args.pretty)
+
+    if not found_jobs:
+        yield "No jobs in queue {!r}".format(args.queue)
+
+
+def _queue_job_ids(storage, queue: str, chunk_size: int, scan_count: int) -> Iterator[str]:
+    """Iterate over the IDs of the jobs in a queue, or in all queues for 'all'"""
+    if queue != 'all':
+        yield from iterate_list(storage, 'jobs:{}'.format(queue), chunk_size)
+        return
+    for key in sorted(scan_keys(storage, "jobs:*", scan_count)):
+        yield from iterate_list(storage, key, chunk_size)
+
+
+def _job_ids_from_index(args, storage,
+                        ranges: Dict[str, Tuple[float, float]]) -> Optional[List[str]]:
+    """Look up the IDs of the jobs matching the job list filters in the indexes
 
-    if not result_lines:
+    Time ranges are answered from the time indexes, with the jobs ordered by the time
+    they were added, or by their last change when only --stale-for was given. If the
+    time index is empty, e.g. because it was never built, the time ranges are left to
+    the checks on the fetched jobs.
+
+    :return: The job IDs, or None if the whole queue needs to be read
+    """
+    filters = {field: getattr(args, field, None) for field in ('email', 'dispatcher', 'jobtype')}
+    filters = {field: value for field, value in filters.items() if value}
+    if ranges and not storage.zcard(time_index_key(next(iter(ranges)))):
+        ranges = {}
+    if not filters and not ranges:
+        return None
+
+    chunk_size = getattr(args, "chunk_size", DEFAULT_CHUNK_SIZE)
+    if ranges:
+        job_ids = find_jobs_in_ranges(storage, ranges, filters, chunk_size)
+    else:
+        job_ids = sorted(find_jobs(storage, filters))
+    if args.queue != 'all':
+        # the state index lags behind jobs moved by other tools, the queue itself decides
+        in_queue = set(iterate_list(storage, 'jobs:{}'.format(args.queue), chunk_size))
+        job_ids = [job_id for job_id in job_ids if job_id in in_queue]
+
+    return job_ids
+
+
+def _time_ranges(args) -> Dict[str, Tuple[float, float]]:
+    """Convert the job list time options to score ranges for the time indexes"""
+    ranges: Dict[str, Tuple[float, float]] = {}
+    since = getattr(args, "since", None)
+    until = getattr(args, "until", None)
+    if since is not None or until is not None:
+        ranges['added'] = (since.timestamp() if since is not None else float('-inf'),
+                           until.timestamp() if until is not None else float('inf'))
+    stale_for = getattr(args, "stale_for", None)
+    if stale_for is not None:
+        ranges['last_changed'] = (float('-inf'), (datetime.now(UTC) - stale_for).timestamp())
+    return ranges
+
+
+def _in_time_ranges(job, ranges: Dict[str, Tuple[float, float]]) -> bool:
+    """Check the timestamps of a fetched job against the job list time ranges"""
+    for field, (minimum, maximum) in ranges.items():
+        timestamp = to_timestamp(getattr(job, field, None))
+        if timestamp is None or not minimum <= timestamp <= maximum:
+            return False
+    return True
+
+
+async def async_joblist(args, storage) -> CommandResult:
+    """Handle listing jobs, asyncio version fetching chunks of the queue concurrently"""
+    unsupported = [option for option in ASYNC_UNSUPPORTED_LIST_OPTIONS
+                   if getattr(args, option, None) is not None]
+    if unsupported:
+        names = ", ".join("--" + option.replace("_", "-") for option in unsupported)
+        raise AntismashRunError(f"{names} can't be combined with --async")
+
+    queue_key = 'jobs:{}'.format(args.queue)
+    chunk_size = getattr(args, "chunk_size", DEFAULT_CHUNK_SIZE)
+
+    job_ids = await storage.lrange(queue_key, 0, -1)
+    jobs = await async_fetch_in_batches(storage, lambda job_id: AsyncJob(storage, job_id),
+                                        job_ids, chunk_size)
+    output_format = getattr(args, "format", None)
+    if output_format:
+        return list(serialize(jobs, output_format, JOB_FIELDS))
+    if not jobs:
         return "No jobs in queue {!r}".format(args.queue)
 
-    return "\n".join(result_lines)
+    return "\n".join(_format_job(job, args.pretty) for job in jobs)
 
 
-def restart(args, storage) -> str:
-    """Restart a given job"""
-    try:
-        # ignore the type on Job to avoid loads of other type errors below
-        job = Job(storage, args.job_id).fetch()  # type: ignore
-    except ValueError as e:
-        raise AntismashRunError('Job {} not found in database, {}!'.format(args.job_id, e))
+def _get_job_ids(args, storage) -> Iterator[str]:
+    """Get the IDs of all jobs selected on the command line"""
+    for job_id in args.job_ids:
+        if job_id != '-':
+            yield job_id
+            continue
+        for line in sys.stdin:
+            line = line.strip()
+            if line:
+                yield line
+
+    from_queue = getattr(args, "from_queue", None)
+    if from_queue:
+        # take a snapshot, bulk operations modify the queue while working through it
+        yield from storage.lrange(from_queue, 0, -1)
+
+
+def _fetch_selected_jobs(args, storage) -> Iterator[List[Tuple[str, Optional[Job]]]]:
+    """Fetch the jobs selected on the command line in batches
+
+    Jobs not matching the filters are dropped, jobs missing from the database
+    are returned as None.
+    """
+    chunk_size = getattr(args, "chunk_size", DEFAULT_CHUNK_SIZE)
+    filters = getattr(args, "filters", [])
 
-    if job.state not in ('queued', 'running', 'done', 'failed'):
-        raise AntismashRunError(f'Job {job.job_id} in state {job.state} cannot be restarted')
+    for chunk in chunked(_get_job_ids(args, storage), chunk_size):
+        jobs = {job.job_id: job for job in
+                fetch_in_batches(storage, lambda job_id: Job(storage, job_id), chunk, chunk_size)}
+        batch: List[Tuple[str, Optional[Job]]] = []
+        for job_id in chunk:
+            job = jobs.get(job_id)
+            if job and not all(str(getattr(job, field)) == expected for field, expected in filters):
+                continue
+            batch.append((job_id, job))
+        yield batch
 
+
+def _bulk_report(lines: List[str], succeeded: int, failed: int, action: str,
+                 skipped: int = 0) -> str:
+    """Summarise the outcome of a bulk operation
+
+    Raises an AntismashRunError if no jobs were selected, or if there were failures
+    and no job could be processed.
+    """
+    if not lines:
+        raise AntismashRunError("No matching jobs found")
+    if failed and not succeeded:
+        raise AntismashRunError("\n".join(lines))
+
+    total = succeeded + failed + skipped
+    if total > 1:
+        summary = f"{action} {succeeded} of {total} jobs"
+        if skipped:
+            summary += f", skipped {skipped}"
+        lines.append(summary)
+
+    return "\n".join(lines)
+
+
+def _restart_job(storage, pipe, job: Job, queue: str) -> None:
+    """Queue the atomic move restarting a job and its index updates on a pipeline"""
     old_queue = "jobs:{}".format(job.state)
+    old_index = index_values(job)
     job.state = 'queued'
     job.status = 'restarted'
     job.dispatcher = ''
-    job.target_queues = [args.queue]
+    job.target_queues = [queue]
     if job.download:
         job.needs_download = True
         job.target_queues.append("jobs:downloads")
 
-    storage.lrem(old_queue, value=job.job_id, count=-1)
-    storage.rpush(job.target_queues.pop(), job.job_id)
+    job.changed()
 
-    job.commit()
-    return "Restarted job {}".format(job.job_id)
+    new_queue = job.target_queues.pop()
+    move_job(storage, job, old_queue, new_queue, pipeline=pipe)
+    update_job_index(pipe, job.job_id, old_index, index_values(job))
+    update_time_index(pipe, job)
 
 
-def cancel(args, storage):
-    """Cancel a job."""
-    try:
-        job = Job(storage, args.job_id)
-        job.fetch()
-    except ValueError as e:
-        raise AntismashRunError('Job {} not found in database, {}!'.format(args.job_id, e))
+def restart(args, storage) -> str:
+    """Restart the given jobs
+
+    Each job is moved atomically by a server-side script, and the script calls for a batch
+    of jobs are sent to the database in a single pipeline.
+    """
+    lines: List[str] = []
+    succeeded = failed = 0
+
+    for batch in _fetch_selected_jobs(args, storage):
+        pipe = storage.pipeline(transaction=False)
+        for job_id, job in batch:
+            if job is None:
+                lines.append(f'Job {job_id} not found in database!')
+                failed += 1
+                continue
 
-    if job.state not in ('created', 'downloading', 'validating', 'waiting', 'queued'):
-        if not args.force:
-            return "Cannot cancel job in state {}".format(job.state)
+            if job.state not in RESTARTABLE_STATES:
+                lines.append(f'Job {job.job_id} in state {job.state} cannot be restarted')
+                failed += 1
+                continue
 
-    old_state = job.state
-    job.state = args.state
-    job.status = "{}: {}".format(args.state, args.reason)
+            _restart_job(storage, pipe, job, args.queue)
+            lines.append("Restarted job {}".format(job.job_id))
+            succeeded += 1
+        pipe.execute()
 
-    storage.lrem('jobs:{}'.format(old_state), value=job.job_id, count=-1)
-    storage.lpush('jobs:{}'.format(job.state), job.job_id)
+    return _bulk_report(lines, succeeded, failed, "Restarted")
 
-    ret = "Canceled job {j.job_id} ({j.state})".format(j=job)
 
+def cancel(args, storage):
+    """Cancel the given jobs
+
+    Each job is moved atomically by a server-side script, and the script calls for a batch
+    of jobs are sent to the database in a single pipeline. Notifications for all canceled
+    jobs are sent over a single SMTP connection.
+    """
+    lines: List[str] = []
+    succeeded = failed = skipped = 0
+
+    session_context: ContextManager[Any] = nullcontext()
     if args.notify:
-        ret += '\n'
-        ret += dispatch_mail(job)
+        from smashctl import mail
+        session_context = mail.MailSession(mail.MailConfig.from_env())
+
+    with session_context as session:
+        for batch in _fetch_selected_jobs(args, storage):
+            pipe = storage.pipeline(transaction=False)
+            canceled: List[Job] = []
+            for job_id, job in batch:
+                if job is None:
+                    lines.append(f'Job {job_id} not found in database!')
+                    failed += 1
+                    continue
+
+                if job.state not in CANCELABLE_STATES and not args.force:
+                    lines.append("Cannot cancel job {} in state {}".format(job.job_id, job.state))
+                    skipped += 1
+                    continue
+
+                old_state = job.state
+                old_index = index_values(job)
+                job.state = args.state
+                job.status = "{}: {}".format(args.state, args.reason)
+                job.changed()
 
-    return ret
+                move_job(storage, job, 'jobs:{}'.format(old_state), 'jobs:{}'.format(job.state),
+                         push_left=True, pipeline=pipe)
+                update_job_index(pipe, job.job_id, old_index, index_values(job))
+                update_time_index(pipe, job)
+                lines.append("Canceled job {j.job_id} ({j.state})".format(j=job))
+                canceled.append(job)
+                succeeded += 1
+            pipe.execute()
+
+            if args.notify:
+                for job in canceled:
+                    lines.append(dispatch_mail(job, session))
+
+    return _bulk_report(lines, succeeded, failed, "Canceled", skipped)
 
 
 def notify(args, storage):
-    """Send email notification about a given job"""
-    try:
-        job = Job(storage, args.job_id)
-        job.fetch()
-    except ValueError as e:
-        raise AntismashRunError('Job {} not found in database, {}!'.format(args.job_id, e))
+    """Send email notifications about the given jobs over a single SMTP connection"""
+    if getattr(args, "parallel", 0) > 0:
+        return _notify_parallel(args, storage)
+
+    from smashctl import mail
+
+    lines: List[str] = []
+    succeeded = failed = skipped = 0
+
+    with mail.MailSession(mail.MailConfig.from_env()) as session:
+        for batch in _fetch_selected_jobs(args, storage):
+            for job_id, job in batch:
+                if job is None:
+                    lines.append(f'Job {job_id} not found in database!')
+                    failed += 1
+                    continue
+
+                lines.append(dispatch_mail(job, session))
+                if getattr(args, "error_report", False) and job.state == 'failed':
+                    mail.send_error_report(session.mail_conf, job, session)
+                    lines.append("Error report sent for job {}".format(job.job_id))
+                succeeded += 1
+
+    return _bulk_report(lines, succeeded, failed, "Notified")
 
-    return dispatch_mail(job)
 
+def _notify_parallel(args, storage):
+    """Send email notifications about the given jobs from a pool of worker threads"""
+    from smashctl import mail
+
+    missing: List[str] = []
+
+    def found_jobs():
+        for batch in _fetch_selected_jobs(args, storage):
+            for job_id, job in batch:
+                if job is None:
+                    missing.append(job_id)
+                    continue
+                yield job
+
+    report = mail.send_mails_parallel(mail.MailConfig.from_env(), found_jobs(), args.parallel,
+                                      getattr(args, "rate_limit", 0.0),
+                                      getattr(args, "error_report", False))
+
+    lines = [f'Job {job_id} not found in database!' for job_id in missing]
+    lines.extend(report.lines())
+    succeeded = len(report.sent) + len(report.skipped)
+    return _bulk_report(lines, succeeded, len(missing) + len(report.failed), "Notified")
+
+
+def dispatch_mail(job, session=None):
+    """Dispatch the actual email for a job.
+
+    :param job: Job to send the email for
+    :param session: MailSession to reuse, a new connection is made if None
+    """
+    from smashctl import mail
 
-def dispatch_mail(job):
-    """Dispatch the actual email for a job."""
     if not job.email:
         return "No email configured for job {}".format(job.job_id)
-    mail_conf = MailConfig.from_env()
 
-    send_mail(mail_conf, job)
+    if session is None:
+        mail.send_mail(mail.MailConfig.from_env(), job)
+    else:
+        mail.send_mail(session.mail_conf, job, session)
     return "Mail sent for job {j.job_id} ({j.state})".format(j=job)
+
+
+class JobWatcher:
+    """Track the state and status of a set of jobs, or of all jobs in a queue"""
+    __slots__ = (
+        'queue',
+        'tracked',
+        '_known',
+    )
+
+    def __init__(self, job_ids: List[str], queue: Optional[str] = None) -> None:
+        self.queue = queue
+        self.tracked: List[str] = list(job_ids)
+        self._known: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+
+    @property
+    def finished(self) -> bool:
+        """Whether all watched jobs have finished, never true when watching a queue"""
+        if self.queue:
+            return False
+        for job_id in self.tracked:
+            if job_id not in self._known:
+                return False
+            state, status = self._known[job_id]
+            if state is not None and state not in FINISHED_STATES:
+                return False
+        return True
+
+    def update(self, storage, job_ids: Optional[List[str]] = None) -> List[str]:
+        """Re-read jobs from the database and describe what changed
+
+        :param storage: A Redis instance connected to the database
+        :param job_ids: Only re-read these jobs, if None the queue and all tracked jobs are read
+        :return: A line of text per change
+        """
+        lines: List[str] = []
+        if job_ids is None:
+            if self.queue:
+                lines, _ = self._read_queue(storage)
+            job_ids = self.tracked
+        return lines + self._read_jobs(storage, job_ids)
+
+    def update_queue(self, storage) -> List[str]:
+        """Re-read the members of the watched queue, only reading the jobs that joined it
+
+        :param storage: A Redis instance connected to the database
+        :return: A line of text per change
+        """
+        lines, joined = self._read_queue(storage)
+        return lines + self._read_jobs(storage, joined)
+
+    def _read_queue(self, storage) -> Tuple[List[str], List[str]]:
+        """Update the tracked jobs from the queue, returning the changes and joined jobs"""
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        lines: List[str] = []
+        members = storage.lrange(self.queue, 0, -1)
+        current = set(members)
+        for job_id in self.tracked:
+            if job_id not in current:
+                lines.append(f"{timestamp} {job_id}\tleft {self.queue}")
+                self._known.pop(job_id, None)
+        known = set(self.tracked)
+        joined = [job_id for job_id in members if job_id not in known]
+        for job_id in joined:
+            lines.append(f"{timestamp} {job_id}\tjoined {self.queue}")
+        self.tracked = members
+        return lines, joined
+
+    def _read_jobs(self, storage, job_ids: List[str]) -> List[str]:
+        """Read the state and status of jobs, describing the ones that changed"""
+        if not job_ids:
+            return []
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        lines: List[str] = []
+        pipe = storage.pipeline(transaction=False)
+        for job_id in job_ids:
+            pipe.hmget(f"job:{job_id}", "state", "status")
+        for job_id, (state, status) in zip(job_ids, pipe.execute()):
+            if self._known.get(job_id) == (state, status):
+                continue
+            self._known[job_id] = (state, status)
+            if state is None and status is None:
+                lines.append(f"{timestamp} {job_id}\tnot found")
+            else:
+                lines.append(f"{timestamp} {job_id}\t{state}\t{status}")
+        return lines
+
+
+def _keyspace_notifications_enabled(storage) -> bool:
+    """Check if the server publishes the keyspace events needed to watch jobs"""
+    try:
+        flags = storage.config_get('notify-keyspace-events').get('notify-keyspace-events', '')
+    except ResponseError:
+        # CONFIG is often disabled for non-admin users
+        return False
+    return 'K' in flags and ('A' in flags or ('h' in flags and 'l' in flags))
+
+
+def _watch_notifications(storage, watcher: JobWatcher, deadline: Optional[float],
+                         queue_interval: float = QUEUE_REFRESH_INTERVAL) -> Iterator[str]:
+    """Follow the watched jobs via keyspace notifications
+
+    A job's event only re-reads that job. Events of a watched queue are debounced, the
+    queue is re-read at most once per queue_interval seconds, however busy it is.
+    """
+    db = storage.connection_pool.connection_kwargs.get('db', 0)
+    prefix = f"__keyspace@{db}__:"
+    pubsub = storage.pubsub(ignore_subscribe_messages=True)
+    subscribed: set = set()
+
+    def sync_subscriptions() -> None:
+        wanted = {f"{prefix}job:{job_id}" for job_id in watcher.tracked}
+        if watcher.queue:
+            wanted.add(prefix + watcher.queue)
+        if wanted - subscribed:
+            pubsub.subscribe(*(wanted - subscribed))
+        if subscribed - wanted:
+            pubsub.unsubscribe(*(subscribed - wanted))
+        subscribed.clear()
+        subscribed.update(wanted)
+
+    try:
+        sync_subscriptions()
+        # catch changes that happened before the subscriptions were active
+        yield from watcher.update(storage)
+        queue_read = time.monotonic()
+        queue_changed = False
+
+        while not watcher.finished and (deadline is None or time.monotonic() < deadline):
+            timeout = 1.0
+            if queue_changed:
+                timeout = max(0.0, min(timeout, queue_read + queue_interval - time.monotonic()))
+            message = pubsub.get_message(timeout=timeout)
+            if message is not None:
+                key = message['channel'][len(prefix):]
+                if key == watcher.queue:
+                    queue_changed = True
+                else:
+                    job_id = key.split(":", 1)[-1]
+                    if job_id in watcher.tracked:
+                        yield from watcher.update(storage, [job_id])
+
+            if queue_changed and time.monotonic() - queue_read >= queue_interval:
+                queue_changed = False
+                queue_read = time.monotonic()
+                yield from watcher.update_queue(storage)
+                sync_subscriptions()
+    finally:
+        pubsub.close()
+
+
+def _watch_polling(storage, watcher: JobWatcher, deadline: Optional[float],
+                   interval: float, max_interval: float) -> Iterator[str]:
+    """Follow the watched jobs by polling, backing off while nothing changes"""
+    delay = interval
+    while not watcher.finished:
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            delay = min(delay, remaining)
+        time.sleep(delay)
+
+        lines = watcher.update(storage)
+        if lines:
+            delay = interval
+            yield from lines
+        else:
+            delay = min(delay * 2, max_interval)
+
+
+def watch(args, storage) -> Iterator[str]:
+    """Print state and status changes of jobs as they happen
+
+    Uses Redis keyspace notifications if the server has them enabled, and falls
+    back to polling with an exponential backoff otherwise and on Redis Cluster.
+    """
+    if not args.job_ids and not args.queue:
+        raise AntismashRunError("Need job IDs or a queue to watch")
+
+    watcher = JobWatcher(args.job_ids, args.queue)
+    deadline = time.monotonic() + args.timeout if args.timeout else None
+
+    try:
+        yield from watcher.update(storage)
+        # cluster nodes only publish the events of their own keys
+        if not is_cluster(storage) and _keyspace_notifications_enabled(storage):
+            yield from _watch_notifications(storage, watcher, deadline)
+        else:
+            yield from _watch_polling(storage, watcher, deadline, args.poll_interval,
+                                      args.max_poll_interval)
+    except KeyboardInterrupt:
+        return
+
+
+def _live_dispatchers(storage, scan_count: int, chunk_size: int) -> Set[str]:
+    """Get the names of all dispatchers that have a control entry and are running"""
+    names = sorted(set(key.split(":", 1)[-1] for key in
+                       scan_keys(storage, "control:*", scan_count)))
+    controls = fetch_in_batches(storage, lambda name: Control(storage, name, 0), names, chunk_size)
+    return {control.name for control in controls if control.running}
+
+
+def _reap_reason(job: Job, dispatchers: Set[str], cutoff: float) -> Optional[str]:
+    """Explain why a running job needs reaping, or return None if it is fine"""
+    if job.dispatcher not in dispatchers:
+        return f"orphaned\tdispatcher {job.dispatcher!r} is gone"
+    last_changed = to_timestamp(job.last_changed)
+    if last_changed is None or last_changed < cutoff:
+        return f"stale\tlast changed {job.last_changed}"
+    return None
+
+
+def reap(args, storage) -> Iterator[str]:
+    """Report and optionally requeue orphaned or stuck running jobs
+
+    The running queue is checked against the live dispatchers in one pass, fetching
+    chunk_size jobs per pipelined round trip. Jobs to requeue are fetched again and
+    re-checked right before being restarted, one pipeline per batch, so jobs picked
+    up by a dispatcher in the meantime are left alone.
+    """
+    chunk_size = getattr(args, "chunk_size", DEFAULT_CHUNK_SIZE)
+    scan_count = getattr(args, "scan_count", DEFAULT_SCAN_COUNT)
+    dispatchers = _live_dispatchers(storage, scan_count, chunk_size)
+    cutoff = (datetime.now(UTC) - args.stale_for).timestamp()
+
+    total = orphaned = stale = 0
+    reapable: List[str] = []
+    for chunk in chunked(iterate_list(storage, RUNNING_QUEUE, chunk_size), chunk_size):
+        jobs = {job.job_id: job for job in
+                fetch_in_batches(storage, lambda job_id: Job(storage, job_id), chunk, chunk_size)}
+        for job_id in chunk:
+            total += 1
+            job = jobs.get(job_id)
+            if job is None:
+                yield f"{job_id}\tmissing\tnot found in database"
+                continue
+            reason = _reap_reason(job, dispatchers, cutoff)
+            if reason is None:
+                continue
+            if reason.startswith("orphaned"):
+                orphaned += 1
+            else:
+                stale += 1
+            reapable.append(job_id)
+            yield f"{job_id}\t{reason}"
+
+    yield f"Found {orphaned} orphaned and {stale} stale of {total} running jobs"
+
+    if not args.requeue:
+        return
+    if args.limit:
+        reapable = reapable[:args.limit]
+
+    requeued = 0
+    for chunk in chunked(reapable, chunk_size):
+        pipe = storage.pipeline(transaction=False)
+        jobs = fetch_in_batches(storage, lambda job_id: Job(storage, job_id), chunk, chunk_size)
+        for job in jobs:
+            if job.state != 'running' or _reap_reason(job, dispatchers, cutoff) is None:
+                continue
+            _restart_job(storage, pipe, job, args.queue)
+            requeued += 1
+            yield f"Requeued job {job.job_id}"
+        pipe.execute()
+
+    yield f"Requeued {requeued} jobs"
+
+
+def _finished_before(fields: Dict[str, str], cutoff: float) -> bool:
+    """Check if a job hash was last changed before a UNIX timestamp"""
+    raw = fields.get('last_changed') or fields.get('added')
+    try:
+        return raw is not None and parse_timestamp(raw) < cutoff
+    except ValueError:
+        return False
+
+
+def _expiry(fields: Dict[str, str], cutoff: float, expire: int) -> int:
+    """Get the TTL for a job that is expire seconds past the archiving cutoff"""
+    raw = fields.get('last_changed') or fields.get('added')
+    try:
+        left = parse_timestamp(raw) - cutoff if raw else 0.0
+    except ValueError:
+        left = 0.0
+    return int(max(left, 0.0)) + expire
+
+
+def archive(args, storage) -> Iterator[str]:
+    """Move finished jobs that haven't changed for a while to the local archive
+
+    The done and failed queues are walked from their tail, where the oldest jobs are, one
+    window of chunk_size jobs at a time. The old jobs of a window are appended to the
+    archive and synced to disk first. Then each of them is removed from the database and
+    its queue by a server-side script, unless it changed since it was read, and the
+    removed jobs are taken out of the indexes. Entries of jobs whose hash is gone are
+    dropped the same way, along with their time index and state index entries; the other
+    index sets only know their values, `index rebuild` drops those.
+
+    With expire_remaining, the jobs too new to be archived get a TTL that runs out
+    expire_remaining after they became old enough to archive, so a job only expires
+    unarchived if archive didn't run for that long.
+    """
+    require_standalone(storage, "Archiving jobs")
+    chunk_size = getattr(args, "chunk_size", DEFAULT_CHUNK_SIZE)
+    cutoff = (datetime.now(UTC) - args.older_than).timestamp()
+    expire = int(args.expire_remaining.total_seconds()) if args.expire_remaining else 0
+    job_archive = JobArchive(args.archive)
+    policy = get_retry_policy(storage)
+
+    total = 0
+    for queue in ARCHIVE_QUEUES:
+        archived = dropped = expiring = kept = 0
+        while True:
+            # entries already looked at and kept stay at the tail, skip over them
+            window = policy.call(lambda: storage.lrange(queue, -(kept + chunk_size),
+                                                        -(kept + 1)))
+            if not window:
+                break
+            job_ids = list(dict.fromkeys(window))
+
+            def fetch_hashes() -> List[Dict[str, str]]:
+                pipe = storage.pipeline(transaction=False)
+                for job_id in job_ids:
+                    pipe.hgetall(f"job:{job_id}")
+                return pipe.execute()
+
+            hashes = dict(zip(job_ids, policy.call(fetch_hashes)))
+            old = [(job_id, fields) for job_id, fields in hashes.items()
+                   if fields and _finished_before(fields, cutoff)]
+            job_archive.append(old)
+            # with empty fields, the script only drops the entries while the hash is missing
+            missing = [(job_id, {}) for job_id, fields in hashes.items() if not fields]
+
+            pipe = storage.pipeline(transaction=False)
+            for job_id, fields in old + missing:
+                remove_archived_job(storage, job_id, queue, fields, pipe)
+            removed = {job_id for (job_id, _), reply in zip(old + missing, pipe.execute())
+                       if reply}
+
+            pipe = storage.pipeline(transaction=False)
+            for job_id, fields in old + missing:
+                if job_id in removed:
+                    values = {field: fields.get(field) or None for field in INDEXED_FIELDS}
+                    if not fields:
+                        values['state'] = queue.split(":", 1)[1]
+                    update_job_index(pipe, job_id, values, {})
+                    remove_from_time_index(pipe, job_id)
+            remaining = [(job_id, fields) for job_id, fields in hashes.items()
+                         if fields and job_id not in removed]
+            if expire:
+                for job_id, fields in remaining:
+                    expire_nx(storage, f"job:{job_id}",
+                              _expiry(fields, cutoff, expire), pipe)
+            replies = pipe.execute()
+            if expire:
+                expiring += sum(1 for reply in replies[len(replies) - len(remaining):] if reply)
+
+            archived += sum(1 for job_id, _ in old if job_id in removed)
+            dropped += sum(1 for job_id, _ in missing if job_id in removed)
+            # all entries of removed jobs are gone, the others stay in the window
+            kept += sum(1 for job_id in window if job_id not in removed)
+            if len(window) < chunk_size:
+                break
+
+        total += archived
+        line = f"Archived {archived} jobs from {queue}"
+        if dropped:
+            line += f", dropped {dropped} entries of missing jobs"
+        if expire:
+            line += f", {expiring} remaining jobs will expire"
+        yield line
+
+    yield f"Archived {total} jobs to {job_archive.path}"
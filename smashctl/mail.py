@@ -1,20 +1,34 @@
 """Email sending"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from email.mime.text import MIMEText
+from functools import lru_cache
 import smtplib
 import os
+import threading
+import time
 from smashctl.common import AntismashRunError
 from smashctl.messages import (
-    message_template,
-    success_template,
-    failure_template,
+    ERROR_MESSAGE,
+    ERROR_SUBJECT,
+    FAILURE,
+    MESSAGE,
+    SUBJECT,
+    SUCCESS,
+    job_row,
 )
 
 
+DEFAULT_MAX_MESSAGES = 100
+# number of distinct configurations to keep prepared message renderers for
+RENDERER_CACHE_SIZE = 8
+
+
 class MailConfig:
     __slots__ = (
         'base_url',
         'configured',
         'encrypt',
+        'max_messages',
         'password',
         'port',
         'sender',
@@ -35,6 +49,8 @@ class MailConfig:
 
         config.base_url = os.environ.get("SMASHCTL_BASE_URL", "https://antismash.secondarymetabolites.org")
         config.encrypt = os.environ.get("SMASHCTL_EMAIL_ENCRYPT", "no")
+        config.max_messages = int(os.environ.get("SMASHCTL_EMAIL_MAX_MESSAGES",
+                                                 DEFAULT_MAX_MESSAGES))
         config.password = os.environ.get("SMASHCTL_EMAIL_PASSWORD", "")
         config.port = os.environ.get("SMASHCTL_EMAIL_PORT", 587)
         config.sender = os.environ.get("SMASHCTL_EMAIL_FROM", "noreply@secondarymetabolites.org")
@@ -57,6 +73,7 @@ class MailConfig:
 
         config.base_url = args.base_url
         config.encrypt = args.encrypt
+        config.max_messages = getattr(args, "max_messages", DEFAULT_MAX_MESSAGES)
         config.password = args.password
         config.port = args.port
         config.sender = args.sender
@@ -68,42 +85,295 @@ class MailConfig:
         config.configured = True
         return config
 
+    def values(self):
+        """Get all settings as a tuple, equal for configs with equal settings"""
+        return tuple(getattr(self, name, None) for name in self.__slots__)
 
-def send_mail(mail_conf, job):
-    """Send an email about a job"""
-    if job.state == 'done':
-        action_string = success_template.format(j=job, c=mail_conf)
-    else:
-        action_string = failure_template.format(c=mail_conf, errors=job.status)
 
-    message_text = message_template.format(j=job, c=mail_conf, action_string=action_string)
+class MailSession:
+    """An SMTP connection that is kept open across many messages
 
-    message = MIMEText(message_text)
-    message['From'] = mail_conf.sender
-    message['To'] = job.email
-    message['Subject'] = "Your {c.tool} job {j.job_id} finished.".format(j=job, c=mail_conf)
-    handle_send(mail_conf, message)
+    The connection is opened on the first message, re-established if the server
+    disconnects and recycled after max_messages messages.
+    """
+    __slots__ = (
+        'mail_conf',
+        'max_messages',
+        '_sent',
+        '_server',
+    )
 
+    def __init__(self, mail_conf, max_messages=None):
+        self.mail_conf = mail_conf
+        self.max_messages = max_messages or getattr(mail_conf, 'max_messages', DEFAULT_MAX_MESSAGES)
+        self._sent = 0
+        self._server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _connect(self):
+        """Connect and log in to the SMTP server"""
+        mail_conf = self.mail_conf
+        if not mail_conf.configured:
+            raise AntismashRunError('Email sending is not configured')
+
+        if mail_conf.encrypt == 'no':
+            server = smtplib.SMTP(mail_conf.server, mail_conf.port)
+        elif mail_conf.encrypt == 'tls':
+            server = smtplib.SMTP(mail_conf.server, mail_conf.port)
+            server.starttls()
+        elif mail_conf.encrypt == 'ssl':
+            server = smtplib.SMTP_SSL(mail_conf.server)
+        else:
+            raise AntismashRunError('Invalid email encryption configuration')
+
+        if mail_conf.encrypt != 'no' and mail_conf.username != '' and mail_conf.password != '':
+            server.login(mail_conf.username, mail_conf.password)
+
+        self._server = server
+        self._sent = 0
+
+    def send(self, message):
+        """Send a message, (re-)connecting to the server if needed
+
+        :param message: MIMEText object
+        """
+        if self._server is not None and self._sent >= self.max_messages:
+            self.close()
+        if self._server is None:
+            self._connect()
+
+        try:
+            self._server.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            self._server = None
+            self._connect()
+            self._server.send_message(message)
+        self._sent += 1
+
+    def close(self):
+        """Close the connection to the server, if open"""
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except smtplib.SMTPServerDisconnected:
+            pass
+        self._server = None
 
-def handle_send(mail_conf, message):
-    """Connect to the SMTP server and send the message
+
+class RecipientRateLimiter:
+    """Enforce a minimum interval between two messages to the same recipient"""
+    __slots__ = (
+        'interval',
+        '_lock',
+        '_next_slot',
+    )
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, recipient):
+        """Block until a message may be sent to the recipient"""
+        if self.interval <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(recipient, now))
+            self._next_slot[recipient] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class MailReport:
+    """Outcome of sending notifications for a set of jobs"""
+    __slots__ = (
+        'failed',
+        'sent',
+        'skipped',
+    )
+
+    def __init__(self):
+        self.sent = []
+        self.skipped = []
+        self.failed = {}
+
+    def lines(self):
+        """Generate one line of text per job"""
+        for job in self.sent:
+            yield "Mail sent for job {j.job_id} ({j.state})".format(j=job)
+        for job in self.skipped:
+            yield "No email configured for job {}".format(job.job_id)
+        for job_id, error in self.failed.items():
+            yield "Failed to send mail for job {}: {}".format(job_id, error)
+
+
+def send_mails_parallel(mail_conf, jobs, workers, rate_limit=0.0, error_reports=False):
+    """Render and send notifications for many jobs using a pool of worker threads
+
+    Every worker thread keeps its own MailSession, so at most `workers` SMTP
+    connections are open at the same time.
 
     :param mail_conf: MailConfig object
-    :param message: MIMEText object
+    :param jobs: Iterable of jobs to send notifications for
+    :param workers: Number of worker threads and SMTP connections
+    :param rate_limit: Minimum number of seconds between two mails to the same recipient
+    :param error_reports: Also send a report to the support address for failed jobs
+    :return: MailReport object
     """
-    if mail_conf.encrypt == 'no':
-        server = smtplib.SMTP(mail_conf.server, mail_conf.port)
-    elif mail_conf.encrypt == 'tls':
-        server = smtplib.SMTP(mail_conf.server, mail_conf.port)
-        server.starttls()
-    elif mail_conf.encrypt == 'ssl':
-        server = smtplib.SMTP_SSL(mail_conf.server)
+    report = MailReport()
+    limiter = RecipientRateLimiter(rate_limit)
+    local = threading.local()
+    sessions = []
+    sessions_lock = threading.Lock()
+
+    def get_session():
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = MailSession(mail_conf)
+            local.session = session
+            with sessions_lock:
+                sessions.append(session)
+        return session
+
+    def send(job):
+        if job.email:
+            limiter.wait(job.email)
+            send_mail(mail_conf, job, get_session())
+        if error_reports and job.state == 'failed':
+            send_error_report(mail_conf, job, get_session())
+
+    def collect(done):
+        for future in done:
+            job = pending.pop(future)
+            try:
+                future.result()
+                report.sent.append(job)
+            except (AntismashRunError, smtplib.SMTPException, OSError) as err:
+                report.failed[job.job_id] = str(err)
+
+    pending = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for job in jobs:
+                if not job.email and not (error_reports and job.state == 'failed'):
+                    report.skipped.append(job)
+                    continue
+                # keep the number of queued messages bounded
+                if len(pending) >= workers * 4:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending[executor.submit(send, job)] = job
+            done, _ = wait(pending)
+            collect(done)
+    finally:
+        for session in sessions:
+            session.close()
+
+    return report
+
+
+class MessageRenderer:
+    """Notification templates with the values of one MailConfig already filled in"""
+    __slots__ = (
+        'error_message',
+        'error_subject',
+        'failure',
+        'mail_conf',
+        'message',
+        'subject',
+        'success',
+    )
+
+    def __init__(self, mail_conf):
+        self.mail_conf = mail_conf
+        self.message = MESSAGE.bind("c", mail_conf)
+        self.success = SUCCESS.bind("c", mail_conf)
+        self.failure = FAILURE.bind("c", mail_conf)
+        self.subject = SUBJECT.bind("c", mail_conf)
+        self.error_message = ERROR_MESSAGE.bind("c", mail_conf)
+        self.error_subject = ERROR_SUBJECT.bind("c", mail_conf)
+
+    def user_message(self, job):
+        """Create the notification message for the user who submitted a job"""
+        row = job_row(job)
+        if job.state == 'done':
+            action_string = self.success.render(row)
+        else:
+            action_string = self.failure.render((job.status,))
+
+        message = MIMEText(self.message.render(row + (action_string,)))
+        message['From'] = self.mail_conf.sender
+        message['To'] = job.email
+        message['Subject'] = self.subject.render(row)
+        return message
+
+    def error_report(self, job):
+        """Create the failure report for a job sent to the support address"""
+        row = job_row(job)
+        # warnings and backtraces are not kept in the database
+        text = self.error_message.render(row + (job.status, "Not available", "Not available"))
+
+        message = MIMEText(text)
+        message['From'] = self.mail_conf.sender
+        message['To'] = self.mail_conf.support
+        message['Subject'] = self.error_subject.render(row)
+        return message
+
+
+@lru_cache(maxsize=RENDERER_CACHE_SIZE)
+def _renderer_for(values):
+    """Create the MessageRenderer for a tuple of MailConfig settings"""
+    config = MailConfig()
+    for name, value in zip(MailConfig.__slots__, values):
+        setattr(config, name, value)
+    return MessageRenderer(config)
+
+
+def get_renderer(mail_conf):
+    """Get the MessageRenderer for a MailConfig, shared by all configs with the same settings"""
+    return _renderer_for(mail_conf.values())
+
+
+def send_mail(mail_conf, job, session=None):
+    """Send an email about a job
+
+    :param mail_conf: MailConfig object
+    :param job: Job to send the notification for
+    :param session: MailSession to send the message over, a new connection is used if None
+    """
+    message = get_renderer(mail_conf).user_message(job)
+    if session is None:
+        handle_send(mail_conf, message)
+    else:
+        session.send(message)
+
+
+def send_error_report(mail_conf, job, session=None):
+    """Send a report about a failed job to the support address
+
+    :param mail_conf: MailConfig object
+    :param job: Job to send the report for
+    :param session: MailSession to send the message over, a new connection is used if None
+    """
+    message = get_renderer(mail_conf).error_report(job)
+    if session is None:
+        handle_send(mail_conf, message)
     else:
-        raise AntismashRunError('Invalid email encryption configuration')
+        session.send(message)
 
-    if mail_conf.encrypt != 'no' and mail_conf.username != '' and mail_conf.password != '':
-        server.login(mail_conf.username, mail_conf.password)
 
-    server.send_message(message)
-    server.quit()
+def handle_send(mail_conf, message):
+    """Connect to the SMTP server and send a single message
 
+    :param mail_conf: MailConfig object
+    :param message: MIMEText object
+    """
+    with MailSession(mail_conf, max_messages=1) as session:
+        session.send(message)
@@ -1,4 +1,6 @@
 """Message templates for antiSMASH notifications."""
+from string import Formatter
+from typing import Any, Sequence
 
 message_template = """Dear {c.tool} user,
 
@@ -40,3 +42,105 @@ Backtrace:
 {backtrace}
 """
 
+
+subject_template = "Your {c.tool} job {j.job_id} finished."
+
+error_subject_template = "{c.tool} job {j.job_id} failed"
+
+
+class CompiledTemplate:
+    """A str.format style template that is parsed once and rendered from plain tuples
+
+    Every replacement field must either be one of the given columns, in which case its value
+    is taken from the matching position of the row passed to render(), or be bound to an
+    object's attributes once via bind().
+    """
+    __slots__ = (
+        'columns',
+        'fields',
+        '_indices',
+        '_literals',
+    )
+
+    def __init__(self, template: str, columns: Sequence[str] = ()) -> None:
+        literals = [""]
+        fields = []
+        for literal, field, spec, conversion in Formatter().parse(template):
+            literals[-1] += literal
+            if field is None:
+                continue
+            if spec or conversion:
+                raise ValueError(f"Unsupported format specification in field {field!r}")
+            fields.append(field)
+            literals.append("")
+
+        self.columns = tuple(columns)
+        self._set_parts(fields, literals)
+
+    def _set_parts(self, fields: Sequence[str], literals: Sequence[str]) -> None:
+        self.fields = tuple(fields)
+        self._literals = tuple(literals)
+        self._indices = tuple(self.columns.index(field) if field in self.columns else None
+                              for field in self.fields)
+
+    def bind(self, prefix: str, obj: Any) -> "CompiledTemplate":
+        """Fill in all fields starting with prefix from the attributes of obj
+
+        :param prefix: Name of the object in the template, e.g. "c" for "{c.tool}"
+        :param obj: The object to take the values from
+        :return: A new template with the remaining fields
+        """
+        literals = [self._literals[0]]
+        fields = []
+        for field, literal in zip(self.fields, self._literals[1:]):
+            name, _, attribute = field.partition(".")
+            if name == prefix and attribute:
+                literals[-1] += f"{getattr(obj, attribute)}{literal}"
+                continue
+            fields.append(field)
+            literals.append(literal)
+
+        bound = CompiledTemplate("", self.columns)
+        bound._set_parts(fields, literals)
+        return bound
+
+    def render(self, row: Sequence[Any]) -> str:
+        """Render the template
+
+        :param row: Values of the template's columns, in the order of self.columns
+        """
+        parts = [self._literals[0]]
+        for field, index, literal in zip(self.fields, self._indices, self._literals[1:]):
+            if index is None:
+                raise ValueError(f"Unbound template field {field!r}")
+            parts.append(f"{row[index]}")
+            parts.append(literal)
+        return "".join(parts)
+
+
+# job attributes used by the templates, rows are created with job_row()
+JOB_COLUMNS = (
+    'job_id',
+    'added',
+    'dispatcher',
+    'email',
+    'filename',
+    'gff3',
+    'state',
+    'status',
+)
+_JOB_FIELDS = tuple(f"j.{column}" for column in JOB_COLUMNS)
+
+
+def job_row(job: Any) -> tuple:
+    """Extract the values of all JOB_COLUMNS from a job"""
+    return tuple(getattr(job, column) for column in JOB_COLUMNS)
+
+
+MESSAGE = CompiledTemplate(message_template, _JOB_FIELDS + ("action_string",))
+SUCCESS = CompiledTemplate(success_template, _JOB_FIELDS)
+FAILURE = CompiledTemplate(failure_template, ("errors",))
+SUBJECT = CompiledTemplate(subject_template, _JOB_FIELDS)
+ERROR_MESSAGE = CompiledTemplate(error_message_template,
+                                 _JOB_FIELDS + ("errors", "warnings", "backtrace"))
+ERROR_SUBJECT = CompiledTemplate(error_subject_template, _JOB_FIELDS)
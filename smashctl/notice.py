@@ -4,11 +4,25 @@ import argparse
 from datetime import date, datetime, timedelta, UTC
 import uuid
 
-from antismash_models import SyncNotice as Notice
+from antismash_models import AsyncNotice, SyncNotice as Notice
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+
+from .common import CommandResult
+from .formats import add_format_argument, serialize
+from .storage import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_SCAN_COUNT,
+    async_fetch_in_batches,
+    async_scan_keys,
+    fetch_in_batches,
+    get_retry_policy,
+    scan_keys,
+)
 
 
 DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+NOTICE_FIELDS = ('notice_id',) + Notice.PROPERTIES + Notice.ATTRIBUTES
 SELECTABLE_CATEGORIES = ['error', 'warning', 'info']
 
 
@@ -19,7 +33,7 @@ def register(subparsers: "argparse._SubParsersAction[argparse.ArgumentParser]")
     next_week = now + timedelta(days=7)
 
     p_notice = subparsers.add_parser("notice", help="Show and control notifications")
-    p_notice.set_defaults(func=notice_list)
+    p_notice.set_defaults(func=notice_list, async_func=async_notice_list)
 
     notice_subparser = p_notice.add_subparsers(title="notice-related commands")
 
@@ -31,7 +45,8 @@ def register(subparsers: "argparse._SubParsersAction[argparse.ArgumentParser]")
     p_list.add_argument('--category', dest='category',
                         default='all', choices=SELECTABLE_CATEGORIES + ['all'],
                         help='Category of the notices to list')
-    p_list.set_defaults(func=notice_list)
+    add_format_argument(p_list)
+    p_list.set_defaults(func=notice_list, async_func=async_notice_list)
 
     p_show = notice_subparser.add_parser("show", help="Show a single notice")
     p_show.add_argument("notice_id", help="ID of the notice to show")
@@ -39,7 +54,7 @@ def register(subparsers: "argparse._SubParsersAction[argparse.ArgumentParser]")
                         dest="pretty", default="verbose",
                         choices=["simple", "verbose"],
                         help="Modify the output style")
-    p_show.set_defaults(func=show)
+    p_show.set_defaults(func=show, async_func=async_show)
 
     p_add = notice_subparser.add_parser("add", help="Add a notice")
     p_add.add_argument("teaser", help="Teaser text for the notice")
@@ -53,11 +68,11 @@ def register(subparsers: "argparse._SubParsersAction[argparse.ArgumentParser]")
     p_add.add_argument('--show-until', dest='show_until',
                        default=next_week, type=_parsedate,
                        help="Time to stop showing the notice in YYYY-MM-DD HH:MM:SS format")
-    p_add.set_defaults(func=add)
+    p_add.set_defaults(func=add, async_func=async_add)
 
     p_remove = notice_subparser.add_parser("remove", help="Remove a notice")
     p_remove.add_argument("notice_id", help="ID of notice to delete")
-    p_remove.set_defaults(func=remove)
+    p_remove.set_defaults(func=remove, async_func=async_remove)
 
 
 def _parsedate(datestring: str) -> datetime:
@@ -106,14 +121,25 @@ To: {notice.show_until.strftime(DATE_FORMAT)}
     raise ValueError(f"Invalid format option {pretty}")
 
 
-def notice_list(args: argparse.Namespace, storage: Redis) -> str:
+def notice_list(args: argparse.Namespace, storage: Redis) -> CommandResult:
     """ List a selection of configured notices """
-    notices: list[str] = storage.keys("notice:*")
+    notices = scan_keys(storage, "notice:*", getattr(args, "scan_count", DEFAULT_SCAN_COUNT))
+
+    output_format = getattr(args, "format", None)
+    if output_format:
+        notice_ids = [key.rsplit(":", 1)[-1] for key in sorted(set(notices))]
+        selected = (notice for notice in fetch_in_batches(
+                        storage, lambda notice_id: Notice(storage, notice_id), notice_ids,
+                        getattr(args, "chunk_size", DEFAULT_CHUNK_SIZE))
+                    if args.category == "all" or args.category == notice.category)
+        return serialize(selected, output_format, NOTICE_FIELDS)
+
     result_lines: list[str] = []
 
-    for notice_id in notices:
+    for notice_id in sorted(set(notices)):
         try:
-            notice = Notice(storage, notice_id.rsplit(":", 1)[-1]).fetch()  # type: ignore
+            notice = get_retry_policy(storage).call(
+                Notice(storage, notice_id.rsplit(":", 1)[-1]).fetch)
             if args.category == "all" or args.category == notice.category:
                 result_lines.append(_format_notice(notice, args.pretty))
         except ValueError as err:  # pragma: no cover  # only happens on race conditions
@@ -125,10 +151,42 @@ def notice_list(args: argparse.Namespace, storage: Redis) -> str:
     return "\n".join(result_lines)
 
 
+async def async_notice_list(args: argparse.Namespace, storage: AsyncRedis) -> CommandResult:
+    """ List a selection of configured notices, fetching them concurrently """
+    keys = {key async for key in async_scan_keys(
+        storage, "notice:*", getattr(args, "scan_count", DEFAULT_SCAN_COUNT))}
+    notice_ids = [key.rsplit(":", 1)[-1] for key in sorted(keys)]
+    notices = await async_fetch_in_batches(
+        storage, lambda notice_id: AsyncNotice(storage, notice_id), notice_ids,
+        getattr(args, "chunk_size", DEFAULT_CHUNK_SIZE))
+
+    selected = [notice for notice in notices
+                if args.category == "all" or args.category == notice.category]
+    output_format = getattr(args, "format", None)
+    if output_format:
+        return list(serialize(selected, output_format, NOTICE_FIELDS))
+
+    result_lines = [_format_notice(notice, args.pretty) for notice in selected]
+    if not result_lines:
+        return "No notices to display"
+
+    return "\n".join(result_lines)
+
+
 def show(args: argparse.Namespace, storage: Redis) -> str:
     """ Show a single notice """
     try:
-        notice = Notice(storage, args.notice_id).fetch()  # type: ignore
+        notice = get_retry_policy(storage).call(Notice(storage, args.notice_id).fetch)
+    except ValueError as err:
+        return f"Notice {args.notice_id} not found in database: {err}"
+
+    return _format_notice(notice, args.pretty)
+
+
+async def async_show(args: argparse.Namespace, storage: AsyncRedis) -> str:
+    """ Show a single notice, asyncio version """
+    try:
+        notice = await AsyncNotice(storage, args.notice_id).fetch()  # type: ignore
     except ValueError as err:
         return f"Notice {args.notice_id} not found in database: {err}"
 
@@ -149,12 +207,37 @@ def add(args: argparse.Namespace, storage: Redis) -> str:
     return "Created new notice:\n" + _format_notice(notice, "verbose")
 
 
+async def async_add(args: argparse.Namespace, storage: AsyncRedis) -> str:
+    """ Add a new notice, asyncio version """
+    notice_id = str(uuid.uuid4())
+    notice = AsyncNotice(storage, notice_id)
+    notice.teaser = args.teaser
+    notice.text = args.text
+    notice.category = args.category
+    notice.show_from = args.show_from
+    notice.show_until = args.show_until
+    await notice.commit()  # type: ignore
+
+    return "Created new notice:\n" + _format_notice(notice, "verbose")
+
+
 def remove(args: argparse.Namespace, storage: Redis) -> str:
     """ Remove an existing notice """
     try:
-        notice = Notice(storage, args.notice_id).fetch()  # type: ignore
+        notice = get_retry_policy(storage).call(Notice(storage, args.notice_id).fetch)
         notice.delete()
     except ValueError as err:
         return f"Notice {args.notice_id} not found in database: {err}"
 
     return f"Removed notice: {notice.teaser}"
+
+
+async def async_remove(args: argparse.Namespace, storage: AsyncRedis) -> str:
+    """ Remove an existing notice, asyncio version """
+    try:
+        notice = await AsyncNotice(storage, args.notice_id).fetch()  # type: ignore
+        await notice.delete()
+    except ValueError as err:
+        return f"Notice {args.notice_id} not found in database: {err}"
+
+    return f"Removed notice: {notice.teaser}"
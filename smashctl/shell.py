@@ -0,0 +1,165 @@
+"""Interactive shell and batch mode
+
+Both run many smashctl command lines in one process, sharing a single Redis
+connection pool and the already imported subcommand modules.
+"""
+
+import argparse
+import shlex
+import sys
+from typing import Dict, List, Optional, TextIO
+
+from redis import Redis
+
+from .__main__ import build_parser, find_subcommand
+from .common import AntismashRunError, execute_command
+
+
+PROMPT = "smashctl> "
+EXIT_COMMANDS = ("exit", "quit")
+# global options that are taken from the shell's own command line
+SHARED_OPTIONS = ('db', 'chunk_size', 'scan_count', 'archive', 'history')
+
+
+def register(subparsers: "argparse._SubParsersAction[argparse.ArgumentParser]") \
+        -> None:  # pragma: no cover
+    """Register the shell and batch subcommands"""
+    p_batch = subparsers.add_parser(
+        "batch", help="Run smashctl commands from a file over one connection")
+    p_batch.add_argument("file", help="File with one command per line, '-' to read from stdin")
+    p_batch.add_argument("-k", "--keep-going", action="store_true", default=False,
+                         help="Run the remaining commands after a command failed")
+    p_batch.set_defaults(func=batch, async_func=None)
+
+    p_shell = subparsers.add_parser(
+        "shell", help="Run smashctl commands interactively over one connection")
+    p_shell.set_defaults(func=shell, async_func=None)
+
+
+class CommandRunner:
+    """Runs smashctl command lines against one shared connection
+
+    Lines are parsed like command lines, without the leading 'smashctl'. The global
+    options of the session apply to all lines, and --async is ignored. A line can't
+    pick another database with --db, all lines share the session's connection.
+    """
+    __slots__ = (
+        'defaults',
+        'storage',
+        '_parsers',
+    )
+
+    def __init__(self, args: argparse.Namespace, storage: Redis) -> None:
+        self.defaults = {option: getattr(args, option) for option in SHARED_OPTIONS
+                         if hasattr(args, option)}
+        self.storage = storage
+        self._parsers: Dict[Optional[str], argparse.ArgumentParser] = {}
+
+    def _get_parser(self, argv: List[str]) -> argparse.ArgumentParser:
+        """Get the parser for a command line, building it once per subcommand"""
+        subcommand = find_subcommand(argv)
+        parser = self._parsers.get(subcommand)
+        if parser is None:
+            parser = build_parser(argv)
+            parser.set_defaults(**self.defaults)
+            self._parsers[subcommand] = parser
+        return parser
+
+    def run(self, line: str) -> bool:
+        """Run a single command line
+
+        :return: True if the command succeeded or the line was empty, False otherwise
+        """
+        try:
+            argv = shlex.split(line, comments=True)
+        except ValueError as err:
+            print("ERROR: ", err, file=sys.stderr)
+            return False
+        if not argv:
+            return True
+
+        parser = self._get_parser(argv)
+        try:
+            args = parser.parse_args(argv)
+        except SystemExit as err:
+            # argparse exits after printing help or a usage error
+            return not err.code
+        # checked on the parsed value, so abbreviations like --d are caught as well
+        if 'db' in self.defaults and args.db != self.defaults['db']:
+            print("ERROR: ", "--db can't be changed per command, start a new session instead",
+                  file=sys.stderr)
+            return False
+        if not hasattr(args, 'func'):
+            parser.print_help()
+            return True
+        if args.func in (shell, batch):
+            print("ERROR: ", "shell and batch can't be nested", file=sys.stderr)
+            return False
+
+        try:
+            return execute_command(args.func, args, self.storage)
+        except KeyboardInterrupt:
+            # Ctrl-C stops the running command, not the session
+            print("ERROR: ", "command interrupted", file=sys.stderr)
+            return False
+        except Exception as err:  # pylint: disable=broad-except
+            # a crashing command must not end the whole session
+            print("ERROR: ", f"{type(err).__name__}: {err}", file=sys.stderr)
+            return False
+
+
+def shell(args: argparse.Namespace, storage: Redis) -> None:
+    """Read and run commands until end of input or exit"""
+    try:
+        import readline  # noqa: F401  # pylint: disable=unused-import,import-outside-toplevel
+    except ImportError:  # pragma: no cover
+        pass
+
+    runner = CommandRunner(args, storage)
+    prompt = PROMPT if sys.stdin.isatty() else ""
+    while True:
+        try:
+            line = input(prompt)
+        except EOFError:
+            if prompt:
+                print()
+            return
+        except KeyboardInterrupt:
+            print()
+            continue
+        if line.strip() in EXIT_COMMANDS:
+            return
+        runner.run(line)
+
+
+def _run_lines(runner: CommandRunner, handle: TextIO, name: str, keep_going: bool) -> None:
+    """Run all command lines of a file"""
+    failed = total = 0
+    for number, line in enumerate(handle, 1):
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
+            continue
+        total += 1
+        if runner.run(line):
+            continue
+        failed += 1
+        if not keep_going:
+            raise AntismashRunError(f"{name}:{number}: command failed, stopping")
+
+    if failed:
+        raise AntismashRunError(f"{failed} of {total} commands failed")
+
+
+def batch(args: argparse.Namespace, storage: Redis) -> None:
+    """Run the commands of a file, stopping at the first failure unless --keep-going is set"""
+    runner = CommandRunner(args, storage)
+    if args.file == "-":
+        _run_lines(runner, sys.stdin, "<stdin>", args.keep_going)
+        return
+
+    try:
+        handle = open(args.file, encoding="utf-8")
+    except OSError as err:
+        raise AntismashRunError(f"Can't read commands from {args.file}: {err.strerror}")
+    with handle:
+        _run_lines(runner, handle, args.file, args.keep_going)
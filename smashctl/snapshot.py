@@ -0,0 +1,229 @@
+"""Snapshots of the jobs, queues, dispatchers and notices
+
+A snapshot is a gzip compressed stream of JSON lines or msgpack maps. The first record
+is a header, every other record holds one hash, or one window of a list together with
+the offset of its first entry. Keys are read with SCAN and pipelined reads and written
+back with pipelined writes, one chunk at a time, so memory use doesn't grow with the
+size of the database. The secondary indexes are not part of a snapshot, run
+`smashctl index rebuild` after loading one.
+"""
+
+import argparse
+from collections import Counter
+from datetime import datetime, UTC
+import gzip
+import json
+import sys
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional
+
+from redis import Redis
+
+from .common import AntismashRunError
+from .formats import DATE_FORMAT, SERIALIZERS
+from .storage import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_SCAN_COUNT,
+    chunked,
+    get_retry_policy,
+    iterate_list,
+    scan_keys,
+)
+
+
+SNAPSHOT_PATTERNS = ("job:*", "jobs:*", "control:*", "notice:*")
+SNAPSHOT_FORMATS = ("jsonl", "msgpack")
+SNAPSHOT_TYPES = ("hash", "list")
+SNAPSHOT_VERSION = 1
+# snapshots are large and short-lived, favour speed over size
+COMPRESS_LEVEL = 1
+
+
+def register(subparsers: "argparse._SubParsersAction[argparse.ArgumentParser]") \
+        -> None:  # pragma: no cover
+    """Register the dump and load subcommands"""
+    p_dump = subparsers.add_parser(
+        "dump", help="Write jobs, queues, dispatchers and notices to a snapshot file")
+    p_dump.add_argument("file", help="File to write the snapshot to, '-' for stdout")
+    p_dump.add_argument("--format", choices=SNAPSHOT_FORMATS, default="jsonl",
+                        help="Record format of the snapshot (default: %(default)s)")
+    p_dump.set_defaults(func=dump, async_func=None)
+
+    p_load = subparsers.add_parser("load", help="Restore a snapshot written by dump")
+    p_load.add_argument("file", help="Snapshot file to read, '-' for stdin")
+    p_load.set_defaults(func=load, async_func=None)
+
+
+def _open_snapshot(path: str, mode: str) -> IO[bytes]:
+    """Open a compressed snapshot file, '-' is stdin or stdout"""
+    try:
+        if path == "-":
+            stream = sys.stdin.buffer if mode == "rb" else sys.stdout.buffer
+            return gzip.GzipFile(fileobj=stream, mode=mode, compresslevel=COMPRESS_LEVEL)
+        return gzip.open(path, mode, compresslevel=COMPRESS_LEVEL)
+    except OSError as err:
+        raise AntismashRunError(f"Can't open snapshot {path}: {err.strerror}")
+
+
+def dump_records(storage: Redis, keys: List[str], window: int,
+                 counts: Optional[Counter] = None) -> Iterator[Dict[str, Any]]:
+    """Read a chunk of keys as snapshot records
+
+    Types and TTLs of all keys are read in one pipeline, the hashes and the first window
+    of each list in a second one. Longer lists are read one window after another.
+
+    :param storage: A Redis instance connected to the database
+    :param keys: The keys to read
+    :param window: Maximum number of list entries per record
+    :param counts: Counter to add the number of dumped keys per type and skipped keys to
+    """
+    if counts is None:
+        counts = Counter()
+    policy = get_retry_policy(storage)
+
+    def fetch_types() -> List[Any]:
+        pipe = storage.pipeline(transaction=False)
+        for key in keys:
+            pipe.type(key)
+            pipe.pttl(key)
+        return pipe.execute()
+
+    replies = policy.call(fetch_types)
+    found = []
+    for key, kind, ttl in zip(keys, replies[0::2], replies[1::2]):
+        if kind in SNAPSHOT_TYPES:
+            found.append((key, kind, ttl))
+        elif kind != "none":
+            counts["skipped"] += 1
+
+    def fetch_values() -> List[Any]:
+        pipe = storage.pipeline(transaction=False)
+        for key, kind, _ in found:
+            if kind == "hash":
+                pipe.hgetall(key)
+            else:
+                pipe.lrange(key, 0, window - 1)
+        return pipe.execute()
+
+    for (key, kind, ttl), value in zip(found, policy.call(fetch_values)):
+        if not value:
+            # removed since the types were read
+            continue
+        counts[kind] += 1
+        record: Dict[str, Any] = {"key": key, "type": kind, "value": value}
+        if ttl > 0:
+            record["ttl"] = ttl
+        if kind == "hash":
+            yield record
+            continue
+
+        record["offset"] = 0
+        yield record
+        if len(value) < window:
+            continue
+        offset = len(value)
+        for segment in chunked(iterate_list(storage, key, window, start=offset), window):
+            yield {"key": key, "type": kind, "offset": offset, "value": segment}
+            offset += len(segment)
+
+
+def _write_records(handle: IO[bytes], records: Iterable[Dict[str, Any]], format_name: str,
+                   chunk_size: int) -> None:
+    """Serialize records into a file, writing one chunk of records at a time"""
+    serializer = SERIALIZERS[format_name](())
+    for chunk in chunked(serializer.serialize(records), chunk_size):
+        handle.write(b"".join(part if isinstance(part, bytes) else part.encode() + b"\n"
+                              for part in chunk))
+
+
+def _read_records(handle: IO[bytes]) -> Iterator[Dict[str, Any]]:
+    """Read the records of a snapshot, telling JSON lines and msgpack apart by the first byte"""
+    if handle.peek(1)[:1] == b"{":  # type: ignore[attr-defined]
+        for number, line in enumerate(handle, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                raise AntismashRunError(f"Invalid record on line {number} of the snapshot")
+        return
+
+    try:
+        import msgpack
+    except ImportError:
+        raise AntismashRunError("Reading msgpack snapshots requires the msgpack package")
+    try:
+        yield from msgpack.Unpacker(handle, raw=False)
+    except ValueError as err:
+        raise AntismashRunError(f"Invalid msgpack record in the snapshot: {err}")
+
+
+def queue_restore(pipe: Any, record: Dict[str, Any]) -> None:
+    """Queue the writes restoring a snapshot record
+
+    The first record of a key replaces any existing value, later list records are
+    appended to it.
+    """
+    key, kind, value = record["key"], record["type"], record["value"]
+    first = not record.get("offset")
+    if first:
+        pipe.delete(key)
+    if kind == "hash":
+        pipe.hset(key, mapping=value)
+    elif kind == "list":
+        pipe.rpush(key, *value)
+    else:
+        raise AntismashRunError(f"Unknown record type {kind!r} for {key}")
+    if first and record.get("ttl"):
+        pipe.pexpire(key, record["ttl"])
+
+
+def dump(args: argparse.Namespace, storage: Redis) -> Optional[str]:
+    """Write all jobs, queues, dispatchers and notices to a snapshot file"""
+    chunk_size = getattr(args, "chunk_size", DEFAULT_CHUNK_SIZE)
+    scan_count = getattr(args, "scan_count", DEFAULT_SCAN_COUNT)
+    counts: Counter = Counter()
+
+    def records() -> Iterator[Dict[str, Any]]:
+        yield {"snapshot": SNAPSHOT_VERSION,
+               "created": datetime.now(UTC).strftime(DATE_FORMAT)}
+        for pattern in SNAPSHOT_PATTERNS:
+            for keys in chunked(scan_keys(storage, pattern, scan_count), chunk_size):
+                yield from dump_records(storage, keys, chunk_size, counts)
+
+    with _open_snapshot(args.file, "wb") as handle:
+        _write_records(handle, records(), args.format, chunk_size)
+
+    if args.file == "-":
+        return None
+    message = f"Dumped {counts['hash']} hashes and {counts['list']} lists to {args.file}"
+    if counts["skipped"]:
+        message += f", skipped {counts['skipped']} keys of other types"
+    return message
+
+
+def load(args: argparse.Namespace, storage: Redis) -> str:
+    """Restore a snapshot, replacing the keys it contains"""
+    chunk_size = getattr(args, "chunk_size", DEFAULT_CHUNK_SIZE)
+    counts: Counter = Counter()
+
+    with _open_snapshot(args.file, "rb") as handle:
+        try:
+            records = _read_records(handle)
+            header = next(records, None)
+            if not isinstance(header, dict) or "snapshot" not in header:
+                raise AntismashRunError(f"{args.file} is not a smashctl snapshot")
+            if header["snapshot"] > SNAPSHOT_VERSION:
+                raise AntismashRunError(f"Unsupported snapshot version {header['snapshot']}")
+
+            for chunk in chunked(records, chunk_size):
+                pipe = storage.pipeline(transaction=False)
+                for record in chunk:
+                    queue_restore(pipe, record)
+                    if not record.get("offset"):
+                        counts[record["type"]] += 1
+                pipe.execute()
+        except (EOFError, gzip.BadGzipFile) as err:
+            raise AntismashRunError(f"Can't read snapshot {args.file}: {err}")
+
+    return (f"Loaded {counts['hash']} hashes and {counts['list']} lists from {args.file}, "
+            "run 'smashctl index rebuild' to update the indexes")
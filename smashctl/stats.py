@@ -0,0 +1,176 @@
+"""Queue and job statistics"""
+
+import argparse
+from collections import Counter
+from datetime import datetime, UTC
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from redis import Redis
+
+from .index import TIME_FIELDS, parse_timestamp, time_index_key
+from .storage import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_SCAN_COUNT,
+    QUEUES,
+    chunked,
+    fetch_fields_in_batches,
+    iterate_list,
+    scan_keys,
+)
+
+
+COUNTED_FIELDS = ('state', 'jobtype', 'dispatcher')
+PERCENTILES = (50, 90, 99)
+QUEUED_QUEUE = "jobs:queued"
+MISSING = "-"
+
+
+def register(subparsers: "argparse._SubParsersAction[argparse.ArgumentParser]") \
+        -> None:  # pragma: no cover
+    """Register the stats subcommand"""
+    p_stats = subparsers.add_parser("stats", help="Show queue lengths and job counts")
+    p_stats.add_argument("--sample", type=int, default=0, metavar="N",
+                         help="Estimate the job counts from N random jobs "
+                              "(default: count all jobs)")
+    p_stats.add_argument("--json", action="store_true", default=False,
+                         help="Print the statistics as JSON")
+    p_stats.set_defaults(func=stats, async_func=None)
+
+
+def _sample_job_ids(storage: Redis, sample: int) -> Optional[Tuple[List[str], int]]:
+    """Pick random job IDs from the time index
+
+    :return: The sampled job IDs and the total number of jobs, or None if the index
+             hasn't been built
+    """
+    added_index = time_index_key(TIME_FIELDS[0])
+    pipe = storage.pipeline(transaction=False)
+    pipe.zcard(added_index)
+    pipe.zrandmember(added_index, sample)
+    total, job_ids = pipe.execute()
+    if not total:
+        return None
+    return job_ids, total
+
+
+def count_jobs(storage: Redis, job_ids: Iterable[str],
+               chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, Counter]:
+    """Count the jobs per state, job type and dispatcher, fetching only those fields"""
+    counts: Dict[str, Counter] = {field: Counter() for field in COUNTED_FIELDS}
+    for _, values in fetch_fields_in_batches(storage, "job:{}", job_ids, COUNTED_FIELDS,
+                                             chunk_size):
+        for field, value in zip(COUNTED_FIELDS, values):
+            counts[field][value or MISSING] += 1
+    return counts
+
+
+def queue_ages(storage: Redis, queue: str, now: float,
+               chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[float]:
+    """Get the ages in seconds of all jobs in a queue, sorted
+
+    Jobs without an added timestamp or with one that can't be parsed are skipped.
+    """
+    ages: List[float] = []
+    for chunk in chunked(iterate_list(storage, queue, chunk_size), chunk_size):
+        pipe = storage.pipeline(transaction=False)
+        for job_id in chunk:
+            pipe.hget(f"job:{job_id}", "added")
+        for added in pipe.execute():
+            if not added:
+                continue
+            try:
+                ages.append(now - parse_timestamp(added))
+            except ValueError:
+                continue
+    return sorted(ages)
+
+
+def percentile(values: List[float], percent: float) -> Optional[float]:
+    """Get a nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(rank) - 1]
+
+
+def _format_age(seconds: Optional[float]) -> str:
+    """Format an age in seconds for humans"""
+    if seconds is None:
+        return MISSING
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days:
+        return f"{days}d {hours:02}h"
+    if hours:
+        return f"{hours}h {minutes:02}m"
+    return f"{minutes}m {secs:02}s"
+
+
+def _format_table(title: str, rows: Iterable[Tuple[str, Any]], header: str = "COUNT") -> List[str]:
+    """Format a two-column table section"""
+    return [f"{title:<32}{header:>10}"] + [f"{name:<32}{value:>10}" for name, value in rows]
+
+
+def _format_stats(result: Dict[str, Any]) -> str:
+    """Format the statistics as text tables"""
+    lines = _format_table("QUEUE", result["queues"].items())
+    for field in COUNTED_FIELDS:
+        lines.append("")
+        lines.extend(_format_table(field.upper(), sorted(result[field].items(),
+                                                         key=lambda item: (-item[1], item[0]))))
+    lines.append("")
+    lines.extend(_format_table(f"{QUEUED_QUEUE.upper()} PERCENTILE",
+                               ((name, _format_age(age)) for name, age
+                                in result["queued_age"].items()), header="AGE"))
+    if result["sampled"] < result["total"]:
+        lines.extend(["", f"Job counts estimated from {result['sampled']} of "
+                          f"{result['total']} jobs"])
+    return "\n".join(lines)
+
+
+def stats(args: argparse.Namespace, storage: Redis) -> str:
+    """Show queue lengths, job counts per state, job type and dispatcher, and queue ages
+
+    Queue lengths are fetched in one pipeline, the job counts from a full or sampled
+    pass over the job hashes that only transfers the counted fields. Samples are drawn
+    from the index:added time index, without it all jobs are counted.
+    """
+    chunk_size = getattr(args, "chunk_size", DEFAULT_CHUNK_SIZE)
+    scan_count = getattr(args, "scan_count", DEFAULT_SCAN_COUNT)
+
+    pipe = storage.pipeline(transaction=False)
+    for queue in QUEUES:
+        pipe.llen(queue)
+    queues = dict(zip(QUEUES, pipe.execute()))
+
+    sampled_ids = _sample_job_ids(storage, args.sample) if args.sample else None
+    if sampled_ids is not None:
+        job_ids, total = sampled_ids
+        counts = count_jobs(storage, job_ids, chunk_size)
+        sampled = sum(counts[COUNTED_FIELDS[0]].values())
+        if sampled:
+            scale = max(total, sampled) / sampled
+            for counter in counts.values():
+                for name in counter:
+                    counter[name] = round(counter[name] * scale)
+    else:
+        counts = count_jobs(storage, (key.split(":", 1)[-1] for key in
+                                      scan_keys(storage, "job:*", scan_count)), chunk_size)
+        sampled = total = sum(counts[COUNTED_FIELDS[0]].values())
+
+    ages = queue_ages(storage, QUEUED_QUEUE, datetime.now(UTC).timestamp(), chunk_size)
+    queued_age = {f"p{percent}": percentile(ages, percent) for percent in PERCENTILES}
+    queued_age["max"] = ages[-1] if ages else None
+
+    result: Dict[str, Any] = {
+        "queues": queues,
+        **{field: dict(counts[field]) for field in COUNTED_FIELDS},
+        "queued_age": queued_age,
+        "sampled": sampled,
+        "total": max(total, sampled),
+    }
+    if args.json:
+        return json.dumps(result, indent=2, sort_keys=True)
+    return _format_stats(result)
@@ -1,5 +1,93 @@
 """Database access functions"""
+import asyncio
+from itertools import islice
+import time
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+from urllib.parse import unquote
+from weakref import WeakKeyDictionary
+
 import redis
+import redis.asyncio
+import redis.asyncio.cluster
+import redis.cluster
+from redis.commands.core import Script
+
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_SCAN_COUNT = 1000
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 0.1
+MAX_RETRY_BACKOFF = 10.0
+DEFAULT_REDIS_PORT = 6379
+DEFAULT_SENTINEL_PORT = 26379
+
+# schemes handled by redis-py's own URL parsing
+URL_SCHEMES = ('redis', 'rediss', 'unix')
+SENTINEL_SCHEME = 'redis+sentinel'
+CLUSTER_SCHEME = 'redis+cluster'
+
+# the job states of antismash_models' Job.VALID_STATES, kept here so that importing the
+# storage helpers doesn't load the models
+JOB_STATES = ('created', 'done', 'downloading', 'failed', 'queued', 'removed', 'running',
+              'validating', 'waiting')
+# the job queues, one per job state plus the download queue
+QUEUES = tuple(f"jobs:{state}" for state in JOB_STATES) + ("jobs:downloads",)
+RUNNING_QUEUE = "jobs:running"
+
+T = TypeVar("T")
+
+# Update a job's hash and move the job between queues in one atomic step
+# KEYS[1]: job hash, KEYS[2]: queue to remove the job from, KEYS[3]: queue to add the job to
+# ARGV[1]: job ID, ARGV[2]: "left" or "right" end of the new queue, ARGV[3...]: field/value pairs
+MOVE_JOB_SCRIPT = """
+if #ARGV > 2 then
+    redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+end
+local removed = redis.call('LREM', KEYS[2], -1, ARGV[1])
+if ARGV[2] == 'left' then
+    redis.call('LPUSH', KEYS[3], ARGV[1])
+else
+    redis.call('RPUSH', KEYS[3], ARGV[1])
+end
+return removed
+"""
+
+# Delete an archived job and remove it from its queue, unless it changed since it was read
+# KEYS[1]: job hash, KEYS[2]: queue
+# ARGV[1]: job ID, ARGV[2]: state and ARGV[3]: last_changed as archived, "" if unset
+REMOVE_ARCHIVED_JOB_SCRIPT = """
+local current = redis.call('HMGET', KEYS[1], 'state', 'last_changed')
+if (current[1] or '') ~= ARGV[2] or (current[2] or '') ~= ARGV[3] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('LREM', KEYS[2], 0, ARGV[1])
+return 1
+"""
+
+# Set a TTL on a key that doesn't have one yet, like EXPIRE NX on Redis 7 and later
+# KEYS[1]: key, ARGV[1]: seconds until the key expires
+EXPIRE_NX_SCRIPT = """
+if redis.call('TTL', KEYS[1]) == -1 then
+    return redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+_SCRIPTS: "WeakKeyDictionary[redis.Redis, Dict[str, Script]]" = WeakKeyDictionary()
 
 
 class AntismashStorageError(RuntimeError):
@@ -7,9 +95,433 @@ class AntismashStorageError(RuntimeError):
     pass
 
 
-def get_storage(uri):
-    """Get a redis connection to the specified URI"""
-    if uri.startswith('redis://'):
-        return redis.Redis.from_url(uri, encoding='utf-8', decode_responses=True)
-    else:
-        raise AntismashStorageError('Unknown storage schema {!r}'.format(uri))
+class RetryPolicy:
+    """Retry idempotent reads with an exponential backoff when the connection fails
+
+    Only used for reads that can safely be sent twice. Writes are never retried, as a
+    command that timed out may still have been run by the server.
+    """
+    __slots__ = (
+        'backoff',
+        'max_backoff',
+        'retries',
+    )
+
+    def __init__(self, retries: int = 0, backoff: float = DEFAULT_RETRY_BACKOFF,
+                 max_backoff: float = MAX_RETRY_BACKOFF) -> None:
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt: int) -> float:
+        """Get the time to wait after a failed attempt, counting from 0"""
+        return min(self.max_backoff, self.backoff * 2 ** attempt)
+
+    def call(self, func: Callable[[], T]) -> T:
+        """Run a read, retrying it on connection errors and timeouts
+
+        Raises an AntismashStorageError once all retries are used up.
+        """
+        attempt = 0
+        while True:
+            try:
+                return func()
+            except (redis.ConnectionError, redis.TimeoutError) as err:
+                if attempt >= self.retries:
+                    raise AntismashStorageError(
+                        f"Redis not reachable after {attempt + 1} attempts: {err}") from err
+                time.sleep(self.delay(attempt))
+                attempt += 1
+
+
+_NO_RETRIES = RetryPolicy()
+_RETRY_POLICIES: "WeakKeyDictionary[redis.Redis, RetryPolicy]" = WeakKeyDictionary()
+
+
+def is_cluster(storage: Any) -> bool:
+    """Check if a connection is to a Redis Cluster"""
+    return isinstance(storage, (redis.RedisCluster, redis.asyncio.RedisCluster))
+
+
+def require_standalone(storage: Any, operation: str) -> None:
+    """Reject an operation that uses keys from different hash slots in one command
+
+    Moving jobs between queues, renaming the rebuilt indexes and intersecting index sets
+    all do, and a Redis Cluster refuses such commands with a CROSSSLOT error.
+
+    :param storage: A Redis instance connected to the database
+    :param operation: Description of the operation for the error message
+    """
+    if is_cluster(storage):
+        raise AntismashStorageError(f"{operation} is not supported on Redis Cluster, "
+                                    "it needs keys from different hash slots")
+
+
+def get_retry_policy(storage: redis.Redis) -> RetryPolicy:
+    """Get the retry policy for reads from a connection, connections not created by
+    get_storage don't retry"""
+    return _RETRY_POLICIES.get(storage, _NO_RETRIES)
+
+
+def _pool_options(socket_timeout: Optional[float], socket_connect_timeout: Optional[float],
+                  health_check_interval: int, max_connections: Optional[int]) -> Dict[str, Any]:
+    """Collect the connection pool options that differ from the redis-py defaults"""
+    options: Dict[str, Any] = {"encoding": "utf-8", "decode_responses": True}
+    if socket_timeout is not None:
+        options["socket_timeout"] = socket_timeout
+    if socket_connect_timeout is not None:
+        options["socket_connect_timeout"] = socket_connect_timeout
+    if health_check_interval:
+        options["health_check_interval"] = health_check_interval
+    if max_connections:
+        options["max_connections"] = max_connections
+    return options
+
+
+def _parse_hosts_uri(uri: str, default_port: int) -> Tuple[List[Tuple[str, int]], List[str],
+                                                            Dict[str, str]]:
+    """Split a URI with a comma-separated host list into its parts
+
+    :return: The (host, port) pairs, the non-empty path segments and the username
+             and password, if any
+    """
+    rest = uri.split('://', 1)[1].split('?', 1)[0]
+    netloc, _, path = rest.partition('/')
+    credentials: Dict[str, str] = {}
+    if '@' in netloc:
+        userinfo, _, netloc = netloc.rpartition('@')
+        username, _, password = userinfo.partition(':')
+        if username:
+            credentials['username'] = unquote(username)
+        if password:
+            credentials['password'] = unquote(password)
+
+    hosts: List[Tuple[str, int]] = []
+    for address in netloc.split(','):
+        host, separator, port = address.rpartition(':')
+        if not separator or ']' in port:
+            host, port = address, str(default_port)
+        host = host.strip('[]')
+        if not host or not port.isdigit():
+            raise AntismashStorageError(f"Invalid host {address!r} in {uri!r}")
+        hosts.append((host, int(port)))
+    return hosts, [segment for segment in path.split('/') if segment], credentials
+
+
+def _parse_db(segments: List[str], uri: str) -> int:
+    """Get the database number from the remaining path segments of a URI"""
+    if not segments:
+        return 0
+    if len(segments) > 1 or not segments[0].isdigit():
+        raise AntismashStorageError(f"Invalid database {'/'.join(segments)!r} in {uri!r}")
+    return int(segments[0])
+
+
+def _connect(client: Any, uri: str, options: Dict[str, Any]) -> Any:
+    """Create a client for a URI
+
+    :param client: The redis or redis.asyncio module, providing the client classes
+    :param uri: URI of the database
+    :param options: Connection and pool options
+    """
+    scheme = uri.split('://', 1)[0] if '://' in uri else ''
+    if scheme in URL_SCHEMES:
+        return client.Redis(connection_pool=client.ConnectionPool.from_url(uri, **options))
+
+    if scheme == SENTINEL_SCHEME:
+        hosts, segments, credentials = _parse_hosts_uri(uri, DEFAULT_SENTINEL_PORT)
+        if not segments:
+            raise AntismashStorageError(f"No Sentinel service name in {uri!r}")
+        db = _parse_db(segments[1:], uri)
+        # the credentials are those of the master, the sentinels only get the timeouts
+        sentinel = client.Sentinel(hosts, **options)
+        return sentinel.master_for(segments[0], redis_class=client.Redis, db=db, **credentials)
+
+    if scheme == CLUSTER_SCHEME:
+        hosts, segments, credentials = _parse_hosts_uri(uri, DEFAULT_REDIS_PORT)
+        if _parse_db(segments, uri):
+            raise AntismashStorageError(f"Redis Cluster only has database 0, not in {uri!r}")
+        nodes = [client.cluster.ClusterNode(host, port) for host, port in hosts]
+        return client.RedisCluster(startup_nodes=nodes, **credentials, **options)
+
+    raise AntismashStorageError('Unknown storage schema {!r}'.format(uri))
+
+
+def get_storage(uri, *, socket_timeout: Optional[float] = None,
+                socket_connect_timeout: Optional[float] = None, health_check_interval: int = 0,
+                max_connections: Optional[int] = None, retries: int = 0,
+                retry_backoff: float = DEFAULT_RETRY_BACKOFF):
+    """Get a redis connection to the specified URI
+
+    Supported URIs are
+        redis://[[user]:password@]host[:port][/db] and rediss:// for TLS
+        unix://[[user]:password@]/path/to/socket[?db=db]
+        redis+sentinel://[[user]:password@]host[:port][,host[:port]...]/service[/db]
+        redis+cluster://[[user]:password@]host[:port][,host[:port]...]
+
+    The credentials of Sentinel URIs are used for the master, not the sentinels. In a
+    cluster, operations using several keys in one command are rejected, see
+    require_standalone.
+
+    :param uri: URI of the database
+    :param socket_timeout: Seconds to wait for a reply before giving up
+    :param socket_connect_timeout: Seconds to wait for a connection before giving up
+    :param health_check_interval: Seconds after which idle connections are checked with PING
+    :param max_connections: Maximum number of pooled connections, redis-py default if not set
+    :param retries: Number of retries of failed idempotent reads
+    :param retry_backoff: Seconds to wait before the first retry, doubled for each retry
+    """
+    storage = _connect(redis, uri, _pool_options(
+        socket_timeout, socket_connect_timeout, health_check_interval, max_connections))
+    _RETRY_POLICIES[storage] = RetryPolicy(retries, retry_backoff)
+    return storage
+
+
+def get_async_storage(uri, *, socket_timeout: Optional[float] = None,
+                      socket_connect_timeout: Optional[float] = None,
+                      health_check_interval: int = 0, max_connections: Optional[int] = None,
+                      **_):
+    """Get an asyncio redis connection to the specified URI
+
+    Takes the same URIs and connection pool options as get_storage, the asyncio helpers
+    don't retry.
+    """
+    return _connect(redis.asyncio, uri, _pool_options(
+        socket_timeout, socket_connect_timeout, health_check_interval, max_connections))
+
+
+def scan_keys(storage: redis.Redis, pattern: str, count: int = DEFAULT_SCAN_COUNT) -> Iterator[str]:
+    """Incrementally iterate over all keys matching a pattern
+
+    Uses SCAN instead of KEYS so the server is never blocked for a full walk of the keyspace.
+    Keys are yielded in no particular order and, as with SCAN itself, a key may be returned
+    more than once if the keyspace is modified during the iteration.
+
+    :param storage: A Redis instance connected to the database
+    :param pattern: Glob-style pattern the keys need to match
+    :param count: COUNT hint for the number of keys to examine per SCAN call
+
+    Failed SCAN calls are retried from the same cursor, following the connection's
+    retry policy.
+    """
+    if is_cluster(storage):
+        # cluster scans walk the nodes one after another, their cursors can't be resumed
+        yield from storage.scan_iter(match=pattern, count=count)
+        return
+    policy = get_retry_policy(storage)
+    cursor = 0
+    while True:
+        cursor, keys = policy.call(lambda: storage.scan(cursor, match=pattern, count=count))
+        yield from keys
+        if not cursor:
+            return
+
+
+def iterate_list(storage: redis.Redis, key: str, window: int = DEFAULT_CHUNK_SIZE,
+                 start: int = 0) -> Iterator[str]:
+    """Lazily iterate over a list, fetching it in LRANGE windows
+
+    Entries added to or removed from the list while iterating may be skipped or seen twice.
+
+    :param storage: A Redis instance connected to the database
+    :param key: Key of the list to iterate over
+    :param window: Number of entries to fetch per LRANGE call
+    :param start: Index of the first entry to fetch
+    """
+    if window < 1:
+        raise ValueError(f"Invalid window size {window}")
+    policy = get_retry_policy(storage)
+    while True:
+        entries = policy.call(lambda: storage.lrange(key, start, start + window - 1))
+        yield from entries
+        if len(entries) < window:
+            return
+        start += window
+
+
+def chunked(items: Iterable[T], chunk_size: int) -> Iterator[List[T]]:
+    """Split an iterable into lists of at most chunk_size items"""
+    if chunk_size < 1:
+        raise ValueError(f"Invalid chunk size {chunk_size}")
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def fetch_in_batches(storage: redis.Redis, factory: Callable[[str], Any],
+                     object_ids: Iterable[str], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Any]:
+    """Fetch many antismash_models objects with one pipelined round trip per chunk
+
+    Objects that are missing from the database or whose hashes can't be parsed are
+    skipped, mirroring the ValueError raised by fetch() on a single object. Failed round
+    trips are retried following the connection's retry policy.
+
+    :param storage: A Redis instance connected to the database
+    :param factory: Callable creating an unfetched model object from an ID
+    :param object_ids: IDs of the objects to fetch
+    :param chunk_size: Number of objects to fetch per round trip
+    """
+    policy = get_retry_policy(storage)
+    for chunk in chunked(object_ids, chunk_size):
+        objects = [factory(object_id) for object_id in chunk]
+
+        def fetch_chunk() -> List[Any]:
+            pipe = storage.pipeline(transaction=False)
+            _queue_fetches(pipe, objects)
+            return pipe.execute()
+
+        yield from _parse_fetched(objects, policy.call(fetch_chunk))
+
+
+def fetch_fields_in_batches(storage: redis.Redis, key_format: str, object_ids: Iterable[str],
+                            fields: Sequence[str], chunk_size: int = DEFAULT_CHUNK_SIZE
+                            ) -> Iterator[Tuple[str, List[Optional[str]]]]:
+    """Fetch selected raw hash fields of many objects, one pipelined round trip per chunk
+
+    Only the requested fields are transferred, as strings. Missing objects are skipped,
+    like in fetch_in_batches.
+
+    :param storage: A Redis instance connected to the database
+    :param key_format: Format string turning an ID into a key, e.g. "job:{}"
+    :param object_ids: IDs of the objects to fetch
+    :param fields: Names of the hash fields to fetch
+    :param chunk_size: Number of objects to fetch per round trip
+    :return: Iterator over (object ID, field values) tuples
+    """
+    policy = get_retry_policy(storage)
+    for chunk in chunked(object_ids, chunk_size):
+
+        def fetch_chunk() -> List[Any]:
+            pipe = storage.pipeline(transaction=False)
+            for object_id in chunk:
+                key = key_format.format(object_id)
+                pipe.exists(key)
+                if fields:
+                    pipe.hmget(key, *fields)
+            return pipe.execute()
+
+        replies = policy.call(fetch_chunk)
+        if not fields:
+            yield from ((object_id, []) for object_id, exists in zip(chunk, replies) if exists)
+            continue
+        for object_id, exists, values in zip(chunk, replies[::2], replies[1::2]):
+            if exists:
+                yield object_id, values
+
+
+def _queue_fetches(pipe: Any, objects: List[Any]) -> None:
+    """Queue the commands fetching a list of model objects on a pipeline"""
+    for obj in objects:
+        pipe.exists(obj._key)
+        pipe.hmget(obj._key, *(obj.PROPERTIES + obj.ATTRIBUTES))
+
+
+def _parse_fetched(objects: List[Any], replies: List[Any]) -> Iterator[Any]:
+    """Fill model objects from the pipeline replies, skipping missing and invalid objects"""
+    for obj, exists, values in zip(objects, replies[::2], replies[1::2]):
+        if not exists:
+            continue
+        try:
+            obj._parse(obj.PROPERTIES + obj.ATTRIBUTES, values)
+        except ValueError:
+            continue
+        yield obj
+
+
+async def async_scan_keys(storage: redis.asyncio.Redis, pattern: str,
+                          count: int = DEFAULT_SCAN_COUNT) -> AsyncIterator[str]:
+    """Incrementally iterate over all keys matching a pattern, asyncio version of scan_keys"""
+    async for key in storage.scan_iter(match=pattern, count=count):
+        yield key
+
+
+async def async_fetch_in_batches(storage: redis.asyncio.Redis, factory: Callable[[str], Any],
+                                 object_ids: Iterable[str], chunk_size: int = DEFAULT_CHUNK_SIZE,
+                                 concurrency: int = DEFAULT_CONCURRENCY) -> List[Any]:
+    """Fetch many antismash_models objects, asyncio version of fetch_in_batches
+
+    Up to `concurrency` pipelined chunks are in flight at the same time. The objects
+    are returned in the order of the IDs, with missing objects skipped.
+    """
+    limit = asyncio.Semaphore(concurrency)
+
+    async def fetch_chunk(chunk: List[str]) -> List[Any]:
+        objects = [factory(object_id) for object_id in chunk]
+        async with limit:
+            async with storage.pipeline(transaction=False) as pipe:
+                _queue_fetches(pipe, objects)
+                replies = await pipe.execute()
+        return list(_parse_fetched(objects, replies))
+
+    fetched = await asyncio.gather(*map(fetch_chunk, chunked(object_ids, chunk_size)))
+    return [obj for chunk in fetched for obj in chunk]
+
+
+def _get_script(storage: redis.Redis, source: str) -> Script:
+    """Get a server-side script, registering it once per connection"""
+    scripts = _SCRIPTS.setdefault(storage, {})
+    script = scripts.get(source)
+    if script is None:
+        script = storage.register_script(source)
+        scripts[source] = script
+    return script
+
+
+def move_job(storage: redis.Redis, job: Any, old_queue: str, new_queue: str, *,
+             push_left: bool = False, pipeline: Optional[redis.client.Pipeline] = None) -> Any:
+    """Atomically commit a job and move it from one queue to another
+
+    The job's fields are written, the job is removed from the old queue and added to
+    the new one by a single server-side script, run via EVALSHA.
+
+    :param storage: A Redis instance connected to the database
+    :param job: The changed job to commit
+    :param old_queue: Key of the queue to remove the job from
+    :param new_queue: Key of the queue to add the job to
+    :param push_left: Add the job to the head instead of the tail of the new queue
+    :param pipeline: Queue the script call on this pipeline instead of running it directly
+    :return: The number of entries removed from the old queue, or the pipeline
+    """
+    require_standalone(storage, "Moving jobs between queues")
+    script = _get_script(storage, MOVE_JOB_SCRIPT)
+    args = [job.job_id, "left" if push_left else "right"]
+    for field, value in job.to_dict().items():
+        args.extend((field, value))
+
+    return script(keys=[job._key, old_queue, new_queue], args=args,
+                  client=pipeline if pipeline is not None else storage)
+
+
+def remove_archived_job(storage: redis.Redis, job_id: str, queue: str,
+                        fields: Dict[str, str], pipeline: redis.client.Pipeline) -> None:
+    """Queue the atomic removal of an archived job from the database and its queue
+
+    The job is only removed if its state and last_changed still match the archived
+    fields, a job that changed in the meantime is kept. With empty fields, only the queue
+    entries of a job whose hash is missing are removed. The script call replies 1 if
+    the job was removed and 0 if it was kept.
+
+    :param storage: A Redis instance connected to the database
+    :param job_id: ID of the archived job
+    :param queue: Key of the queue to remove all of the job's entries from
+    :param fields: The fields of the job's hash as they were archived
+    :param pipeline: The pipeline to queue the script call on
+    """
+    require_standalone(storage, "Archiving jobs")
+    script = _get_script(storage, REMOVE_ARCHIVED_JOB_SCRIPT)
+    script(keys=[f"job:{job_id}", queue],
+           args=[job_id, fields.get("state") or "", fields.get("last_changed") or ""],
+           client=pipeline)
+
+
+def expire_nx(storage: redis.Redis, key: str, seconds: int,
+              pipeline: redis.client.Pipeline) -> None:
+    """Queue setting a TTL on a key that has none, also on Redis versions before 7
+
+    The script call replies 1 if the TTL was set and 0 otherwise.
+    """
+    script = _get_script(storage, EXPIRE_NX_SCRIPT)
+    script(keys=[key], args=[seconds], client=pipeline)
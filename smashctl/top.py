@@ -0,0 +1,191 @@
+"""Live cluster overview"""
+
+import argparse
+from collections import deque
+from datetime import datetime
+import sys
+import time
+from typing import Deque, Dict, Iterator, List, Set, Tuple
+
+from antismash_models import SyncControl as Control, SyncJob as Job
+from redis import Redis
+
+from .storage import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_SCAN_COUNT,
+    QUEUES,
+    RUNNING_QUEUE,
+    chunked,
+    fetch_in_batches,
+    scan_keys,
+)
+
+
+# how far back to look when calculating the change of queue lengths and the throughput
+RATE_WINDOW = 60.0
+CLEAR_SCREEN = "\033[H\033[2J"
+
+
+def register(subparsers: "argparse._SubParsersAction[argparse.ArgumentParser]") \
+        -> None:  # pragma: no cover
+    """Register the top subcommand"""
+    p_top = subparsers.add_parser(
+        "top", help="Show a live overview of dispatchers and queues",
+        description="Show a live overview of dispatchers and queues. The throughput is the "
+                    "number of jobs per minute that left the running queue over the last "
+                    "minute. The Δ/MIN column is the net change of a queue's length per "
+                    "minute over the last minute, jobs entering minus jobs leaving the queue.")
+    p_top.add_argument("-i", "--interval", type=float, default=2.0,
+                       help="Seconds between refreshes (default: %(default)s)")
+    p_top.add_argument("-n", "--iterations", type=int, default=0,
+                       help="Stop after this many refreshes (default: run until interrupted)")
+    p_top.set_defaults(func=top, async_func=None)
+
+
+class ClusterState:
+    """Incrementally refreshed view of dispatchers, queue lengths and running jobs
+
+    Running jobs are only re-fetched when their last_changed timestamp moved since
+    the previous refresh. Jobs that left the running queue between two refreshes are
+    counted for the throughput, a job that starts and finishes between two refreshes
+    is missed.
+    """
+    __slots__ = (
+        'dispatchers',
+        'jobs',
+        'queue_lengths',
+        '_history',
+        '_last_changed',
+        '_running_ids',
+    )
+
+    def __init__(self) -> None:
+        self.dispatchers: List[Control] = []
+        self.jobs: Dict[str, Job] = {}
+        self.queue_lengths: Dict[str, int] = {}
+        # refresh time, queue lengths and number of jobs that left the running queue
+        self._history: Deque[Tuple[float, Dict[str, int], int]] = deque()
+        self._last_changed: Dict[str, str] = {}
+        self._running_ids: Set[str] = set()
+
+    def refresh(self, storage: Redis, now: float, scan_count: int = DEFAULT_SCAN_COUNT,
+                chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+        """Update the state from the database
+
+        :param storage: A Redis instance connected to the database
+        :param now: Monotonic timestamp of the refresh, used for the queue length changes
+        :param scan_count: COUNT hint for scanning the dispatcher keys
+        :param chunk_size: Number of objects to fetch per round trip
+        """
+        names = sorted(set(key.split(":", 1)[-1] for key in
+                           scan_keys(storage, "control:*", scan_count)))
+        self.dispatchers = list(fetch_in_batches(storage, lambda name: Control(storage, name, 0),
+                                                 names, chunk_size))
+
+        pipe = storage.pipeline(transaction=False)
+        for queue in QUEUES:
+            pipe.llen(queue)
+        pipe.lrange(RUNNING_QUEUE, 0, -1)
+        *lengths, running_ids = pipe.execute()
+        self.queue_lengths = dict(zip(QUEUES, lengths))
+
+        left = len(self._running_ids.difference(running_ids)) if self._history else 0
+        self._running_ids = set(running_ids)
+        self._history.append((now, self.queue_lengths, left))
+        while len(self._history) > 2 and now - self._history[1][0] >= RATE_WINDOW:
+            self._history.popleft()
+
+        self._refresh_jobs(storage, running_ids, chunk_size)
+
+    def _refresh_jobs(self, storage: Redis, job_ids: List[str], chunk_size: int) -> None:
+        """Re-fetch the running jobs that changed since the last refresh"""
+        last_changed: Dict[str, str] = {}
+        for chunk in chunked(job_ids, chunk_size):
+            pipe = storage.pipeline(transaction=False)
+            for job_id in chunk:
+                pipe.hget(f"job:{job_id}", "last_changed")
+            last_changed.update(zip(chunk, pipe.execute()))
+
+        changed = [job_id for job_id, timestamp in last_changed.items()
+                   if timestamp is not None and (job_id not in self.jobs
+                                                 or self._last_changed.get(job_id) != timestamp)]
+
+        jobs = {job_id: self.jobs[job_id] for job_id in last_changed if job_id in self.jobs}
+        for job in fetch_in_batches(storage, lambda job_id: Job(storage, job_id), changed,
+                                    chunk_size):
+            jobs[job.job_id] = job
+
+        self.jobs = {job_id: jobs[job_id] for job_id in job_ids if job_id in jobs}
+        self._last_changed = {job_id: last_changed[job_id] for job_id in self.jobs}
+
+    def rates(self) -> Dict[str, float]:
+        """Calculate the net change in queue length per minute for all queues
+
+        This is the difference between jobs entering and leaving a queue, a queue that
+        processes many jobs at a steady length has a rate of zero.
+        """
+        if len(self._history) < 2:
+            return {queue: 0.0 for queue in QUEUES}
+        start, old_lengths, _ = self._history[0]
+        end, new_lengths, _ = self._history[-1]
+        minutes = (end - start) / 60
+        if minutes <= 0:
+            return {queue: 0.0 for queue in QUEUES}
+        return {queue: (new_lengths[queue] - old_lengths[queue]) / minutes for queue in QUEUES}
+
+    def throughput(self) -> float:
+        """Calculate the number of jobs per minute that left the running queue"""
+        if len(self._history) < 2:
+            return 0.0
+        minutes = (self._history[-1][0] - self._history[0][0]) / 60
+        if minutes <= 0:
+            return 0.0
+        # the first entry counts the jobs that left before the window started
+        return sum(left for _, _, left in list(self._history)[1:]) / minutes
+
+
+def _format_state(state: ClusterState, interval: float) -> str:
+    """Format a full screen of the cluster state"""
+    lines = [
+        f"smashctl top - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}, "
+        f"refreshing every {interval}s",
+        f"Throughput: {state.throughput():.1f} jobs/min leaving {RUNNING_QUEUE}",
+        "",
+        f"{'QUEUE':<20}{'LENGTH':>10}{'Δ/MIN':>10}",
+    ]
+    rates = state.rates()
+    for queue in QUEUES:
+        lines.append(f"{queue:<20}{state.queue_lengths[queue]:>10}{rates[queue]:>+10.1f}")
+
+    lines.extend(["", f"{'DISPATCHER':<24}{'STATUS':<12}{'JOBS':>9}  STOPPING"])
+    for d in state.dispatchers:
+        lines.append(f"{d.name:<24}{d.status:<12}{d.running_jobs:>4}/{d.max_jobs:<4}  "
+                     f"{d.stop_scheduled}")
+
+    lines.extend(["", "RUNNING JOBS"])
+    for job in state.jobs.values():
+        lines.append(f"{job.job_id}\t{job.jobtype}\t{job.dispatcher}\t{job.last_changed}\t"
+                     f"{job.status}")
+
+    return "\n".join(lines)
+
+
+def top(args: argparse.Namespace, storage: Redis) -> Iterator[str]:
+    """Continuously display the cluster state, using a single connection"""
+    state = ClusterState()
+    clear = CLEAR_SCREEN if sys.stdout.isatty() else ""
+    iteration = 0
+
+    try:
+        while True:
+            state.refresh(storage, time.monotonic(),
+                          getattr(args, "scan_count", DEFAULT_SCAN_COUNT),
+                          getattr(args, "chunk_size", DEFAULT_CHUNK_SIZE))
+            yield clear + _format_state(state, args.interval)
+
+            iteration += 1
+            if args.iterations and iteration >= args.iterations:
+                return
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        return
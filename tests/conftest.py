@@ -3,5 +3,16 @@ import pytest
 
 
 @pytest.fixture
-def db():
-    return fakeredis.FakeRedis(encoding="utf-8", decode_responses=True)
+def fake_server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def db(fake_server):
+    return fakeredis.FakeRedis(server=fake_server, encoding="utf-8", decode_responses=True)
+
+
+@pytest.fixture
+def async_db(fake_server):
+    """An asyncio client connected to the same fake server as db"""
+    return fakeredis.FakeAsyncRedis(server=fake_server, encoding="utf-8", decode_responses=True)
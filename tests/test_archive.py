@@ -0,0 +1,57 @@
+"""Tests for the local job archive"""
+import pytest
+
+from smashctl.archive import JobArchive
+from smashctl.common import AntismashRunError
+
+
+def test_append_and_get(tmp_path):
+    archive = JobArchive(str(tmp_path / 'nested' / 'archive.jsonl'))
+    assert archive.get('bacteria-1') is None
+    assert list(archive) == []
+
+    assert archive.append([('bacteria-1', {'state': 'done'}),
+                           ('bacteria-2', {'state': 'failed'})]) == 2
+    assert archive.append([]) == 0
+    assert archive.append([('bacteria-1', {'state': 'failed'})]) == 1
+
+    assert archive.get('bacteria-1') == {'state': 'failed'}
+    assert archive.get('bacteria-2') == {'state': 'failed'}
+    assert archive.get('bacteria-3') is None
+    assert [job_id for job_id, _ in archive] == ['bacteria-1', 'bacteria-2', 'bacteria-1']
+
+
+def test_get_mismatched_index(tmp_path):
+    archive = JobArchive(str(tmp_path / 'archive.jsonl'))
+    archive.append([('bacteria-1', {'state': 'done'}), ('bacteria-2', {'state': 'done'})])
+    (tmp_path / 'archive.jsonl').write_text('{"job_id": "bacteria-3", "fields": {}}\n' * 2)
+    with pytest.raises(ValueError, match="doesn't match"):
+        archive.get('bacteria-2')
+
+
+def test_read_from(tmp_path):
+    archive = JobArchive(str(tmp_path / 'archive.jsonl'))
+    archive.append([('bacteria-1', {}), ('bacteria-2', {})])
+    offsets = [offset for offset, _, _ in archive.read_from()]
+    assert offsets[-1] == (tmp_path / 'archive.jsonl').stat().st_size
+    assert [job_id for _, job_id, _ in archive.read_from(offsets[0])] == ['bacteria-2']
+    assert list(archive.read_from(offsets[-1])) == []
+
+
+def test_read_from_partial_and_corrupt(tmp_path):
+    archive = JobArchive(str(tmp_path / 'archive.jsonl'))
+    archive.append([('bacteria-1', {})])
+    with open(archive.path, 'ab') as handle:
+        handle.write(b'{"job_id": "bacteria-2", "fie')
+    # the unfinished line is skipped and not read past
+    assert [(offset, job_id) for offset, job_id, _ in archive.read_from()] == [
+        (len(b'{"fields": {}, "job_id": "bacteria-1"}\n'), 'bacteria-1')]
+
+    with open(archive.path, 'ab') as handle:
+        handle.write(b'lds": {}}\n')
+    assert [job_id for _, job_id, _ in archive.read_from()] == ['bacteria-1', 'bacteria-2']
+
+    with open(archive.path, 'ab') as handle:
+        handle.write(b'{"job_id": "bacteria-3"}\n')
+    with pytest.raises(AntismashRunError, match="Corrupt archive"):
+        list(archive.read_from())
@@ -1,6 +1,9 @@
 """Tests for the common functions"""
 import builtins  # noqa # pylint: disable=unused-import
-from argparse import Namespace
+from argparse import ArgumentTypeError, Namespace
+from datetime import datetime, timedelta, UTC
+
+import pytest
 
 from smashctl import common
 
@@ -31,3 +34,70 @@ def test_default_action(db):
 
     fn = common.default_action(fake_func, extra=True)
     fn(opts, db)
+
+
+def test_run_command_iterable(mocker):
+    mock_print = mocker.patch('builtins.print')
+
+    def fake_func(args, storage):
+        yield "first"
+        yield "second"
+
+    common.run_command(fake_func, 'args', 'storage')
+    assert mock_print.call_args_list == [mocker.call("first"), mocker.call("second")]
+
+
+def test_run_command_iterable_error(mocker):
+    mock_print = mocker.patch('builtins.print')
+    mock_exit = mocker.patch('sys.exit')
+
+    def fake_func(args, storage):
+        yield "first"
+        raise common.AntismashRunError("broken")
+
+    common.run_command(fake_func, 'args', 'storage')
+    assert mock_print.call_args_list[0] == mocker.call("first")
+    mock_exit.assert_called_once_with(1)
+
+
+def test_run_command_async(mocker):
+    mock_print = mocker.patch('builtins.print')
+    storage = mocker.AsyncMock()
+
+    async def fake_func(args, storage):
+        return "async result"
+
+    common.run_command(fake_func, 'args', storage)
+    mock_print.assert_called_once_with("async result")
+    storage.aclose.assert_awaited_once()
+
+
+def test_parse_duration():
+    assert common.parse_duration("90") == timedelta(seconds=90)
+    assert common.parse_duration("30m") == timedelta(minutes=30)
+    assert common.parse_duration("1.5h") == timedelta(minutes=90)
+    assert common.parse_duration("2d") == timedelta(days=2)
+    with pytest.raises(ArgumentTypeError):
+        common.parse_duration("soon")
+
+
+def test_parse_time():
+    assert common.parse_time("2024-03-01") == datetime(2024, 3, 1, tzinfo=UTC)
+    assert common.parse_time("2024-03-01 12:30:00") == datetime(2024, 3, 1, 12, 30, tzinfo=UTC)
+    ago = datetime.now(UTC) - common.parse_time("1h")
+    assert timedelta(minutes=59) < ago < timedelta(minutes=61)
+    with pytest.raises(ArgumentTypeError):
+        common.parse_time("yesterday")
+
+
+def test_run_command_bytes(mocker):
+    mock_print = mocker.patch('builtins.print')
+    mock_stdout = mocker.patch('sys.stdout')
+
+    def fake_func(args, storage):
+        yield "text"
+        yield b"\x81\xa1a\x01"
+
+    common.run_command(fake_func, 'args', 'storage')
+    mock_print.assert_called_once_with("text")
+    mock_stdout.buffer.write.assert_called_once_with(b"\x81\xa1a\x01")
@@ -0,0 +1,67 @@
+"""Tests for the dispatcher control logic"""
+import asyncio
+import json
+from argparse import Namespace
+
+from antismash_models import SyncControl as Control
+
+from smashctl import control
+
+
+def test_get_all_dispatcher_names(db, mocker):
+    for name in ("zeta", "alpha", "beta"):
+        Control(db, name, 5).commit()
+    keys_spy = mocker.spy(db, "keys")
+
+    assert control._get_all_dispatcher_names(db, scan_count=1) == ["alpha", "beta", "zeta"]
+    keys_spy.assert_not_called()
+
+
+def test_control_stop_all(db):
+    for name in ("alpha", "beta"):
+        Control(db, name, 5).commit()
+
+    args = Namespace(names=["all"], scan_count=1)
+    assert control.control_stop(args, db) == "Stopping dispatcher alpha\nStopping dispatcher beta"
+    for name in ("alpha", "beta"):
+        assert Control(db, name, 0).fetch().stop_scheduled
+
+    args = Namespace(names=["gamma"])
+    assert control.control_stop(args, db) == "Skipping noexistent dispatcher gamma"
+
+
+def test_async_control_list(db, async_db):
+    for name in ("beta", "alpha"):
+        Control(db, name, 5).commit()
+
+    args = Namespace(pretty="simple", scan_count=1, chunk_size=1)
+    expected = control.control_list(args, db)
+    assert asyncio.run(control.async_control_list(args, async_db)) == expected
+
+
+def test_async_control_stop_all(db, async_db):
+    for name in ("alpha", "beta"):
+        Control(db, name, 5).commit()
+
+    args = Namespace(names=["all", "gamma"])
+    expected = "\n".join([
+        "Stopping dispatcher alpha",
+        "Stopping dispatcher beta",
+    ])
+    assert asyncio.run(control.async_control_stop(args, async_db)) == expected
+    for name in ("alpha", "beta"):
+        assert Control(db, name, 0).fetch().stop_scheduled
+
+
+def test_control_list_format(db, async_db):
+    for name in ("beta", "alpha"):
+        Control(db, name, 5).commit()
+
+    args = Namespace(pretty="simple", format="jsonl")
+    records = [json.loads(line) for line in control.control_list(args, db)]
+    assert [record["name"] for record in records] == ["alpha", "beta"]
+    assert records[0]["max_jobs"] == 5
+    assert records[0]["running"] is True
+
+    expected = list(control.control_list(args, db))
+    assert asyncio.run(control.async_control_list(args, async_db)) == expected
@@ -0,0 +1,113 @@
+"""Tests for the Prometheus metrics exporter"""
+from argparse import ArgumentTypeError
+from datetime import datetime, timedelta, UTC
+import threading
+import urllib.error
+import urllib.request
+
+from antismash_models import SyncControl as Control, SyncNotice as Notice
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from smashctl import exporter
+from smashctl.storage import AntismashStorageError
+
+
+def test_parse_listen():
+    assert exporter._parse_listen(":9100") == ("", 9100)
+    assert exporter._parse_listen("127.0.0.1:8080") == ("127.0.0.1", 8080)
+    assert exporter._parse_listen("[::1]:9100") == ("::1", 9100)
+    with pytest.raises(ArgumentTypeError):
+        exporter._parse_listen("localhost")
+
+
+def test_collect(db):
+    db.rpush("jobs:queued", "bacteria-1", "bacteria-2")
+    Control(db, "alpha", 5).commit()
+    beta = Control(db, "beta\"quoted", 2)
+    beta.stop_scheduled = True
+    beta.running_jobs = 1
+    beta.status = "shutting down"
+    beta.commit()
+
+    now = datetime.now(UTC)
+    Notice(db, "active", category="error", teaser="t", text="t",
+           show_from=now - timedelta(hours=1), show_until=now + timedelta(hours=1)).commit()
+    Notice(db, "upcoming", category="info", teaser="t", text="t",
+           show_from=now + timedelta(hours=1), show_until=now + timedelta(hours=2)).commit()
+
+    lines = exporter.collect(db, now=now.timestamp()).splitlines()
+    assert 'smashctl_queue_length{queue="jobs:queued"} 2' in lines
+    assert 'smashctl_queue_length{queue="jobs:running"} 0' in lines
+    assert 'smashctl_dispatcher_max_jobs{dispatcher="alpha"} 5' in lines
+    assert 'smashctl_dispatcher_running_jobs{dispatcher="beta\\"quoted"} 1' in lines
+    assert 'smashctl_dispatcher_stop_scheduled{dispatcher="alpha"} 0' in lines
+    assert 'smashctl_dispatcher_stop_scheduled{dispatcher="beta\\"quoted"} 1' in lines
+    assert 'smashctl_dispatcher_state{dispatcher="alpha",state="running"} 1' in lines
+    assert 'smashctl_dispatcher_state{dispatcher="beta\\"quoted",state="running"} 0' in lines
+    assert 'smashctl_dispatcher_state{dispatcher="beta\\"quoted",state="stopping"} 1' in lines
+    assert not any("shutting down" in line for line in lines)
+    assert 'smashctl_active_notices{category="error"} 1' in lines
+    assert not any(line.startswith('smashctl_active_notices{category="info"}') for line in lines)
+    assert "# TYPE smashctl_queue_length gauge" in lines
+
+
+def test_cache_keeps_values_on_errors():
+    results = ["first 1\n", RedisConnectionError("gone"),
+               AntismashStorageError("Redis not reachable after 4 attempts"),
+               KeyError("state")]
+
+    def collector():
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    cache = exporter.MetricsCache(collector, ttl=60)
+    assert cache.text() is None
+    for _ in range(4):
+        cache.refresh()
+    text = cache.text()
+    assert text.startswith("first 1\n")
+    assert "smashctl_refresh_errors_total 3" in text
+
+
+def test_cache_stale(mocker):
+    cache = exporter.MetricsCache(lambda: "value 1\n", ttl=60)
+    mocker.patch("time.time", return_value=1000.0)
+    cache.refresh()
+    mocker.patch("time.time", return_value=1000.0 + 3 * 60)
+    assert cache.text() is not None
+    mocker.patch("time.time", return_value=1001.0 + 3 * 60)
+    assert cache.text() is None
+
+
+def test_server(db):
+    db.rpush("jobs:failed", "bacteria-1")
+    calls = []
+
+    def collector():
+        calls.append(1)
+        return exporter.collect(db)
+
+    cache = exporter.MetricsCache(collector, ttl=60)
+    cache.start()
+    server = exporter.make_server(("127.0.0.1", 0), cache)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        for _ in range(3):
+            with urllib.request.urlopen(url + "/metrics") as response:
+                assert response.headers["Content-Type"].startswith("text/plain")
+                body = response.read().decode()
+        assert 'smashctl_queue_length{queue="jobs:failed"} 1' in body
+        assert len(calls) == 1
+
+        with pytest.raises(urllib.error.HTTPError) as err:
+            urllib.request.urlopen(url + "/other")
+        assert err.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+        cache.stop()
@@ -0,0 +1,94 @@
+"""Tests for the machine-readable output formats"""
+import csv
+from datetime import datetime, UTC
+import json
+import sys
+
+import pytest
+
+from smashctl import formats
+from smashctl.common import AntismashRunError
+
+
+class Record:
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+
+FIELDS = ('name', 'added', 'tags', 'count')
+RECORDS = [
+    Record(name="tab\tseparated", added=datetime(2024, 3, 1, 12, 0, tzinfo=UTC),
+           tags=["a", "b"], count=1),
+    Record(name="quoted, \"name\"", added=None, tags=[], count=2),
+]
+
+
+def test_json():
+    output = "\n".join(formats.serialize(RECORDS, "json", FIELDS))
+    parsed = json.loads(output)
+    assert parsed[0] == {"name": "tab\tseparated", "added": "2024-03-01 12:00:00.000000",
+                         "tags": ["a", "b"], "count": 1}
+    assert parsed[1]["added"] is None
+
+    assert json.loads("\n".join(formats.serialize([], "json", FIELDS))) == []
+
+
+def test_jsonl():
+    lines = list(formats.serialize(RECORDS, "jsonl", FIELDS))
+    assert len(lines) == 2
+    assert json.loads(lines[1]) == {"name": "quoted, \"name\"", "added": None, "tags": [],
+                                    "count": 2}
+
+
+def test_csv():
+    lines = list(formats.serialize(RECORDS, "csv", FIELDS))
+    rows = list(csv.reader(lines))
+    assert rows == [
+        list(FIELDS),
+        ["tab\tseparated", "2024-03-01 12:00:00.000000", "a,b", "1"],
+        ["quoted, \"name\"", "", "", "2"],
+    ]
+
+
+def test_serialize_is_lazy():
+    def records():
+        yield RECORDS[0]
+        raise RuntimeError("fetched too much")
+
+    output = formats.serialize(records(), "jsonl", FIELDS)
+    assert json.loads(next(output))["count"] == 1
+    with pytest.raises(RuntimeError):
+        next(output)
+
+
+def test_msgpack_missing(mocker):
+    mocker.patch.dict(sys.modules, {"msgpack": None})
+    with pytest.raises(AntismashRunError, match="msgpack package"):
+        list(formats.serialize(RECORDS, "msgpack", FIELDS))
+
+
+def test_msgpack():
+    msgpack = pytest.importorskip("msgpack")
+    chunks = list(formats.serialize(RECORDS, "msgpack", FIELDS))
+    assert all(isinstance(chunk, bytes) for chunk in chunks)
+    unpacker = msgpack.Unpacker()
+    unpacker.feed(b"".join(chunks))
+    unpacked = list(unpacker)
+    assert unpacked[0]["added"] == "2024-03-01 12:00:00.000000"
+
+
+def test_unknown_format():
+    with pytest.raises(AntismashRunError, match="Unknown output format"):
+        list(formats.serialize(RECORDS, "yaml", FIELDS))
+
+
+def test_serializer_is_abstract():
+    with pytest.raises(TypeError):
+        formats.Serializer(FIELDS)
+
+    class Incomplete(formats.Serializer):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete(FIELDS)
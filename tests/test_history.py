@@ -0,0 +1,121 @@
+"""Tests for the offline job history"""
+import argparse
+from argparse import Namespace
+from datetime import datetime, UTC
+import json
+
+from antismash_models import SyncJob as Job
+import pytest
+
+from smashctl import history
+from smashctl.archive import JobArchive
+
+
+def _raw_job(jobtype, dispatcher, added, runtime, state='done'):
+    added_at = datetime.fromisoformat(added).replace(tzinfo=UTC)
+    finished = datetime.fromtimestamp(added_at.timestamp() + runtime, UTC)
+    return {
+        'jobtype': jobtype,
+        'dispatcher': dispatcher,
+        'state': state,
+        'email': 'alice@example.org',
+        'added': added_at.strftime("%Y-%m-%d %H:%M:%S.%f"),
+        'last_changed': finished.strftime("%Y-%m-%d %H:%M:%S.%f"),
+        'smcogs': 'True',
+        'seed': '42',
+        'sideloads': '["a.json"]',
+    }
+
+
+def _args(tmp_path, **kwargs):
+    defaults = dict(archive=str(tmp_path / 'archive.jsonl'),
+                    history=str(tmp_path / 'history.sqlite'), include_queues=False,
+                    by=('day',), since=None, until=None, filters=[], chunk_size=2)
+    defaults.update(kwargs)
+    return Namespace(**defaults)
+
+
+def _fill_archive(tmp_path):
+    JobArchive(str(tmp_path / 'archive.jsonl')).append([
+        ('bacteria-1', _raw_job('antismash7', 'dispatcher-1', '2024-03-01 10:00:00', 100)),
+        ('bacteria-2', _raw_job('antismash8', 'dispatcher-1', '2024-03-01 12:00:00', 300)),
+        ('bacteria-3', _raw_job('antismash8', 'dispatcher-2', '2024-03-02 08:00:00', 50,
+                                state='failed')),
+    ])
+
+
+def test_import_incremental(db, tmp_path):
+    _fill_archive(tmp_path)
+    args = _args(tmp_path)
+    assert history.history_import(args, db) == \
+        f"Imported 3 jobs from {tmp_path / 'archive.jsonl'}"
+    assert history.history_import(args, db) == \
+        f"Imported 0 jobs from {tmp_path / 'archive.jsonl'}"
+
+    JobArchive(args.archive).append([
+        ('bacteria-4', _raw_job('antismash8', 'dispatcher-2', '2024-03-02 09:00:00', 10))])
+    j = Job(db, 'bacteria-5')
+    j.state = 'done'
+    j.commit()
+    db.rpush('jobs:done', j.job_id, 'bacteria-missing')
+
+    args.include_queues = True
+    assert history.history_import(args, db).splitlines() == [
+        f"Imported 1 jobs from {tmp_path / 'archive.jsonl'}",
+        "Imported 1 jobs from jobs:done and jobs:failed",
+    ]
+
+    store = history.JobHistory(args.history)
+    row = store.connection.execute(
+        "SELECT seed, smcogs, sideloads, added FROM jobs WHERE job_id = 'bacteria-1'").fetchone()
+    assert row == (42, 1, '["a.json"]', datetime(2024, 3, 1, 10, tzinfo=UTC).timestamp())
+    assert store.connection.execute("SELECT COUNT(*) FROM jobs").fetchone() == (5,)
+    indexes = {name for name, in store.connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'jobs_%'")}
+    assert indexes == {f"jobs_{column}" for column in history.INDEXED_COLUMNS}
+    store.close()
+
+
+def test_query(db, tmp_path):
+    _fill_archive(tmp_path)
+    history.history_import(_args(tmp_path), db)
+
+    lines = list(history.history_query(_args(tmp_path, by=('day', 'jobtype')), db))
+    assert lines == [
+        "day\tjobtype\tjobs\tmean_runtime",
+        "2024-03-01\tantismash7\t1\t100.0",
+        "2024-03-01\tantismash8\t1\t300.0",
+        "2024-03-02\tantismash8\t1\t50.0",
+    ]
+
+    args = _args(tmp_path, by=('dispatcher',), format='jsonl',
+                 since=datetime(2024, 3, 1, 11, tzinfo=UTC))
+    records = [json.loads(line) for line in history.history_query(args, db)]
+    assert records == [
+        {"dispatcher": "dispatcher-1", "jobs": 1, "mean_runtime": 300.0},
+        {"dispatcher": "dispatcher-2", "jobs": 1, "mean_runtime": 50.0},
+    ]
+
+    args = _args(tmp_path, by=('state',), filters=[('jobtype', 'antismash8')])
+    assert list(history.history_query(args, db))[1:] == ["done\t1\t300.0", "failed\t1\t50.0"]
+
+
+def test_query_uses_index(tmp_path):
+    store = history.JobHistory(str(tmp_path / 'history.sqlite'))
+    for group, index_name in [('day', 'jobs_added'), ('jobtype', 'jobs_jobtype'),
+                              ('dispatcher', 'jobs_dispatcher')]:
+        statement = (f"SELECT {history.GROUPS[group]}, COUNT(*), AVG(last_changed - added) "
+                     "FROM jobs WHERE added >= 0 GROUP BY 1")
+        plan = " ".join(row[-1] for row in
+                        store.connection.execute(f"EXPLAIN QUERY PLAN {statement}"))
+        assert f"COVERING INDEX {index_name}" in plan
+    store.close()
+
+
+def test_parse_arguments():
+    assert history._parse_groups("day, jobtype") == ('day', 'jobtype')
+    assert history._parse_filter("state=done") == ('state', 'done')
+    with pytest.raises(argparse.ArgumentTypeError):
+        history._parse_groups("day,nonsense")
+    with pytest.raises(argparse.ArgumentTypeError):
+        history._parse_filter("filename=x.gbk")
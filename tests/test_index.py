@@ -0,0 +1,117 @@
+"""Tests for the secondary job indexes"""
+from argparse import Namespace
+from datetime import datetime, UTC
+
+from antismash_models import SyncJob as Job
+import pytest
+import redis
+
+from smashctl import index
+from smashctl.storage import AntismashStorageError
+
+
+def _make_job(db, job_id, **kwargs):
+    j = Job(db, job_id)
+    for key, value in kwargs.items():
+        setattr(j, key, value)
+    j.commit()
+    return j
+
+
+def test_rebuild(db):
+    _make_job(db, 'bacteria-1', email='alice@example.org', jobtype='antismash7', state='running',
+              dispatcher='dispatcher-1')
+    _make_job(db, 'bacteria-2', email='alice@example.org', jobtype='antismash8')
+    _make_job(db, 'bacteria-3', email='bob@example.org', jobtype='antismash8')
+    db.sadd('index:email:outdated@example.org', 'bacteria-old')
+    db.sadd('index-rebuild:email:leftover@example.org', 'bacteria-old')
+
+    args = Namespace(scan_count=2, chunk_size=2)
+    assert index.rebuild(args, db) == "Indexed 3 jobs into 9 indexes"
+
+    assert db.smembers('index:email:alice@example.org') == {'bacteria-1', 'bacteria-2'}
+    assert db.smembers('index:jobtype:antismash8') == {'bacteria-2', 'bacteria-3'}
+    assert db.smembers('index:state:created') == {'bacteria-2', 'bacteria-3'}
+    assert db.smembers('index:dispatcher:dispatcher-1') == {'bacteria-1'}
+    assert not db.exists('index:email:outdated@example.org')
+    assert not db.keys('index-rebuild:*')
+    assert db.zcard('index:added') == 3
+    assert db.zcard('index:last_changed') == 3
+
+    db.hset('job:bacteria-3', 'added', 'yesterday')
+    assert index.rebuild(args, db) == ("Indexed 3 jobs into 9 indexes, 1 jobs with unparsable "
+                                       "timestamps left out of the time indexes")
+    assert db.zscore('index:added', 'bacteria-3') is None
+    assert db.zscore('index:last_changed', 'bacteria-3') is not None
+
+
+def test_find_jobs(db):
+    db.sadd('index:email:alice@example.org', 'bacteria-1', 'bacteria-2')
+    db.sadd('index:state:running', 'bacteria-2', 'bacteria-3')
+
+    assert index.find_jobs(db, {'email': 'alice@example.org'}) == {'bacteria-1', 'bacteria-2'}
+    assert index.find_jobs(db, {'email': 'alice@example.org', 'state': 'running'}) == {'bacteria-2'}
+
+    with pytest.raises(ValueError, match="not indexed"):
+        index.find_jobs(db, {'filename': 'test.gbk'})
+    with pytest.raises(ValueError, match="at least one"):
+        index.find_jobs(db, {})
+
+
+def test_update_job_index(db):
+    db.sadd('index:state:running', 'bacteria-1')
+    db.sadd('index:dispatcher:dispatcher-1', 'bacteria-1')
+
+    old = {'state': 'running', 'dispatcher': 'dispatcher-1', 'email': 'alice@example.org'}
+    new = {'state': 'queued', 'dispatcher': None, 'email': 'alice@example.org'}
+    pipe = db.pipeline()
+    index.update_job_index(pipe, 'bacteria-1', old, new)
+    pipe.execute()
+
+    assert db.smembers('index:state:queued') == {'bacteria-1'}
+    assert not db.exists('index:state:running')
+    assert not db.exists('index:dispatcher:dispatcher-1')
+    assert not db.exists('index:email:alice@example.org')
+
+
+def test_update_time_index(db):
+    j = Job(db, 'bacteria-1')
+    j.added = datetime(2024, 3, 1, tzinfo=UTC)
+    j.last_changed = datetime(2024, 3, 2, tzinfo=UTC)
+    pipe = db.pipeline()
+    index.update_time_index(pipe, j)
+    pipe.execute()
+
+    assert db.zscore('index:added', 'bacteria-1') == j.added.timestamp()
+    assert db.zscore('index:last_changed', 'bacteria-1') == j.last_changed.timestamp()
+
+    pipe = db.pipeline()
+    index.remove_from_time_index(pipe, 'bacteria-1')
+    pipe.execute()
+    assert not db.exists('index:added', 'index:last_changed')
+
+
+def test_find_jobs_in_ranges(db):
+    db.zadd('index:added', {'bacteria-1': 100, 'bacteria-2': 200, 'bacteria-3': 300})
+    db.zadd('index:last_changed', {'bacteria-1': 150, 'bacteria-2': 900, 'bacteria-3': 350})
+    db.sadd('index:state:running', 'bacteria-1', 'bacteria-2')
+
+    assert index.find_jobs_in_ranges(db, {'added': (150, 400)}) == ['bacteria-2', 'bacteria-3']
+    ranges = {'added': (0, 400), 'last_changed': (0, 500)}
+    assert index.find_jobs_in_ranges(db, ranges, chunk_size=2) == ['bacteria-1', 'bacteria-3']
+    assert index.find_jobs_in_ranges(db, ranges, {'state': 'running'}) == ['bacteria-1']
+
+    with pytest.raises(ValueError, match="no time index"):
+        index.find_jobs_in_ranges(db, {'finished': (0, 1)})
+    with pytest.raises(ValueError, match="at least one"):
+        index.find_jobs_in_ranges(db, {})
+
+
+def test_cluster_rejected(mocker):
+    cluster = mocker.MagicMock(spec=redis.RedisCluster)
+    with pytest.raises(AntismashStorageError, match="Rebuilding the indexes"):
+        index.rebuild(Namespace(), cluster)
+    with pytest.raises(AntismashStorageError, match="Redis Cluster"):
+        index.find_jobs(cluster, {'email': 'alice@example.org'})
+    cluster.sinter.assert_not_called()
+    cluster.rename.assert_not_called()
@@ -1,9 +1,18 @@
-from antismash_models import SyncJob as Job
+import argparse
+import asyncio
+import json
+import os
+from antismash_models import SyncControl as Control, SyncJob as Job
 from argparse import Namespace
+from datetime import datetime, timedelta, UTC
 import pytest
+import redis
+from redis.client import Pipeline
 
+from smashctl.archive import JobArchive
 from smashctl.common import AntismashRunError
-from smashctl import job
+from smashctl import index, job
+from smashctl.storage import RetryPolicy, fetch_in_batches
 
 
 def test_show_simple(db):
@@ -19,6 +28,23 @@ def test_show_simple(db):
         job.show(args, db)
 
 
+def test_show_retried(db, mocker):
+    Job(db, 'bacteria-1').commit()
+    mocker.patch('time.sleep')
+    mocker.patch.dict('smashctl.storage._RETRY_POLICIES', {db: RetryPolicy(retries=1)})
+    hmget = db.hmget
+    failures = [redis.ConnectionError()]
+
+    def flaky_hmget(*args):
+        if failures:
+            raise failures.pop()
+        return hmget(*args)
+
+    mocker.patch.object(db, 'hmget', side_effect=flaky_hmget)
+    args = Namespace(job_id='bacteria-1', pretty="oneline")
+    assert job.show(args, db).startswith('bacteria-1\t')
+
+
 def test_joblist_simple(db):
     running_jobs = [
         Job(db, 'bacteria-1'),
@@ -48,14 +74,14 @@ def test_joblist_simple(db):
 
     args = Namespace(queue='queued', pretty="oneline")
     expected = '\n'.join(expected_lines_queued)
-    assert job.joblist(args, db) == expected
+    assert '\n'.join(job.joblist(args, db)) == expected
 
     args = Namespace(queue='running', pretty="oneline")
     expected = '\n'.join(expected_lines_running)
-    assert job.joblist(args, db) == expected
+    assert '\n'.join(job.joblist(args, db)) == expected
 
     args = Namespace(queue='fake', pretty="oneline")
-    assert job.joblist(args, db) == "No jobs in queue 'fake'"
+    assert '\n'.join(job.joblist(args, db)) == "No jobs in queue 'fake'"
 
 
 def test_restart(db):
@@ -64,7 +90,7 @@ def test_restart(db):
     j.commit()
     db.lpush('jobs:running', j.job_id)
 
-    args = Namespace(job_id=j.job_id, queue="jobs:queued")
+    args = Namespace(job_ids=[j.job_id], queue="jobs:queued")
 
     # Jobs in 'created' state can't be restarted
     with pytest.raises(AntismashRunError):
@@ -83,10 +109,657 @@ def test_restart(db):
     assert j.status == 'restarted'
     print(j.to_dict())
 
-    args = Namespace(job_id='bacteria-fake')
+    args = Namespace(job_ids=['bacteria-fake'], queue="jobs:queued")
     with pytest.raises(AntismashRunError):
         job.restart(args, db)
 
 
 def test_notify(mocker, db):
     j = Job(db, 'bacteria-fake')
+
+
+def test_joblist_chunked(db):
+    expected_lines = []
+    for i in range(5):
+        j = Job(db, f'bacteria-{i}')
+        j.commit()
+        db.rpush('jobs:queued', j.job_id)
+        expected_lines.append(job._format_job(j))
+        if i == 2:
+            db.rpush('jobs:queued', 'bacteria-vanished')
+
+    args = Namespace(queue='queued', pretty="oneline", chunk_size=2)
+    assert '\n'.join(job.joblist(args, db)) == '\n'.join(expected_lines)
+
+
+def _bulk_args(**kwargs):
+    defaults = dict(job_ids=[], from_queue=None, filters=[], queue="jobs:queued", chunk_size=2)
+    defaults.update(kwargs)
+    return Namespace(**defaults)
+
+
+def test_restart_bulk(db, mocker):
+    for i in range(4):
+        j = Job(db, f'bacteria-{i}')
+        j.state = 'failed'
+        j.jobtype = 'antismash7' if i % 2 else 'antismash8'
+        j.commit()
+        db.rpush('jobs:failed', j.job_id)
+    pipeline_spy = mocker.spy(db, 'pipeline')
+
+    args = _bulk_args(job_ids=['bacteria-0', 'bacteria-fake', 'bacteria-1'])
+    expected = "\n".join([
+        "Restarted job bacteria-0",
+        "Job bacteria-fake not found in database!",
+        "Restarted job bacteria-1",
+        "Restarted 2 of 3 jobs",
+    ])
+    assert job.restart(args, db) == expected
+    assert db.lrange('jobs:failed', 0, -1) == ['bacteria-2', 'bacteria-3']
+    assert db.lrange('jobs:queued', 0, -1) == ['bacteria-0', 'bacteria-1']
+    # two batches of two IDs, each needing a pipeline for fetching and one for the changes
+    assert pipeline_spy.call_count == 4
+
+    args = _bulk_args(from_queue='jobs:failed', filters=[('jobtype', 'antismash7')])
+    assert job.restart(args, db) == "Restarted job bacteria-3"
+    assert db.lrange('jobs:failed', 0, -1) == ['bacteria-2']
+    assert Job(db, 'bacteria-3').fetch().state == 'queued'
+
+
+def test_restart_stdin(db, mocker):
+    for i in range(2):
+        j = Job(db, f'bacteria-{i}')
+        j.state = 'done'
+        j.commit()
+        db.rpush('jobs:done', j.job_id)
+    mocker.patch('sys.stdin', ['bacteria-0\n', '\n', 'bacteria-1\n'])
+
+    args = _bulk_args(job_ids=['-'])
+    assert job.restart(args, db).endswith("Restarted 2 of 2 jobs")
+    assert db.llen('jobs:done') == 0
+    assert db.llen('jobs:queued') == 2
+
+
+def test_cancel_bulk(db, mocker):
+    mail_session = mocker.patch('smashctl.mail.MailSession')
+    for i, state in enumerate(['queued', 'running', 'queued']):
+        j = Job(db, f'bacteria-{i}')
+        j.state = state
+        j.commit()
+        db.rpush(f'jobs:{state}', j.job_id)
+
+    args = _bulk_args(job_ids=['bacteria-0', 'bacteria-1', 'bacteria-2'], force=False,
+                      notify=False, reason="Testing", state="failed")
+    expected = "\n".join([
+        "Canceled job bacteria-0 (failed)",
+        "Cannot cancel job bacteria-1 in state running",
+        "Canceled job bacteria-2 (failed)",
+        "Canceled 2 of 3 jobs, skipped 1",
+    ])
+    assert job.cancel(args, db) == expected
+    assert db.llen('jobs:queued') == 0
+    assert db.lrange('jobs:failed', 0, -1) == ['bacteria-2', 'bacteria-0']
+    j = Job(db, 'bacteria-0').fetch()
+    assert j.state == 'failed'
+    assert j.status == 'failed: Testing'
+    # without --notify, no mail session is set up
+    mail_session.assert_not_called()
+
+    args.job_ids = ['bacteria-fake']
+    with pytest.raises(AntismashRunError):
+        job.cancel(args, db)
+
+    args.job_ids = []
+    args.from_queue = 'jobs:queued'
+    with pytest.raises(AntismashRunError, match="No matching jobs found"):
+        job.cancel(args, db)
+
+
+def test_notify_bulk(db, mocker):
+    mock_session = mocker.MagicMock()
+    mock_session.__enter__.return_value = mock_session
+    mocker.patch('smashctl.mail.MailSession', return_value=mock_session)
+    mock_send = mocker.patch('smashctl.mail.send_mail')
+
+    for i in range(3):
+        j = Job(db, f'bacteria-{i}')
+        j.state = 'done'
+        if i:
+            j.email = 'claire@example.com'
+        j.commit()
+
+    args = _bulk_args(job_ids=['bacteria-0', 'bacteria-1', 'bacteria-2'])
+    expected = "\n".join([
+        "No email configured for job bacteria-0",
+        "Mail sent for job bacteria-1 (done)",
+        "Mail sent for job bacteria-2 (done)",
+        "Notified 3 of 3 jobs",
+    ])
+    assert job.notify(args, db) == expected
+    assert mock_send.call_count == 2
+    for call in mock_send.call_args_list:
+        assert call[0][2] is mock_session
+    mock_session.__exit__.assert_called_once()
+
+
+def test_notify_parallel(db, mocker):
+    report = mocker.MagicMock()
+    report.sent = ['fake']
+    report.skipped = []
+    report.failed = {}
+    report.lines.return_value = iter(["Mail sent for job bacteria-0 (done)"])
+
+    def fake_parallel(conf, jobs, workers, rate_limit, error_reports):
+        assert [j.job_id for j in jobs] == ['bacteria-0']
+        return report
+    mock_parallel = mocker.patch('smashctl.mail.send_mails_parallel', side_effect=fake_parallel)
+
+    j = Job(db, 'bacteria-0')
+    j.email = 'claire@example.com'
+    j.commit()
+
+    args = _bulk_args(job_ids=['bacteria-0', 'bacteria-fake'], parallel=4, rate_limit=1.5)
+    expected = "\n".join([
+        "Job bacteria-fake not found in database!",
+        "Mail sent for job bacteria-0 (done)",
+        "Notified 1 of 2 jobs",
+    ])
+    assert job.notify(args, db) == expected
+    assert mock_parallel.call_args[0][2:] == (4, 1.5, False)
+
+
+def test_async_joblist(db, async_db):
+    for i in range(5):
+        j = Job(db, f'bacteria-{i}')
+        j.commit()
+        db.rpush('jobs:queued', j.job_id)
+    db.rpush('jobs:queued', 'bacteria-vanished')
+
+    args = Namespace(queue='queued', pretty="oneline", chunk_size=2)
+    expected = '\n'.join(job.joblist(args, db))
+    assert asyncio.run(job.async_joblist(args, async_db)) == expected
+
+    args = Namespace(queue='fake', pretty="oneline")
+    assert asyncio.run(job.async_joblist(args, async_db)) == "No jobs in queue 'fake'"
+
+    args = Namespace(queue='queued', pretty="oneline", email='alice@example.org',
+                     since=None, fields=('job_id',))
+    with pytest.raises(AntismashRunError, match="--email, --fields can't be combined"):
+        asyncio.run(job.async_joblist(args, async_db))
+
+
+def test_async_show(db, async_db):
+    j = Job(db, 'bacteria-fake')
+    j.commit()
+    args = Namespace(job_id='bacteria-fake', pretty="verbose")
+    assert asyncio.run(job.async_show(args, async_db)) == job.show(args, db)
+
+    args.job_id = 'bacteria-nonexisting'
+    with pytest.raises(AntismashRunError):
+        asyncio.run(job.async_show(args, async_db))
+
+
+def _strip_times(lines):
+    return [line.split(' ', 1)[1] for line in lines]
+
+
+def _watch_args(**kwargs):
+    defaults = dict(job_ids=[], queue=None, timeout=0, poll_interval=1.0, max_poll_interval=4.0)
+    defaults.update(kwargs)
+    return Namespace(**defaults)
+
+
+def test_watch_polling(db, mocker):
+    j = Job(db, 'bacteria-1')
+    j.state = 'queued'
+    j.status = 'queued'
+    j.commit()
+
+    delays = []
+
+    def fake_sleep(delay):
+        delays.append(delay)
+        if len(delays) == 1:
+            j.state = 'running'
+            j.status = 'running: step 1'
+            j.commit()
+        elif len(delays) == 4:
+            j.state = 'done'
+            j.status = 'done'
+            j.commit()
+
+    mocker.patch('time.sleep', side_effect=fake_sleep)
+    args = _watch_args(job_ids=['bacteria-1', 'bacteria-fake'])
+
+    assert _strip_times(job.watch(args, db)) == [
+        'bacteria-1\tqueued\tqueued',
+        'bacteria-fake\tnot found',
+        'bacteria-1\trunning\trunning: step 1',
+        'bacteria-1\tdone\tdone',
+    ]
+    # back off while nothing changes, up to the maximum
+    assert delays == [1.0, 1.0, 2.0, 4.0]
+
+
+def test_watch_polling_queue_timeout(db, mocker):
+    Job(db, 'bacteria-1').commit()
+    Job(db, 'bacteria-2').commit()
+    db.rpush('jobs:running', 'bacteria-1')
+    clock = [0.0]
+    mocker.patch('time.monotonic', side_effect=lambda: clock[0])
+
+    def fake_sleep(delay):
+        assert delay == 1.0
+        clock[0] = 5.0
+        db.lrem('jobs:running', 1, 'bacteria-1')
+        db.rpush('jobs:running', 'bacteria-2')
+
+    mocker.patch('time.sleep', side_effect=fake_sleep)
+    args = _watch_args(queue='jobs:running', timeout=2)
+    assert _strip_times(job.watch(args, db)) == [
+        'bacteria-1\tjoined jobs:running',
+        'bacteria-1\tcreated\tpending',
+        'bacteria-1\tleft jobs:running',
+        'bacteria-2\tjoined jobs:running',
+        'bacteria-2\tcreated\tpending',
+    ]
+
+
+def test_watch_notifications(db, mocker):
+    j = Job(db, 'bacteria-1')
+    j.state = 'running'
+    j.commit()
+
+    mocker.patch.object(db, 'config_get', return_value={'notify-keyspace-events': 'Kh$l'})
+    pubsub = mocker.MagicMock()
+
+    messages = [None, {'channel': '__keyspace@0__:job:bacteria-1', 'data': 'hset'}]
+
+    def fake_message(timeout):
+        message = messages.pop(0)
+        if message:
+            j.state = 'done'
+            j.commit()
+        return message
+
+    pubsub.get_message.side_effect = fake_message
+    mocker.patch.object(db, 'pubsub', return_value=pubsub)
+    poll = mocker.patch('smashctl.job._watch_polling')
+
+    args = _watch_args(job_ids=['bacteria-1'])
+    lines = _strip_times(job.watch(args, db))
+    poll.assert_not_called()
+    pubsub.subscribe.assert_called_once_with('__keyspace@0__:job:bacteria-1')
+    pubsub.close.assert_called_once()
+    assert lines == ['bacteria-1\trunning\tpending', 'bacteria-1\tdone\tpending']
+
+
+def test_watch_notifications_queue_debounced(db, mocker):
+    for job_id in ('bacteria-1', 'bacteria-2'):
+        Job(db, job_id).commit()
+    db.rpush('jobs:running', 'bacteria-1')
+
+    mocker.patch.object(db, 'config_get', return_value={'notify-keyspace-events': 'KA'})
+    clock = [0.0]
+    mocker.patch('time.monotonic', side_effect=lambda: clock[0])
+    pubsub = mocker.MagicMock()
+    queue_event = {'channel': '__keyspace@0__:jobs:running', 'data': 'rpush'}
+    messages = [queue_event] * 3 + [{'channel': '__keyspace@0__:job:bacteria-1', 'data': 'hset'}]
+
+    def fake_message(timeout):
+        if not messages:
+            clock[0] += max(timeout, 0.5)
+            return None
+        clock[0] += 0.1
+        message = messages.pop(0)
+        if message is queue_event and len(messages) == 3:
+            db.rpush('jobs:running', 'bacteria-2')
+        return message
+
+    pubsub.get_message.side_effect = fake_message
+    mocker.patch.object(db, 'pubsub', return_value=pubsub)
+    lrange = mocker.spy(db, 'lrange')
+    read_jobs = mocker.spy(job.JobWatcher, '_read_jobs')
+
+    args = _watch_args(queue='jobs:running', timeout=3)
+    lines = _strip_times(job.watch(args, db))
+    assert lines == [
+        'bacteria-1\tjoined jobs:running',
+        'bacteria-1\tcreated\tpending',
+        'bacteria-2\tjoined jobs:running',
+        'bacteria-2\tcreated\tpending',
+    ]
+    # two initial reads, then a single one for three queue events
+    assert lrange.call_count == 3
+    # after a queue event only the joined job is read, after a job event only that job
+    assert [list(call.args[2]) for call in read_jobs.call_args_list[2:]] == [
+        ['bacteria-1'], ['bacteria-2']]
+    pubsub.subscribe.assert_called_with('__keyspace@0__:job:bacteria-2')
+
+
+def test_watch_cluster_polls(mocker):
+    cluster = mocker.MagicMock(spec=redis.RedisCluster)
+    poll = mocker.patch('smashctl.job._watch_polling', return_value=iter(()))
+    mocker.patch.object(job.JobWatcher, 'update', return_value=[])
+    list(job.watch(_watch_args(job_ids=['bacteria-1']), cluster))
+    poll.assert_called_once()
+    cluster.config_get.assert_not_called()
+    cluster.pubsub.assert_not_called()
+
+
+def test_watch_nothing(db):
+    with pytest.raises(AntismashRunError):
+        list(job.watch(_watch_args(), db))
+
+
+def test_joblist_index_filters(db):
+    for i, (email, state) in enumerate([('alice@example.org', 'running'),
+                                        ('alice@example.org', 'queued'),
+                                        ('bob@example.org', 'running')]):
+        j = Job(db, f'bacteria-{i}')
+        j.email = email
+        j.state = state
+        j.jobtype = 'antismash8'
+        j.commit()
+        db.rpush(f'jobs:{state}', j.job_id)
+    index.rebuild(Namespace(), db)
+
+    args = Namespace(queue='running', pretty="oneline", email='alice@example.org')
+    lines = list(job.joblist(args, db))
+    assert len(lines) == 1
+    assert lines[0].startswith('bacteria-0\t')
+
+    args = Namespace(queue='all', pretty="oneline", email='alice@example.org', jobtype='antismash8')
+    assert [line.split('\t')[0] for line in job.joblist(args, db)] == ['bacteria-0', 'bacteria-1']
+
+    args = Namespace(queue='running', pretty="oneline", dispatcher='dispatcher-1')
+    assert list(job.joblist(args, db)) == ["No jobs in queue 'running'"]
+
+    # moved by another tool without updating the state index
+    db.lrem('jobs:running', 1, 'bacteria-0')
+    db.rpush('jobs:done', 'bacteria-0')
+    args = Namespace(queue='running', pretty="oneline", jobtype='antismash8')
+    assert [line.split('\t')[0] for line in job.joblist(args, db)] == ['bacteria-2']
+    args.queue = 'done'
+    assert [line.split('\t')[0] for line in job.joblist(args, db)] == ['bacteria-0']
+
+
+def test_restart_updates_index(db):
+    j = Job(db, 'bacteria-1')
+    j.state = 'running'
+    j.dispatcher = 'dispatcher-1'
+    j.commit()
+    db.rpush('jobs:running', j.job_id)
+    index.rebuild(Namespace(), db)
+
+    job.restart(_bulk_args(job_ids=['bacteria-1']), db)
+    assert db.smembers('index:state:queued') == {'bacteria-1'}
+    assert not db.exists('index:state:running')
+    assert not db.exists('index:dispatcher:dispatcher-1')
+    assert db.zscore('index:last_changed', 'bacteria-1') > j.last_changed.timestamp()
+
+
+def test_joblist_time_ranges(db):
+    now = datetime.now(UTC)
+    for i, (age, state) in enumerate([(timedelta(days=3), 'running'),
+                                      (timedelta(hours=5), 'running'),
+                                      (timedelta(minutes=5), 'queued')]):
+        j = Job(db, f'bacteria-{i}')
+        j.state = state
+        j.added = now - age
+        j.last_changed = now - age
+        j.commit()
+        db.rpush(f'jobs:{state}', j.job_id)
+    index.rebuild(Namespace(), db)
+
+    def listed(**kwargs):
+        args = Namespace(queue='all', pretty="oneline", **kwargs)
+        return [line.split('\t')[0] for line in job.joblist(args, db)]
+
+    assert listed(since=now - timedelta(days=1)) == ['bacteria-1', 'bacteria-2']
+    assert listed(until=now - timedelta(days=1)) == ['bacteria-0']
+    assert listed(since=now - timedelta(days=1), stale_for=timedelta(hours=1)) == ['bacteria-1']
+    assert listed(stale_for=timedelta(hours=1), email=None) == ['bacteria-0', 'bacteria-1']
+
+    args = Namespace(queue='running', pretty="oneline", since=now - timedelta(hours=1))
+    assert list(job.joblist(args, db)) == ["No jobs in queue 'running'"]
+
+    # a stale time index only narrows down the candidates
+    db.zadd('index:added', {'bacteria-0': (now - timedelta(hours=2)).timestamp()})
+    assert listed(since=now - timedelta(days=1)) == ['bacteria-1', 'bacteria-2']
+    assert listed(since=now - timedelta(days=1), fields=('job_id', 'state')) == [
+        'bacteria-1', 'bacteria-2']
+
+    # without a time index, the queues are scanned
+    db.delete('index:added', 'index:last_changed')
+    assert listed(since=now - timedelta(days=1)) == ['bacteria-2', 'bacteria-1']
+    args = Namespace(queue='running', pretty="verbose", stale_for=timedelta(hours=1))
+    assert [line.split('\n')[0] for line in job.joblist(args, db)] == ['bacteria-0', 'bacteria-1']
+
+
+def _reap_args(**kwargs):
+    defaults = dict(stale_for=timedelta(hours=1), requeue=False, queue='jobs:queued', limit=0,
+                    chunk_size=2)
+    defaults.update(kwargs)
+    return Namespace(**defaults)
+
+
+def _make_running_jobs(db):
+    Control(db, 'alive', 5).commit()
+    gone = Control(db, 'stopped', 5)
+    gone.running = False
+    gone.commit()
+
+    now = datetime.now(UTC)
+    for job_id, dispatcher, age in [('bacteria-ok', 'alive', timedelta(minutes=5)),
+                                    ('bacteria-orphan', 'crashed', timedelta(minutes=5)),
+                                    ('bacteria-stopped', 'stopped', timedelta(minutes=5)),
+                                    ('bacteria-stuck', 'alive', timedelta(hours=3))]:
+        j = Job(db, job_id)
+        j.state = 'running'
+        j.dispatcher = dispatcher
+        j.commit()
+        db.hset(j._key, 'last_changed', (now - age).strftime("%Y-%m-%d %H:%M:%S.%f"))
+        db.rpush('jobs:running', job_id)
+    db.rpush('jobs:running', 'bacteria-missing')
+
+
+def test_reap_report(db):
+    _make_running_jobs(db)
+
+    lines = list(job.reap(_reap_args(), db))
+    assert [line.split('\t')[:2] for line in lines[:-1]] == [
+        ['bacteria-orphan', 'orphaned'],
+        ['bacteria-stopped', 'orphaned'],
+        ['bacteria-stuck', 'stale'],
+        ['bacteria-missing', 'missing'],
+    ]
+    assert lines[-1] == "Found 2 orphaned and 1 stale of 5 running jobs"
+    assert db.llen('jobs:running') == 5
+
+
+def test_reap_requeue(db):
+    _make_running_jobs(db)
+
+    lines = list(job.reap(_reap_args(requeue=True, limit=2), db))
+    assert lines[-3:] == ["Requeued job bacteria-orphan", "Requeued job bacteria-stopped",
+                          "Requeued 2 jobs"]
+    assert db.lrange('jobs:queued', 0, -1) == ['bacteria-orphan', 'bacteria-stopped']
+    assert db.lrange('jobs:running', 0, -1) == ['bacteria-ok', 'bacteria-stuck',
+                                                'bacteria-missing']
+    requeued = Job(db, 'bacteria-orphan').fetch()
+    assert requeued.state == 'queued'
+    assert requeued.dispatcher == ''
+
+
+def test_joblist_skips_partial_hash(db):
+    Job(db, 'bacteria-1').commit()
+    db.hset('job:bacteria-partial', 'email', 'alice@example.org')
+    db.rpush('jobs:queued', 'bacteria-partial', 'bacteria-1')
+
+    args = Namespace(queue='queued', pretty="verbose")
+    lines = list(job.joblist(args, db))
+    assert len(lines) == 1
+    assert lines[0].startswith('bacteria-1\n')
+
+    args = Namespace(queue='queued', pretty="oneline", format="jsonl")
+    assert [json.loads(line)['job_id'] for line in job.joblist(args, db)] == ['bacteria-1']
+
+
+def test_joblist_format(db):
+    for i in range(3):
+        j = Job(db, f'bacteria-{i}')
+        j.filename = f'contains\ttab-{i}.gbk'
+        j.commit()
+        db.rpush('jobs:queued', j.job_id)
+
+    args = Namespace(queue='queued', pretty="oneline", format="jsonl", chunk_size=2)
+    records = [json.loads(line) for line in job.joblist(args, db)]
+    assert [record['job_id'] for record in records] == ['bacteria-0', 'bacteria-1', 'bacteria-2']
+    assert records[0]['filename'] == 'contains\ttab-0.gbk'
+    assert set(records[0]) == set(job.JOB_FIELDS)
+
+    args = Namespace(queue='empty', pretty="oneline", format="csv")
+    assert list(job.joblist(args, db)) == [",".join(job.JOB_FIELDS)]
+
+
+def test_joblist_fields(db, mocker):
+    for i in range(3):
+        j = Job(db, f'bacteria-{i}')
+        j.email = 'alice@example.org'
+        j.filename = f'input-{i}.gbk'
+        j.download = 'NC_003888' if i == 1 else None
+        j.smcogs = True
+        j.commit()
+        db.rpush('jobs:queued', j.job_id)
+
+    expected = [job._format_job(j, "oneline") for j in
+                fetch_in_batches(db, lambda job_id: Job(db, job_id),
+                                 ['bacteria-0', 'bacteria-1', 'bacteria-2'])]
+
+    hmget_spy = mocker.spy(Pipeline, "hmget")
+    args = Namespace(queue='queued', pretty="oneline", chunk_size=2)
+    assert list(job.joblist(args, db)) == expected
+    fetched_fields = {field for call in hmget_spy.call_args_list for field in call.args[2:]}
+    assert fetched_fields == set(job.ONELINE_FIELDS) - {'job_id'}
+
+    args = Namespace(queue='queued', pretty="oneline", fields=('job_id', 'smcogs', 'added'))
+    lines = list(job.joblist(args, db))
+    assert lines[0].startswith('bacteria-0\tTrue\t')
+    assert lines[0].endswith('+00:00')
+
+    args = Namespace(queue='queued', pretty="oneline", fields=('job_id', 'email'), format="jsonl")
+    assert json.loads(next(job.joblist(args, db))) == {'job_id': 'bacteria-0',
+                                                      'email': 'alice@example.org'}
+
+    # values are parsed by the model, so they show just like in fully fetched jobs
+    db.hdel('job:bacteria-2', 'status', 'trace')
+    full = Job(db, 'bacteria-2').fetch()
+    args = Namespace(queue='queued', pretty="oneline",
+                     fields=('job_id', 'status', 'trace', 'last_changed', 'state'))
+    assert list(job.joblist(args, db))[2] == \
+        f'bacteria-2\t{full.status}\t[]\t{full.last_changed}\tcreated'
+
+
+def test_parse_fields():
+    assert job._parse_fields("job_id, state,email") == ('job_id', 'state', 'email')
+    with pytest.raises(argparse.ArgumentTypeError):
+        job._parse_fields("job_id,nonsense")
+
+
+def _make_finished_jobs(db):
+    now = datetime.now(UTC)
+    for job_id, state, age in [('bacteria-new', 'done', timedelta(days=1)),
+                               ('bacteria-old', 'done', timedelta(days=40)),
+                               ('bacteria-older', 'done', timedelta(days=50)),
+                               ('bacteria-broken', 'failed', timedelta(days=45)),
+                               ('bacteria-recent', 'failed', timedelta(hours=1))]:
+        j = Job(db, job_id)
+        j.state = state
+        j.email = 'alice@example.org'
+        j.commit()
+        db.hset(j._key, 'last_changed', (now - age).strftime("%Y-%m-%d %H:%M:%S.%f"))
+        db.lpush(f'jobs:{state}', job_id)
+    db.lpush('jobs:done', 'bacteria-missing')
+    index.rebuild(Namespace(), db)
+    # left behind when the job hash disappeared
+    db.sadd('index:state:done', 'bacteria-missing')
+    db.zadd('index:added', {'bacteria-missing': now.timestamp()})
+
+
+def test_archive(db, tmp_path):
+    _make_finished_jobs(db)
+    path = str(tmp_path / 'archive.jsonl')
+    args = Namespace(older_than=timedelta(days=30), expire_remaining=None, archive=path,
+                     chunk_size=2)
+
+    lines = list(job.archive(args, db))
+    assert lines == ["Archived 2 jobs from jobs:done, dropped 1 entries of missing jobs",
+                     "Archived 1 jobs from jobs:failed", f"Archived 3 jobs to {path}"]
+    assert db.lrange('jobs:done', 0, -1) == ['bacteria-new']
+    assert not db.sismember('index:state:done', 'bacteria-missing')
+    assert db.zscore('index:added', 'bacteria-missing') is None
+    assert db.lrange('jobs:failed', 0, -1) == ['bacteria-recent']
+    for job_id in ('bacteria-old', 'bacteria-older', 'bacteria-broken'):
+        assert not db.exists(f'job:{job_id}')
+        assert not db.sismember('index:email:alice@example.org', job_id)
+        assert db.zscore('index:added', job_id) is None
+        assert db.zscore('index:last_changed', job_id) is None
+    assert db.sismember('index:email:alice@example.org', 'bacteria-new')
+    assert JobArchive(path).get('bacteria-broken')['state'] == 'failed'
+
+    args.expire_remaining = timedelta(days=7)
+    lines = list(job.archive(args, db))
+    assert lines[:2] == ["Archived 0 jobs from jobs:done, 1 remaining jobs will expire",
+                         "Archived 0 jobs from jobs:failed, 1 remaining jobs will expire"]
+    # a day old, so it can be archived 29 days from now and expires 7 days after that
+    assert 35 * 86400 < db.ttl('job:bacteria-new') <= 36 * 86400
+
+
+def test_archive_keeps_changed_and_duplicate_jobs(db, tmp_path, mocker):
+    _make_finished_jobs(db)
+    db.rpush('jobs:done', 'bacteria-old', 'bacteria-new')
+    append = JobArchive.append
+
+    def append_then_restart(self, jobs):
+        jobs = list(jobs)
+        if any(job_id == 'bacteria-older' for job_id, _ in jobs):
+            # restarted by someone else after its hash was read
+            db.hset('job:bacteria-older', mapping={'state': 'queued',
+                                                   'last_changed': '2100-01-01 00:00:00.0'})
+        return append(self, jobs)
+
+    mocker.patch.object(JobArchive, 'append', append_then_restart)
+    path = str(tmp_path / 'archive.jsonl')
+    args = Namespace(older_than=timedelta(days=30), expire_remaining=None, archive=path,
+                     chunk_size=2)
+    lines = list(job.archive(args, db))
+    assert lines[0] == "Archived 1 jobs from jobs:done, dropped 1 entries of missing jobs"
+    # both entries of the archived duplicate are gone
+    assert db.lrange('jobs:done', 0, -1) == ['bacteria-older', 'bacteria-new', 'bacteria-new']
+    assert db.hget('job:bacteria-older', 'state') == 'queued'
+    assert db.sismember('index:email:alice@example.org', 'bacteria-older')
+    assert not db.exists('job:bacteria-old')
+
+
+def test_show_archived(db, async_db, tmp_path):
+    _make_finished_jobs(db)
+    path = str(tmp_path / 'archive.jsonl')
+    expected = job._format_job(Job(db, 'bacteria-old').fetch(), "verbose")
+    list(job.archive(Namespace(older_than=timedelta(days=30), expire_remaining=None,
+                               archive=path), db))
+
+    args = Namespace(job_id='bacteria-old', pretty="verbose", archive=path)
+    assert job.show(args, db) == expected
+    assert asyncio.run(job.async_show(args, async_db)) == expected
+
+    args.job_id = 'bacteria-nonexisting'
+    with pytest.raises(AntismashRunError):
+        job.show(args, db)
+
+    args.job_id = 'bacteria-old'
+    os.remove(path)
+    with pytest.raises(AntismashRunError, match="Can't read job bacteria-old"):
+        job.show(args, db)
+    with pytest.raises(AntismashRunError, match="Can't read job bacteria-old"):
+        asyncio.run(job.async_show(args, async_db))
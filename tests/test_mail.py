@@ -3,6 +3,7 @@ from antismash_models import SyncJob as Job
 from argparse import Namespace
 from email.mime.text import MIMEText
 import smtplib
+import socket
 import pytest
 
 from smashctl import mail
@@ -120,4 +121,171 @@ def test_handle_send_invalid(mocker):
     message['From'] = conf.sender
     message['To'] = 'claire@example.com'
     with pytest.raises(mail.AntismashRunError):
-        mail.handle_send(conf, message)
\ No newline at end of file
+        mail.handle_send(conf, message)
+
+def _make_message(conf):
+    message = MIMEText('This is a test')
+    message['From'] = conf.sender
+    message['To'] = 'claire@example.com'
+    return message
+
+
+def test_mail_session_reuse(mocker):
+    mock_server = mocker.MagicMock(spec=smtplib.SMTP, instance=True)
+    mock_smtp = mocker.patch('smtplib.SMTP', autospec=True, return_value=mock_server)
+
+    conf = generate_mail_conf()
+    conf.encrypt = 'tls'
+
+    with mail.MailSession(conf, max_messages=2) as session:
+        for _ in range(3):
+            session.send(_make_message(conf))
+
+    # the third message needs a fresh connection
+    assert mock_smtp.call_count == 2
+    assert mock_server.starttls.call_count == 2
+    assert mock_server.login.call_count == 2
+    assert mock_server.send_message.call_count == 3
+    assert mock_server.quit.call_count == 2
+
+
+def test_mail_session_reconnect(mocker):
+    mock_server = mocker.MagicMock(spec=smtplib.SMTP, instance=True)
+    mock_server.send_message.side_effect = [smtplib.SMTPServerDisconnected, None, None]
+    mock_smtp = mocker.patch('smtplib.SMTP', autospec=True, return_value=mock_server)
+
+    conf = generate_mail_conf()
+    conf.encrypt = 'no'
+
+    session = mail.MailSession(conf)
+    session.send(_make_message(conf))
+    session.send(_make_message(conf))
+    session.close()
+
+    assert mock_smtp.call_count == 2
+    assert mock_server.send_message.call_count == 3
+    mock_server.quit.assert_called_once_with()
+
+
+def test_mail_session_unconfigured():
+    conf = mail.MailConfig.from_args(Namespace(server=''))
+    with pytest.raises(mail.AntismashRunError, match="not configured"):
+        mail.MailSession(conf).send(MIMEText('This is a test'))
+
+
+def test_send_mail_session(mocker):
+    mock_handle_send = mocker.patch('smashctl.mail.handle_send')
+    session = mocker.MagicMock(spec=mail.MailSession)
+    job = Job(None, 'bacteria-fake')
+    job.state = 'done'
+    job.email = 'claire@example.com'
+
+    mail.send_mail(generate_mail_conf(), job, session)
+    mock_handle_send.assert_not_called()
+    message = session.send.call_args[0][0]
+    assert message['To'] == job.email
+
+
+def test_rate_limiter(mocker):
+    mock_sleep = mocker.patch('time.sleep')
+    mocker.patch('time.monotonic', return_value=100.0)
+
+    limiter = mail.RecipientRateLimiter(2.0)
+    limiter.wait('claire@example.com')
+    limiter.wait('dave@example.com')
+    mock_sleep.assert_not_called()
+
+    limiter.wait('claire@example.com')
+    mock_sleep.assert_called_once_with(2.0)
+    limiter.wait('claire@example.com')
+    mock_sleep.assert_called_with(4.0)
+
+
+def test_send_mails_parallel_report(mocker):
+    def fake_send(conf, job, session):
+        if job.job_id == 'bacteria-2':
+            raise smtplib.SMTPRecipientsRefused({job.email: (550, b"nope")})
+    mocker.patch('smashctl.mail.send_mail', side_effect=fake_send)
+
+    jobs = []
+    for i in range(4):
+        job = Job(None, f'bacteria-{i}')
+        job.state = 'done'
+        job.email = 'claire@example.com' if i else None
+        jobs.append(job)
+
+    report = mail.send_mails_parallel(generate_mail_conf(), jobs, workers=2)
+    assert sorted(j.job_id for j in report.sent) == ['bacteria-1', 'bacteria-3']
+    assert [j.job_id for j in report.skipped] == ['bacteria-0']
+    assert list(report.failed) == ['bacteria-2']
+    assert len(list(report.lines())) == 4
+
+
+def test_send_mails_parallel_smtpd():
+    controller_module = pytest.importorskip('aiosmtpd.controller')
+
+    class Collector:
+        def __init__(self):
+            self.recipients = []
+
+        async def handle_DATA(self, server, session, envelope):
+            self.recipients.extend(envelope.rcpt_tos)
+            return '250 OK'
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    handler = Collector()
+    controller = controller_module.Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    try:
+        conf = generate_mail_conf()
+        conf.encrypt = 'no'
+        conf.server = controller.hostname
+        conf.port = port
+
+        jobs = []
+        for i in range(6):
+            job = Job(None, f'bacteria-{i}')
+            job.state = 'done'
+            job.email = f'user{i}@example.com'
+            jobs.append(job)
+
+        report = mail.send_mails_parallel(conf, jobs, workers=3)
+    finally:
+        controller.stop()
+
+    assert not report.failed
+    assert len(report.sent) == 6
+    assert sorted(handler.recipients) == sorted(job.email for job in jobs)
+
+
+def test_send_error_report(mocker):
+    mock_handle_send = mocker.patch('smashctl.mail.handle_send')
+    job = Job(None, 'bacteria-fake')
+    job.state = 'failed'
+    job.status = 'failed: Something broke'
+    job.dispatcher = 'dispatcher-1'
+
+    conf = generate_mail_conf()
+    mail.send_error_report(conf, job)
+    message = mock_handle_send.call_args[0][1]
+    assert message['To'] == conf.support
+    assert message['Subject'] == "antiSMASH job bacteria-fake failed"
+    text = message.get_payload()
+    assert 'Dispatcher: dispatcher-1' in text
+    assert 'failed: Something broke' in text
+
+
+def test_get_renderer_cached():
+    conf = generate_mail_conf()
+    assert mail.get_renderer(conf) is mail.get_renderer(conf)
+    # configs are created per job, equal settings need to share a renderer
+    assert mail.get_renderer(generate_mail_conf()) is mail.get_renderer(conf)
+    assert mail.get_renderer(conf).mail_conf.tool == conf.tool
+
+    other = generate_mail_conf()
+    other.tool = "otherSMASH"
+    assert mail.get_renderer(other) is not mail.get_renderer(conf)
+    assert mail._renderer_for.cache_info().maxsize == mail.RENDERER_CACHE_SIZE
@@ -0,0 +1,67 @@
+"""Tests for the command line handling"""
+import subprocess
+import sys
+
+from smashctl import __main__ as cli
+
+# modules only some subcommands need, the command line itself must not import them
+DEFERRED_MODULES = ("smtplib", "email.mime.text", "sqlite3", "dbm", "gzip", "http.server",
+                    "antismash_models")
+
+
+def test_find_subcommand():
+    assert cli.find_subcommand(["job", "list"]) == "job"
+    assert cli.find_subcommand(["--db", "redis://job:6379/0", "control", "-h"]) == "control"
+    assert cli.find_subcommand(["--chunk-size=10", "top", "--interval", "1"]) == "top"
+    assert cli.find_subcommand(["-h"]) is None
+    assert cli.find_subcommand([]) is None
+
+
+def test_build_parser():
+    parser = cli.build_parser(["index", "rebuild"])
+    args = parser.parse_args(["index", "rebuild"])
+    assert args.func.__module__ == "smashctl.index"
+
+    parser = cli.build_parser(["--scan-count", "5", "job", "list", "-q", "queued"])
+    args = parser.parse_args(["--scan-count", "5", "job", "list", "-q", "queued"])
+    assert args.scan_count == 5
+    assert args.queue == "queued"
+
+
+def test_storage_options(monkeypatch):
+    options = cli._storage_options(cli._get_env())
+    assert options["max_connections"] is None
+    assert options["retries"] == 3
+
+    monkeypatch.setenv("SMASHCTL_SOCKET_TIMEOUT", "2.5")
+    monkeypatch.setenv("SMASHCTL_MAX_CONNECTIONS", "8")
+    monkeypatch.setenv("SMASHCTL_RETRIES", "0")
+    options = cli._storage_options(cli._get_env())
+    assert options["socket_timeout"] == 2.5
+    assert options["max_connections"] == 8
+    assert options["retries"] == 0
+
+
+def _loaded_modules(code):
+    """Run code in a fresh interpreter, returning the names of all modules it imported"""
+    result = subprocess.run([sys.executable, "-c", code + "; print(' '.join(sorted(sys.modules)))"],
+                            capture_output=True, text=True, check=True)
+    return set(result.stdout.split())
+
+
+def test_import_main():
+    modules = _loaded_modules("import sys; import smashctl.__main__")
+    subcommand_modules = {f"smashctl.{module}" for module, _ in cli.SUBCOMMANDS.values()}
+    assert not modules & subcommand_modules
+    assert "smashctl.mail" not in modules
+    for unwanted in DEFERRED_MODULES:
+        assert unwanted not in modules
+
+
+def test_import_subcommand():
+    modules = _loaded_modules("import sys; from smashctl.__main__ import build_parser; "
+                              "build_parser(['job', 'list'])")
+    assert "smashctl.job" in modules
+    for unwanted in ("smtplib", "email.mime.text", "smashctl.mail", "smashctl.control",
+                     "smashctl.exporter", "http.server", "sqlite3"):
+        assert unwanted not in modules
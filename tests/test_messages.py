@@ -0,0 +1,40 @@
+"""Tests for the precompiled message templates"""
+from argparse import Namespace
+
+from antismash_models import SyncJob as Job
+import pytest
+
+from smashctl import messages
+
+
+def test_compiled_template():
+    template = messages.CompiledTemplate("{{literal}} {c.tool} job {j.job_id}: {extra}",
+                                         ("j.job_id", "extra"))
+    assert template.fields == ("c.tool", "j.job_id", "extra")
+
+    with pytest.raises(ValueError, match="Unbound template field 'c.tool'"):
+        template.render(("bacteria-fake", 42))
+
+    bound = template.bind("c", Namespace(tool="antiSMASH"))
+    assert bound.fields == ("j.job_id", "extra")
+    assert bound.render(("bacteria-fake", 42)) == "{literal} antiSMASH job bacteria-fake: 42"
+    # binding doesn't modify the original template
+    assert template.fields == ("c.tool", "j.job_id", "extra")
+
+    with pytest.raises(ValueError, match="Unsupported format"):
+        messages.CompiledTemplate("{value:>5}")
+
+
+def test_compiled_matches_format():
+    job = Job(None, 'bacteria-fake')
+    job.filename = 'test.gbk'
+    conf = Namespace(tool="antiSMASH", base_url="https://example.org", support="bob@example.org")
+
+    expected = messages.message_template.format(j=job, c=conf, action_string="Done.")
+    rendered = messages.MESSAGE.bind("c", conf).render(messages.job_row(job) + ("Done.",))
+    assert rendered == expected
+
+    expected = messages.error_message_template.format(j=job, c=conf, errors="E", warnings="W",
+                                                      backtrace="B")
+    rendered = messages.ERROR_MESSAGE.bind("c", conf).render(messages.job_row(job) + ("E", "W", "B"))
+    assert rendered == expected
@@ -1,5 +1,7 @@
 import argparse
-from datetime import date, datetime, time
+import asyncio
+import json
+from datetime import UTC, date, datetime, time, timedelta
 import uuid
 
 from antismash_models import SyncNotice as Notice
@@ -166,3 +168,50 @@ def test_remove(args, db, notices):
     )
     args.notice_id = "bob"
     assert expected == notice.remove(args, db)
+
+
+def test_async_notice_handlers(args, db, async_db, mocker):
+    start = datetime.now(UTC)
+    end = start + timedelta(days=1)
+    for notice_id, category in [("b_notice", "error"), ("a_notice", "info")]:
+        Notice(db, notice_id, category=category, show_from=start, show_until=end).commit()
+
+    args.pretty = "simple"
+    args.scan_count = 1
+    args.chunk_size = 1
+    expected = notice.notice_list(args, db)
+    assert expected.startswith("a_notice")
+
+    mocker.patch("uuid.uuid4", return_value="also-fake")
+
+    async def run():
+        assert expected == await notice.async_notice_list(args, async_db)
+
+        args.notice_id = "a_notice"
+        assert notice.show(args, db) == await notice.async_show(args, async_db)
+
+        args.teaser = "Test notice"
+        args.text = "A text for the test notice"
+        args.show_from = start
+        args.show_until = end
+        args.category = "warning"
+        assert (await notice.async_add(args, async_db)).startswith("Created new notice:\n")
+
+        args.notice_id = "also-fake"
+        assert "Removed notice: Test notice" == await notice.async_remove(args, async_db)
+        assert (await notice.async_remove(args, async_db)).startswith("Notice also-fake not found")
+
+    asyncio.run(run())
+
+
+def test_list_format(db, args):
+    start = datetime.now(UTC).replace(microsecond=0)
+    for notice_id, category in [("info_notice", "info"), ("error_notice", "error")]:
+        Notice(db, notice_id, category=category, teaser="teaser", text="text",
+               show_from=start, show_until=start + timedelta(days=1)).commit()  # type: ignore
+
+    args.format = "jsonl"
+    args.category = "error"
+    records = [json.loads(line) for line in notice.notice_list(args, db)]
+    assert [record["notice_id"] for record in records] == ["error_notice"]
+    assert records[0]["show_from"] == start.strftime("%Y-%m-%d %H:%M:%S.%f")
@@ -0,0 +1,102 @@
+"""Tests for the interactive shell and batch mode"""
+from argparse import Namespace
+
+from antismash_models import SyncJob as Job
+import pytest
+
+from smashctl import shell
+from smashctl.common import AntismashRunError
+
+
+def _args(**kwargs):
+    defaults = dict(db="redis://fake:6379/0", chunk_size=2, scan_count=10, keep_going=False)
+    defaults.update(kwargs)
+    return Namespace(**defaults)
+
+
+@pytest.fixture
+def jobs(db):
+    for i in range(3):
+        j = Job(db, f'bacteria-{i}')
+        j.state = 'failed'
+        j.commit()
+        db.rpush('jobs:failed', j.job_id)
+
+
+def test_runner(db, jobs, capsys):
+    runner = shell.CommandRunner(_args(), db)
+    assert runner.run("job list -q failed --fields job_id,state  # with a comment")
+    assert capsys.readouterr().out.splitlines() == ["bacteria-0\tfailed", "bacteria-1\tfailed",
+                                                    "bacteria-2\tfailed"]
+
+    assert runner.run("")
+    assert not runner.run("job show bacteria-missing")
+    assert "not found" in capsys.readouterr().err
+    assert not runner.run("job list --no-such-option")
+    assert not runner.run("job show 'unterminated")
+    assert not runner.run("shell")
+    assert runner.run("job -h")
+    assert "usage: smashctl job" in capsys.readouterr().out
+
+
+def test_runner_uses_session_options(db, jobs, mocker):
+    runner = shell.CommandRunner(_args(chunk_size=7), db)
+    execute = mocker.patch("smashctl.shell.execute_command", return_value=True)
+    runner.run("job list")
+    runner.run("job list -q failed")
+    assert [call.args[1].chunk_size for call in execute.call_args_list] == [7, 7]
+    assert all(call.args[2] is db for call in execute.call_args_list)
+
+
+def test_runner_errors(db, jobs, mocker, capsys):
+    runner = shell.CommandRunner(_args(), db)
+    execute = mocker.patch("smashctl.shell.execute_command")
+    assert not runner.run("--db redis://other:6379/1 job list")
+    assert not runner.run("--db=redis://other:6379/1 job list")
+    assert not runner.run("--d redis://other:6379/1 job list")
+    assert "--db can't be changed" in capsys.readouterr().err
+    execute.assert_not_called()
+
+    execute.side_effect = KeyError("state")
+    assert not runner.run("job list")
+    assert "KeyError: 'state'" in capsys.readouterr().err
+    execute.side_effect = KeyboardInterrupt
+    assert not runner.run("job list")
+    assert "command interrupted" in capsys.readouterr().err
+    execute.side_effect = None
+    execute.return_value = True
+    assert runner.run("--chunk-size 5 job list")
+
+
+def test_batch(db, jobs, tmp_path, capsys):
+    script = tmp_path / "remediate.txt"
+    script.write_text("# restart all failed jobs\n"
+                      "job restart --from-queue jobs:failed\n"
+                      "\n"
+                      "job show bacteria-missing\n"
+                      "index rebuild\n")
+
+    db.sadd('index:email:outdated@example.org', 'bacteria-old')
+
+    with pytest.raises(AntismashRunError, match=r"remediate.txt:4: command failed"):
+        shell.batch(_args(file=str(script)), db)
+    assert db.llen('jobs:queued') == 3
+    assert db.exists('index:email:outdated@example.org')
+    assert "Restarted 3 of 3 jobs" in capsys.readouterr().out
+
+    # jobs:failed is empty by now, so the restart fails as well
+    with pytest.raises(AntismashRunError, match="2 of 3 commands failed"):
+        shell.batch(_args(file=str(script), keep_going=True), db)
+    assert not db.exists('index:email:outdated@example.org')
+
+
+def test_batch_missing_file(db, tmp_path):
+    with pytest.raises(AntismashRunError, match="Can't read commands"):
+        shell.batch(_args(file=str(tmp_path / "missing")), db)
+
+
+def test_shell(db, jobs, mocker, capsys):
+    lines = iter(["job list -q failed --fields job_id", "quit", "never run"])
+    mocker.patch("builtins.input", side_effect=lambda prompt: next(lines))
+    shell.shell(_args(), db)
+    assert capsys.readouterr().out.splitlines() == ["bacteria-0", "bacteria-1", "bacteria-2"]
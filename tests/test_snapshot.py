@@ -0,0 +1,100 @@
+"""Tests for the snapshot dump and load"""
+from argparse import Namespace
+from collections import Counter
+import gzip
+import json
+
+from antismash_models import SyncControl as Control, SyncJob as Job, SyncNotice as Notice
+import pytest
+
+from smashctl import snapshot
+from smashctl.common import AntismashRunError
+
+
+def _fill(db):
+    for i in range(5):
+        j = Job(db, f'bacteria-{i}')
+        j.email = f'user{i}@example.org'
+        j.commit()
+        db.rpush('jobs:queued', j.job_id)
+    Control(db, 'dispatcher-1', 5).commit()
+    db.hset('notice:1', mapping={'category': 'info', 'teaser': 'Maintenance'})
+    db.pexpire('notice:1', 600000)
+    db.sadd('index:state:created', 'bacteria-0')
+    db.set('job:lock', 'held')
+
+
+def _read_snapshot(path):
+    with gzip.open(path, 'rt') as handle:
+        return [json.loads(line) for line in handle]
+
+
+def test_dump_records(db):
+    _fill(db)
+    keys = ['jobs:queued', 'job:bacteria-0', 'job:lock', 'job:fake']
+    counts = Counter()
+    records = list(snapshot.dump_records(db, keys, 2, counts))
+    assert [(r['key'], r['offset']) for r in records[:3]] == [('jobs:queued', 0),
+                                                              ('jobs:queued', 2),
+                                                              ('jobs:queued', 4)]
+    assert [r['value'] for r in records[:3]] == [['bacteria-0', 'bacteria-1'],
+                                                 ['bacteria-2', 'bacteria-3'],
+                                                 ['bacteria-4']]
+    assert records[3]['key'] == 'job:bacteria-0'
+    assert records[3]['value']['email'] == 'user0@example.org'
+    assert 'ttl' not in records[3]
+    assert len(records) == 4
+    assert counts == {'list': 1, 'hash': 1, 'skipped': 1}
+
+
+def test_dump_and_load(db, tmp_path):
+    _fill(db)
+    path = str(tmp_path / 'snapshot.jsonl.gz')
+    message = snapshot.dump(Namespace(file=path, format='jsonl', chunk_size=2), db)
+    assert message == (f"Dumped 7 hashes and 1 lists to {path}, "
+                       "skipped 1 keys of other types")
+
+    records = _read_snapshot(path)
+    assert records[0]['snapshot'] == snapshot.SNAPSHOT_VERSION
+    assert not any(r['key'].startswith('index:') for r in records[1:])
+    notice = [r for r in records[1:] if r['key'] == 'notice:1'][0]
+    assert 0 < notice['ttl'] <= 600000
+
+    expected = {key: db.hgetall(key) for key in db.keys('*:*') if db.type(key) == 'hash'}
+    db.flushall()
+    db.rpush('jobs:queued', 'stale')
+
+    message = snapshot.load(Namespace(file=path, chunk_size=3), db)
+    assert message.startswith(f"Loaded 7 hashes and 1 lists from {path}")
+    assert db.lrange('jobs:queued', 0, -1) == [f'bacteria-{i}' for i in range(5)]
+    assert {key: db.hgetall(key) for key in expected} == expected
+    assert Job(db, 'bacteria-3').fetch().email == 'user3@example.org'
+    assert 0 < db.pttl('notice:1') <= 600000
+    assert db.pttl('job:bacteria-0') == -1
+    assert Notice(db, '1').fetch().teaser == 'Maintenance'
+
+
+def test_dump_and_load_msgpack(db, tmp_path):
+    pytest.importorskip('msgpack')
+    _fill(db)
+    path = str(tmp_path / 'snapshot.msgpack.gz')
+    snapshot.dump(Namespace(file=path, format='msgpack', chunk_size=2), db)
+    db.flushall()
+    snapshot.load(Namespace(file=path, chunk_size=2), db)
+    assert db.llen('jobs:queued') == 5
+    assert db.hget('control:dispatcher-1', 'max_jobs') == '5'
+
+
+def test_load_invalid(db, tmp_path):
+    path = tmp_path / 'invalid.gz'
+    with gzip.open(path, 'wt') as handle:
+        handle.write('{"key": "job:1", "type": "hash", "value": {}}\n')
+    with pytest.raises(AntismashRunError, match="not a smashctl snapshot"):
+        snapshot.load(Namespace(file=str(path)), db)
+
+    path.write_bytes(b'not compressed')
+    with pytest.raises(AntismashRunError, match="Can't read snapshot"):
+        snapshot.load(Namespace(file=str(path)), db)
+
+    with pytest.raises(AntismashRunError, match="Can't open snapshot"):
+        snapshot.load(Namespace(file=str(tmp_path / 'missing.gz')), db)
@@ -0,0 +1,69 @@
+"""Tests for the queue and job statistics"""
+from argparse import Namespace
+from datetime import datetime, timedelta, UTC
+import json
+
+from antismash_models import SyncJob as Job
+
+from smashctl import index, stats
+
+
+def _make_jobs(db):
+    now = datetime.now(UTC)
+    for i in range(10):
+        j = Job(db, f'bacteria-{i}')
+        j.state = 'queued' if i < 6 else 'running'
+        j.jobtype = 'antismash8' if i % 2 else 'antismash7'
+        j.dispatcher = 'dispatcher-1' if j.state == 'running' else ''
+        j.added = now - timedelta(minutes=10 * (i + 1))
+        j.commit()
+        db.rpush(f'jobs:{j.state}', j.job_id)
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+    assert stats.percentile(values, 50) == 50
+    assert stats.percentile(values, 99) == 99
+    assert stats.percentile([3.0], 90) == 3
+    assert stats.percentile([], 50) is None
+
+
+def test_stats_full(db):
+    _make_jobs(db)
+
+    result = json.loads(stats.stats(Namespace(sample=0, json=True, chunk_size=3), db))
+    assert result["queues"]["jobs:queued"] == 6
+    assert result["queues"]["jobs:running"] == 4
+    assert result["state"] == {"queued": 6, "running": 4}
+    assert result["jobtype"] == {"antismash7": 5, "antismash8": 5}
+    assert result["dispatcher"] == {"-": 6, "dispatcher-1": 4}
+    assert result["sampled"] == result["total"] == 10
+    assert 25 * 60 < result["queued_age"]["p50"] < 35 * 60
+    assert 55 * 60 < result["queued_age"]["max"] < 65 * 60
+
+    text = stats.stats(Namespace(sample=0, json=False), db)
+    assert "jobs:queued" in text
+    assert "estimated" not in text
+
+
+def test_queue_ages_skips_unparsable(db):
+    _make_jobs(db)
+    db.hset('job:bacteria-0', 'added', 'yesterday')
+    db.hdel('job:bacteria-1', 'added')
+
+    ages = stats.queue_ages(db, 'jobs:queued', datetime.now(UTC).timestamp())
+    assert len(ages) == 4
+    assert ages == sorted(ages)
+
+
+def test_stats_sampled(db):
+    _make_jobs(db)
+    index.rebuild(Namespace(), db)
+
+    result = json.loads(stats.stats(Namespace(sample=5, json=True), db))
+    assert result["sampled"] == 5
+    assert result["total"] == 10
+    assert sum(result["state"].values()) == 10
+
+    text = stats.stats(Namespace(sample=5, json=False), db)
+    assert text.endswith("Job counts estimated from 5 of 10 jobs")
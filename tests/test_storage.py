@@ -1,13 +1,330 @@
 """Storage access abstractions"""
+import asyncio
+
+from antismash_models import AsyncJob, SyncJob as Job
 import pytest
-from smashctl.storage import get_storage, AntismashStorageError
+import redis
+from redis.client import Pipeline
+from smashctl.storage import (
+    AntismashStorageError,
+    JOB_STATES,
+    RetryPolicy,
+    async_fetch_in_batches,
+    chunked,
+    expire_nx,
+    fetch_fields_in_batches,
+    fetch_in_batches,
+    get_async_storage,
+    get_retry_policy,
+    get_storage,
+    iterate_list,
+    move_job,
+    scan_keys,
+)
+
 
+def test_get_storage():
+    storage = get_storage('redis://fake:6379/2')
+    kwargs = storage.connection_pool.connection_kwargs
+    assert kwargs['host'] == 'fake'
+    assert kwargs['db'] == 2
+    assert kwargs['decode_responses']
+    assert get_retry_policy(storage).retries == 0
 
-def test_get_storage(mocker):
-    redis_mock = mocker.patch('redis.Redis')
-    redis_mock.from_url = mocker.MagicMock()
-    get_storage('redis://fake')
-    assert redis_mock.from_url.called_with('redis://fake', encoding='utf-8', decode_responses=True)
+    storage = get_storage('redis://fake', socket_timeout=2.5, socket_connect_timeout=1.0,
+                          health_check_interval=30, max_connections=4, retries=3,
+                          retry_backoff=0.5)
+    kwargs = storage.connection_pool.connection_kwargs
+    assert kwargs['socket_timeout'] == 2.5
+    assert kwargs['socket_connect_timeout'] == 1.0
+    assert kwargs['health_check_interval'] == 30
+    assert storage.connection_pool.max_connections == 4
+    policy = get_retry_policy(storage)
+    assert (policy.retries, policy.backoff) == (3, 0.5)
 
     with pytest.raises(AntismashStorageError):
         get_storage('fake://data')
+
+
+def test_get_storage_url_schemes():
+    storage = get_storage('rediss://:secret@fake:6380/1')
+    assert storage.connection_pool.connection_class is redis.SSLConnection
+    assert storage.connection_pool.connection_kwargs['password'] == 'secret'
+
+    storage = get_storage('unix:///run/redis/redis.sock?db=3', socket_timeout=2.5)
+    assert storage.connection_pool.connection_class is redis.UnixDomainSocketConnection
+    kwargs = storage.connection_pool.connection_kwargs
+    assert kwargs['path'] == '/run/redis/redis.sock'
+    assert (kwargs['db'], kwargs['socket_timeout']) == (3, 2.5)
+    assert kwargs['decode_responses']
+
+
+def test_get_storage_sentinel():
+    storage = get_storage('redis+sentinel://:s%40cret@sentinel-1,sentinel-2:26380/mymaster/2',
+                          socket_timeout=2.5, max_connections=4, retries=2)
+    pool = storage.connection_pool
+    assert isinstance(pool, redis.sentinel.SentinelConnectionPool)
+    assert pool.service_name == 'mymaster'
+    assert pool.max_connections == 4
+    assert pool.connection_kwargs['db'] == 2
+    assert pool.connection_kwargs['password'] == 's@cret'
+    assert pool.connection_kwargs['decode_responses']
+    sentinels = [s.connection_pool.connection_kwargs for s in pool.sentinel_manager.sentinels]
+    assert [(s['host'], s['port']) for s in sentinels] == [('sentinel-1', 26379),
+                                                           ('sentinel-2', 26380)]
+    assert all(s['password'] is None and s['socket_timeout'] == 2.5 for s in sentinels)
+    assert get_retry_policy(storage).retries == 2
+
+    storage = get_async_storage('redis+sentinel://sentinel-1/mymaster')
+    assert isinstance(storage, redis.asyncio.Redis)
+    assert storage.connection_pool.service_name == 'mymaster'
+
+    for uri in ('redis+sentinel://sentinel-1', 'redis+sentinel://sentinel-1/mymaster/db',
+                'redis+sentinel://sentinel-1:port/mymaster'):
+        with pytest.raises(AntismashStorageError):
+            get_storage(uri)
+
+
+def test_get_storage_cluster(mocker):
+    cluster = mocker.patch('redis.RedisCluster')
+    storage = get_storage('redis+cluster://user:pw@node-1:7000,node-2', max_connections=4)
+    assert storage is cluster.return_value
+    kwargs = cluster.call_args.kwargs
+    assert [(node.host, node.port) for node in kwargs['startup_nodes']] == [('node-1', 7000),
+                                                                           ('node-2', 6379)]
+    assert (kwargs['username'], kwargs['password']) == ('user', 'pw')
+    assert kwargs['max_connections'] == 4
+    assert kwargs['decode_responses']
+
+    async_cluster = mocker.patch('redis.asyncio.RedisCluster')
+    assert get_async_storage('redis+cluster://node-1:7000/0') is async_cluster.return_value
+    assert async_cluster.call_args.kwargs['startup_nodes'][0].port == 7000
+
+    with pytest.raises(AntismashStorageError, match="database 0"):
+        get_storage('redis+cluster://node-1:7000/1')
+
+
+def test_scan_keys_cluster(mocker):
+    cluster = mocker.MagicMock(spec=redis.RedisCluster)
+    cluster.scan_iter.return_value = iter(['job:1', 'job:2'])
+    assert list(scan_keys(cluster, 'job:*', 10)) == ['job:1', 'job:2']
+    cluster.scan_iter.assert_called_once_with(match='job:*', count=10)
+    cluster.scan.assert_not_called()
+
+
+def test_cluster_rejects_cross_slot_commands(mocker):
+    cluster = mocker.MagicMock(spec=redis.RedisCluster)
+    with pytest.raises(AntismashStorageError, match="Moving jobs.*Redis Cluster"):
+        move_job(cluster, Job(cluster, 'bacteria-1'), 'jobs:queued', 'jobs:running')
+    cluster.evalsha.assert_not_called()
+    cluster.register_script.assert_not_called()
+
+
+def test_retry_policy(mocker):
+    sleep = mocker.patch('time.sleep')
+    func = mocker.MagicMock(side_effect=[redis.ConnectionError("down"), redis.TimeoutError(), 42])
+    assert RetryPolicy(retries=3, backoff=0.1).call(func) == 42
+    assert func.call_count == 3
+    assert [c.args[0] for c in sleep.call_args_list] == [0.1, 0.2]
+
+    sleep.reset_mock()
+    func = mocker.MagicMock(side_effect=redis.ConnectionError("down"))
+    with pytest.raises(AntismashStorageError, match="after 3 attempts"):
+        RetryPolicy(retries=2, backoff=1, max_backoff=1.5).call(func)
+    assert [c.args[0] for c in sleep.call_args_list] == [1, 1.5]
+
+    # other errors are not retried
+    func = mocker.MagicMock(side_effect=redis.ResponseError("WRONGTYPE"))
+    with pytest.raises(redis.ResponseError):
+        RetryPolicy(retries=2).call(func)
+    assert func.call_count == 1
+
+
+def test_reads_are_retried(db, mocker):
+    mocker.patch('time.sleep')
+    mocker.patch.dict('smashctl.storage._RETRY_POLICIES', {db: RetryPolicy(retries=1)})
+    Job(db, 'bacteria-1').commit()
+    db.rpush('jobs:queued', 'bacteria-1')
+
+    scan = mocker.patch.object(db, 'scan', side_effect=[redis.ConnectionError(), (0, ['job:1'])])
+    assert list(scan_keys(db, 'job:*')) == ['job:1']
+    assert scan.call_args_list[0] == scan.call_args_list[1]
+    mocker.stopall()
+    mocker.patch('time.sleep')
+    mocker.patch.dict('smashctl.storage._RETRY_POLICIES', {db: RetryPolicy(retries=1)})
+
+    execute = Pipeline.execute
+    failures = []
+
+    def flaky_execute(self, *args, **kwargs):
+        if not failures:
+            failures.append(True)
+            self.reset()
+            raise redis.ConnectionError()
+        return execute(self, *args, **kwargs)
+
+    mocker.patch.object(Pipeline, 'execute', flaky_execute)
+    jobs = list(fetch_in_batches(db, lambda job_id: Job(db, job_id), ['bacteria-1']))
+    assert [j.job_id for j in jobs] == ['bacteria-1']
+
+    failures.clear()
+    assert list(fetch_fields_in_batches(db, 'job:{}', ['bacteria-1'], ['state'])) == \
+        [('bacteria-1', ['created'])]
+
+    lrange = mocker.patch.object(db, 'lrange', side_effect=redis.TimeoutError())
+    with pytest.raises(AntismashStorageError):
+        list(iterate_list(db, 'jobs:queued'))
+    assert lrange.call_count == 2
+
+
+def test_job_states_match_models():
+    assert JOB_STATES == tuple(sorted(Job.VALID_STATES))
+
+
+def test_chunked():
+    assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunked([], 2)) == []
+
+    with pytest.raises(ValueError):
+        list(chunked(range(5), 0))
+
+
+def test_fetch_in_batches(db):
+    for job_id in ('bacteria-1', 'bacteria-2', 'bacteria-3'):
+        j = Job(db, job_id)
+        j.email = f"{job_id}@example.org"
+        j.commit()
+
+    job_ids = ['bacteria-1', 'bacteria-fake', 'bacteria-2', 'bacteria-3']
+    jobs = list(fetch_in_batches(db, lambda job_id: Job(db, job_id), job_ids, chunk_size=2))
+
+    assert [j.job_id for j in jobs] == ['bacteria-1', 'bacteria-2', 'bacteria-3']
+    for j in jobs:
+        assert j.email == f"{j.job_id}@example.org"
+        assert j.state == 'created'
+
+
+def test_fetch_in_batches_partial_hash(db):
+    Job(db, 'bacteria-1').commit()
+    db.hset('job:bacteria-partial', 'email', 'alice@example.org')
+    Job(db, 'bacteria-2').commit()
+
+    job_ids = ['bacteria-1', 'bacteria-partial', 'bacteria-2']
+    jobs = list(fetch_in_batches(db, lambda job_id: Job(db, job_id), job_ids, chunk_size=3))
+    assert [j.job_id for j in jobs] == ['bacteria-1', 'bacteria-2']
+
+
+def test_fetch_in_batches_round_trips(db, mocker):
+    for job_id in ('bacteria-1', 'bacteria-2', 'bacteria-3'):
+        Job(db, job_id).commit()
+    pipeline_spy = mocker.spy(db, 'pipeline')
+
+    jobs = list(fetch_in_batches(db, lambda job_id: Job(db, job_id),
+                                 ['bacteria-1', 'bacteria-2', 'bacteria-3'], chunk_size=2))
+    assert len(jobs) == 3
+    assert pipeline_spy.call_count == 2
+
+
+def test_fetch_fields_in_batches(db, mocker):
+    db.hset('job:bacteria-1', mapping={'state': 'queued', 'status': 'long text', 'email': 'a@b.c'})
+    db.hset('job:bacteria-2', mapping={'state': 'running'})
+    pipeline_spy = mocker.spy(db, "pipeline")
+
+    fetched = list(fetch_fields_in_batches(db, "job:{}", ['bacteria-1', 'missing', 'bacteria-2'],
+                                           ['state', 'email'], chunk_size=2))
+    assert fetched == [('bacteria-1', ['queued', 'a@b.c']), ('bacteria-2', ['running', None])]
+    assert pipeline_spy.call_count == 2
+
+    fetched = list(fetch_fields_in_batches(db, "job:{}", ['bacteria-1', 'missing'], []))
+    assert fetched == [('bacteria-1', [])]
+
+
+def test_scan_keys(db):
+    for i in range(25):
+        db.set(f"control:dispatcher-{i}", "fake")
+    db.set("notice:fake", "fake")
+
+    keys = scan_keys(db, "control:*", count=5)
+    assert not isinstance(keys, list)
+    assert sorted(keys) == sorted(f"control:dispatcher-{i}" for i in range(25))
+    assert list(scan_keys(db, "job:*")) == []
+
+
+def test_iterate_list(db, mocker):
+    db.rpush("jobs:queued", *[f"bacteria-{i}" for i in range(5)])
+    lrange_spy = mocker.spy(db, "lrange")
+
+    entries = iterate_list(db, "jobs:queued", window=2)
+    assert next(entries) == "bacteria-0"
+    assert lrange_spy.call_count == 1
+    assert list(entries) == [f"bacteria-{i}" for i in range(1, 5)]
+    assert lrange_spy.call_count == 3
+
+    assert list(iterate_list(db, "jobs:queued", window=2, start=3)) == ["bacteria-3",
+                                                                         "bacteria-4"]
+    assert list(iterate_list(db, "jobs:fake")) == []
+    with pytest.raises(ValueError):
+        list(iterate_list(db, "jobs:queued", window=0))
+
+
+def test_move_job(db, mocker):
+    j = Job(db, 'bacteria-1')
+    j.state = 'running'
+    j.commit()
+    db.rpush('jobs:running', 'bacteria-other', j.job_id)
+    db.rpush('jobs:queued', 'bacteria-queued')
+    register_spy = mocker.spy(db, 'register_script')
+
+    j.state = 'queued'
+    j.status = 'restarted'
+    assert move_job(db, j, 'jobs:running', 'jobs:queued') == 1
+    assert db.lrange('jobs:running', 0, -1) == ['bacteria-other']
+    assert db.lrange('jobs:queued', 0, -1) == ['bacteria-queued', j.job_id]
+    fetched = Job(db, j.job_id).fetch()
+    assert fetched.state == 'queued'
+    assert fetched.status == 'restarted'
+
+    j.state = 'failed'
+    pipe = db.pipeline(transaction=False)
+    move_job(db, j, 'jobs:queued', 'jobs:failed', push_left=True, pipeline=pipe)
+    assert Job(db, j.job_id).fetch().state == 'queued'
+    assert pipe.execute() == [1]
+    assert db.lrange('jobs:queued', 0, -1) == ['bacteria-queued']
+    assert db.lrange('jobs:failed', 0, -1) == [j.job_id]
+    assert Job(db, j.job_id).fetch().state == 'failed'
+
+    # the script is only registered once per connection
+    register_spy.assert_called_once()
+
+
+def test_expire_nx(db):
+    db.set('persistent', 1)
+    db.set('expiring', 1, ex=100)
+    pipe = db.pipeline(transaction=False)
+    for key in ('persistent', 'expiring', 'missing'):
+        expire_nx(db, key, 500, pipe)
+    assert pipe.execute() == [1, 0, 0]
+    assert 100 < db.ttl('persistent') <= 500
+    assert db.ttl('expiring') <= 100
+
+
+def test_get_async_storage():
+    storage = get_async_storage('redis://fake', socket_timeout=2.5, max_connections=4,
+                                retries=3)
+    assert storage.connection_pool.connection_kwargs['socket_timeout'] == 2.5
+    assert storage.connection_pool.connection_kwargs['decode_responses']
+    assert storage.connection_pool.max_connections == 4
+
+    with pytest.raises(AntismashStorageError):
+        get_async_storage('fake://data')
+
+
+def test_async_fetch_in_batches(db, async_db):
+    for job_id in ('bacteria-1', 'bacteria-2', 'bacteria-3'):
+        Job(db, job_id).commit()
+
+    job_ids = ['bacteria-3', 'bacteria-fake', 'bacteria-1', 'bacteria-2']
+    jobs = asyncio.run(async_fetch_in_batches(async_db, lambda job_id: AsyncJob(async_db, job_id),
+                                              job_ids, chunk_size=1, concurrency=2))
+    assert [j.job_id for j in jobs] == ['bacteria-3', 'bacteria-1', 'bacteria-2']
+    assert all(j.state == 'created' for j in jobs)
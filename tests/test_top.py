@@ -0,0 +1,92 @@
+"""Tests for the live cluster overview"""
+from argparse import Namespace
+
+from antismash_models import SyncControl as Control, SyncJob as Job
+
+from smashctl import top
+
+
+def _setup(db):
+    Control(db, "dispatcher-1", 5).commit()
+    for i in range(3):
+        j = Job(db, f"bacteria-{i}")
+        j.state = "running"
+        j.dispatcher = "dispatcher-1"
+        j.commit()
+        db.rpush("jobs:running", j.job_id)
+    db.rpush("jobs:queued", "bacteria-queued")
+
+
+def test_refresh_incremental(db, mocker):
+    _setup(db)
+    fetch_spy = mocker.spy(top, "fetch_in_batches")
+
+    state = top.ClusterState()
+    state.refresh(db, 0.0, chunk_size=2)
+    assert [d.name for d in state.dispatchers] == ["dispatcher-1"]
+    assert state.queue_lengths["jobs:running"] == 3
+    assert state.queue_lengths["jobs:queued"] == 1
+    assert list(state.jobs) == ["bacteria-0", "bacteria-1", "bacteria-2"]
+    assert list(fetch_spy.call_args_list[-1][0][2]) == ["bacteria-0", "bacteria-1", "bacteria-2"]
+
+    # nothing changed, no jobs need to be fetched again
+    state.refresh(db, 1.0)
+    assert list(fetch_spy.call_args_list[-1][0][2]) == []
+
+    j = Job(db, "bacteria-1").fetch()
+    j.status = "running: step 2"
+    j.changed()
+    j.commit()
+    db.lrem("jobs:running", 1, "bacteria-2")
+    db.rpush("jobs:done", "bacteria-2")
+
+    state.refresh(db, 2.0)
+    assert list(fetch_spy.call_args_list[-1][0][2]) == ["bacteria-1"]
+    assert list(state.jobs) == ["bacteria-0", "bacteria-1"]
+    assert state.jobs["bacteria-1"].status == "running: step 2"
+
+
+def test_rates():
+    state = top.ClusterState()
+    assert set(state.rates().values()) == {0.0}
+
+    lengths = {queue: 0 for queue in top.QUEUES}
+    state._history.append((0.0, lengths, 0))
+    state._history.append((30.0, dict(lengths, **{"jobs:done": 4}), 0))
+    rates = state.rates()
+    assert rates["jobs:done"] == 8.0
+    assert rates["jobs:queued"] == 0.0
+
+
+def test_throughput(db):
+    _setup(db)
+    state = top.ClusterState()
+    state.refresh(db, 0.0)
+    assert state.throughput() == 0.0
+
+    # one job finished and one started, the queue length stays the same
+    db.lrem("jobs:running", 1, "bacteria-0")
+    db.rpush("jobs:running", "bacteria-queued")
+    state.refresh(db, 30.0)
+    assert state.rates()["jobs:running"] == 0.0
+    assert state.throughput() == 2.0
+
+    db.lrem("jobs:running", 1, "bacteria-1")
+    db.lrem("jobs:running", 1, "bacteria-2")
+    state.refresh(db, 60.0)
+    assert state.throughput() == 3.0
+
+
+def test_top(db, mocker):
+    _setup(db)
+    mock_sleep = mocker.patch("time.sleep")
+
+    args = Namespace(interval=0.5, iterations=2)
+    frames = list(top.top(args, db))
+    assert len(frames) == 2
+    mock_sleep.assert_called_once_with(0.5)
+    assert "dispatcher-1" in frames[0]
+    assert "   0/5  " in frames[0]
+    assert "Δ/MIN" in frames[0]
+    assert "Throughput: 0.0 jobs/min leaving jobs:running" in frames[0]
+    assert "bacteria-2\tNone\tdispatcher-1" in frames[0]